@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare the database connection profiles
+
+  PYTHONPATH=. python3 benchmarks/bench_db_profiles.py --count 500000
+
+Run it from the top of the source tree, so that scatterbackup is found.
+
+Every profile writes the same FileInfos into a fresh database, the
+read-only profiles are skipped for that, then every profile runs the
+same point lookups, glob and duplicate queries on one database. Drop
+the page cache between runs to see the effect of mmap_size on a cold
+database.
+"""
+
+
+from typing import Callable, Iterator
+
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from scatterbackup.blobinfo import BlobInfo
+from scatterbackup.database import Database, DB_PROFILES
+from scatterbackup.fileinfo import FileInfo
+
+
+def path_of(i: int) -> str:
+    return "/home/user/projects/project{}/src/module{}/file{}.txt".format(i // 10000, i // 100, i)
+
+
+def make_fileinfos(count: int) -> Iterator[FileInfo]:
+    now = int(time.time() * 1000**3)
+    for i in range(count):
+        # the last tenth repeats the content of the first tenth
+        content = i % (count * 9 // 10)
+        data = str(content).encode()
+
+        fileinfo = FileInfo(path_of(i))
+        fileinfo.kind = "file"
+        # equal content has to come with an equal size
+        fileinfo.size = content % 1000
+        fileinfo.mtime = now
+        fileinfo.blob = BlobInfo(fileinfo.size, md5=hashlib.md5(data).hexdigest(), sha1=hashlib.sha1(data).hexdigest())
+        yield fileinfo
+
+
+def bench(name: str, func: Callable[[], int]) -> None:
+    start = time.perf_counter()
+    count = func()
+    duration = time.perf_counter() - start
+    print("  {:30} {:8.2f}s  {:>10} rows".format(name, duration, count))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the database connection profiles")
+    parser.add_argument('-n', '--count', type=int, default=200000,
+                        help="Number of FileInfos in the database")
+    parser.add_argument('-l', '--lookups', type=int, default=10000,
+                        help="Number of point lookups")
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help="Directory for the database files")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmpdir:
+        for profile, pragmas in DB_PROFILES.items():
+            if pragmas["query_only"]:
+                continue
+
+            print("{} write:".format(profile))
+            db = Database(os.path.join(tmpdir, profile + ".sqlite3"), profile=profile)
+            db.init_generation("bench")
+
+            def store(db: Database = db) -> int:
+                db.store_many(make_fileinfos(args.count))
+                db.commit()
+                return args.count
+
+            bench("store_many()", store)
+            del db
+
+        filename = os.path.join(tmpdir, "default.sqlite3")
+        paths = [path_of(random.randrange(args.count)) for _ in range(args.lookups)]
+
+        for profile in DB_PROFILES:
+            print("{} read:".format(profile))
+            db = Database(filename, profile=profile)
+            bench("get_one_by_path()", lambda: sum(db.get_one_by_path(p) is not None
+                                                   for p in paths))
+            bench("get_by_glob()", lambda: sum(1 for _ in db.get_by_glob(
+                "/home/user/projects/project1/*")))
+            bench("get_duplicates()", lambda: sum(len(group) for group in
+                                                  db.get_duplicates("/home/user")))
+            bench("get_all()", lambda: sum(1 for _ in db.get_all()))
+            del db
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF #
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare sb-diffdb against a lookup per file
+
+  PYTHONPATH=. python3 benchmarks/bench_diffdb.py --count 1000000
+
+Two synthetic mirrors /mirror/old and /mirror/new with COUNT files each
+are stored in a fresh database, a few percent of the files differ
+between them. The merge of the two ordered subtrees is timed against
+the previous approach of globbing one tree and looking up every file in
+the other one.
+"""
+
+
+from typing import Callable, Iterator
+
+import argparse
+import contextlib
+import hashlib
+import io
+import os
+import tempfile
+import time
+
+from scatterbackup.blobinfo import BlobInfo
+from scatterbackup.cmd_diffdb import diff
+from scatterbackup.database import Database, SCHEMA_VERSION
+from scatterbackup.fileinfo import FileInfo
+
+
+def relpath_of(i: int) -> str:
+    return "project{}/src/module{}/file{}.txt".format(i // 10000, i // 100, i)
+
+
+def make_fileinfos(root: str, count: int, changed: int) -> Iterator[FileInfo]:
+    now = int(time.time() * 1000**3)
+    for i in range(count):
+        # every 'changed'th file is missing, every other one modified
+        if changed and i % changed == 0 and i % (2 * changed) != 0 and root.endswith("new"):
+            continue
+
+        fileinfo = FileInfo(os.path.join(root, relpath_of(i)))
+        fileinfo.kind = "file"
+        fileinfo.size = i % 1000
+        fileinfo.mtime = now
+        data = str(i).encode()
+        if changed and i % (2 * changed) == 0 and root.endswith("new"):
+            data += b"modified"
+        fileinfo.blob = BlobInfo(fileinfo.size, md5=hashlib.md5(data).hexdigest(), sha1=hashlib.sha1(data).hexdigest())
+        yield fileinfo
+
+
+def diff_lookup(db: Database, oldpath: str, newpath: str) -> None:
+    """The N+1 approach sb-diffdb used before"""
+    for oldfileinfo in db.get_by_glob(os.path.join(oldpath, "*")):
+        path = os.path.relpath(oldfileinfo.path, oldpath)
+        newfileinfo = db.get_one_by_path(os.path.join(newpath, path))
+        if newfileinfo is None:
+            print("removed {}".format(path))
+        elif oldfileinfo.blob != newfileinfo.blob:
+            print("modified {}".format(path))
+
+    for newfileinfo in db.get_by_glob(os.path.join(newpath, "*")):
+        path = os.path.relpath(newfileinfo.path, newpath)
+        if db.get_one_by_path(os.path.join(oldpath, path)) is None:
+            print("added {}".format(path))
+
+
+def bench(name: str, func: Callable[[], None]) -> None:
+    out = io.StringIO()
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(out):
+        func()
+    duration = time.perf_counter() - start
+    print("  {:30} {:8.2f}s  {:>10} differences".format(name, duration, len(out.getvalue().splitlines())))
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark sb-diffdb")
+    parser.add_argument('-n', '--count', type=int, default=200000,
+                        help="Number of files in each subtree")
+    parser.add_argument('--changed', type=int, default=50, metavar="N",
+                        help="Every Nth file differs between the subtrees")
+    parser.add_argument('--schema-version', type=int, default=SCHEMA_VERSION,
+                        help="Database layout to use")
+    parser.add_argument('--skip-lookup', action='store_true', default=False,
+                        help="Don't run the slow lookup per file approach")
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help="Directory for the database file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmpdir:
+        db = Database(os.path.join(tmpdir, "diffdb.sqlite3"), schema_version=args.schema_version,
+                      profile="bulk-write")
+        db.init_generation("bench")
+        for root in ["/mirror/old", "/mirror/new"]:
+            db.store_many(make_fileinfos(root, args.count, args.changed))
+        db.commit()
+
+        db.set_profile("analytics")
+        print("schema version {}, {} files per subtree:".format(db.schema_version, args.count))
+        bench("diff()", lambda: diff(db, "/mirror/old", "/mirror/new", []))
+        bench("diff() with exclude", lambda: diff(db, "/mirror/old", "/mirror/new", ["project1"]))
+        if not args.skip_lookup:
+            bench("lookup per file", lambda: diff_lookup(db, "/mirror/old", "/mirror/new"))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF #
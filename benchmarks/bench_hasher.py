@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare the Hasher with the old read() based checksum loop
+
+  PYTHONPATH=. python3 benchmarks/bench_hasher.py --size 4GiB
+  PYTHONPATH=. python3 benchmarks/bench_hasher.py --file /path/to/large.iso
+"""
+
+
+from typing import Any, Callable
+
+import argparse
+import hashlib
+import os
+import tempfile
+import time
+import zlib
+
+from scatterbackup.hasher import Hasher
+from scatterbackup.units import size2bytes, bytes2human_binary
+
+
+def legacy_hash_file(path: str) -> tuple[int, dict[str, Any]]:
+    """BlobInfo.from_file() before the Hasher was introduced"""
+    size = 0
+    md5 = hashlib.md5()
+    sha1 = hashlib.sha1()
+    crc32 = 0
+    with open(path, 'rb') as fin:
+        data = fin.read(65536)
+        while data:
+            size += len(data)
+            md5.update(data)
+            sha1.update(data)
+            crc32 = zlib.crc32(data, crc32)
+            data = fin.read(65536)
+
+    return (size, {"md5": md5.hexdigest(), "sha1": sha1.hexdigest(), "crc32": crc32})
+
+
+def make_file(directory: str, size: int) -> str:
+    path = os.path.join(directory, "bench_hasher.dat")
+    block = os.urandom(1024 * 1024)
+    with open(path, "wb") as fout:
+        written = 0
+        while written < size:
+            count = min(len(block), size - written)
+            fout.write(block[:count])
+            written += count
+    return path
+
+
+def bench(name: str, func: Callable[[str], tuple[int, dict[str, Any]]], path: str) -> tuple[int, dict[str, Any]]:
+    start = time.perf_counter()
+    result = func(path)
+    duration = time.perf_counter() - start
+    print("{:40} {:8.2f}s  {:>12}/s".format(name, duration, bytes2human_binary(int(result[0] / duration))))
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark checksum calculation")
+    parser.add_argument('-s', '--size', type=size2bytes, default=size2bytes("2GiB"),
+                        help="Size of the generated test file")
+    parser.add_argument('-f', '--file', type=str, default=None,
+                        help="Use FILE instead of generating a test file")
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help="Directory for the generated test file")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmpdir:
+        path = args.file or make_file(tmpdir, args.size)
+        print("{}: {}".format(path, bytes2human_binary(os.path.getsize(path))))
+
+        expected = bench("legacy read(64KiB)", legacy_hash_file, path)
+        for block_size in ["64kiB", "1MiB", "8MiB"]:
+            for threaded in [False, True]:
+                hasher = Hasher(block_size=size2bytes(block_size), threaded=threaded,
+                                digests=["md5", "sha1", "crc32"])
+                result = bench("Hasher(block_size={}, threaded={})".format(block_size, threaded),
+                               hasher.hash_file, path)
+                hasher.close()
+                assert result == expected
+
+        for digests in [["blake2b"], ["blake2b", "sha1", "md5"]]:
+            hasher = Hasher(digests=digests)
+            bench("Hasher(digests={})".format(",".join(digests)), hasher.hash_file, path)
+            hasher.close()
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF #
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Measure the memory used by FileInfo objects loaded from the database
+
+  PYTHONPATH=. python3 benchmarks/bench_memory.py --count 1000000
+  PYTHONPATH=. python3 benchmarks/bench_memory.py --database ~/.local/share/scatterbackup/database1.sqlite3
+"""
+
+
+from typing import Any, Iterator
+
+import argparse
+import hashlib
+import time
+import tracemalloc
+
+from scatterbackup.database import Database, fileinfo_from_row
+
+
+def make_rows(count: int) -> Iterator[list[Any]]:
+    """Rows as returned by 'SELECT * FROM fileinfo LEFT JOIN blobinfo
+    LEFT JOIN linkinfo', with a BlobInfo but no link target"""
+    now = int(time.time() * 1000**3)
+    for i in range(count):
+        data = str(i).encode()
+        path = "/home/user/Documents/projects/project{}/src/module{}/file{}.txt".format(i // 10000, i // 100, i)
+        # sqlite3 returns a new object for every value
+        yield [i, "file", path, 2049, 1000000 + i, 0o100644, 1, 1000, 1000, 0,
+               4096 + i, 4096, 16, now + i, now + i, now + i, now + i, 1, None, i // 100,
+               i, i, 4096 + i,
+               hashlib.md5(data).hexdigest(), hashlib.sha1(data).hexdigest(), None,
+               None, None, None]
+
+
+def load_rows(database: str, count: int) -> Iterator[list[Any]]:
+    db = Database(database)
+    cur = db.con.cursor()
+    cur.execute(db.fileinfo_select + "LIMIT ?", [count])
+    for row in cur:
+        yield list(row)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark memory use of FileInfo")
+    parser.add_argument('-n', '--count', type=int, default=1000000,
+                        help="Number of FileInfos to create")
+    parser.add_argument('-d', '--database', type=str, default=None,
+                        help="Load rows from DATABASE instead of generating them")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    # the rows are created while tracing, only what the FileInfos keep
+    # alive is counted
+    rows = load_rows(args.database, args.count) if args.database else make_rows(args.count)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    start = time.perf_counter()
+
+    fileinfos = [fileinfo_from_row(row) for row in rows]
+
+    duration = time.perf_counter() - start
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    print("{} FileInfos: {:.1f} MiB, {:.0f} bytes per FileInfo, {:.2f}s"
+          .format(len(fileinfos), used / 1024 / 1024, used / max(1, len(fileinfos)), duration))
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF #
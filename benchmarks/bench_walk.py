@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Compare scatterbackup.walk() with the old recursive implementation
+
+  PYTHONPATH=. python3 benchmarks/bench_walk.py --entries 1000000
+  PYTHONPATH=. python3 benchmarks/bench_walk.py --tree /mnt/nfs/some/directory
+
+Listing a generated tree on a local filesystem is mostly served from
+the dentry cache, the benefit of --jobs shows on NFS, CephFS and
+other filesystems where every scandir() is a round trip.
+"""
+
+
+from typing import Any, Callable, Iterator
+
+import argparse
+import os
+import tempfile
+import time
+
+from scatterbackup.walk import walk
+
+
+def legacy_walk(top: str) -> Iterator[tuple[str, list[str], list[str]]]:
+    """The recursive walk() before it was made iterative, topdown only"""
+    dirs = []
+    nondirs = []
+    try:
+        entries = list(os.scandir(top))
+    except OSError:
+        return
+
+    for entry in entries:
+        try:
+            is_dir = entry.is_dir()
+        except OSError:
+            is_dir = False
+
+        try:
+            is_symlink = entry.is_symlink()
+        except OSError:
+            is_symlink = False
+
+        if is_dir and not is_symlink:
+            dirs.append(entry.name)
+        else:
+            nondirs.append(entry.name)
+
+    yield top, dirs, nondirs
+
+    for dirname in dirs:
+        new_path = os.path.join(top, dirname)
+        if not os.path.islink(new_path):
+            yield from legacy_walk(new_path)
+
+
+def make_tree(directory: str, entries: int, fanout: int) -> str:
+    """Create a tree with 'fanout' entries per directory, two levels of
+    directories and files below them"""
+    top = os.path.join(directory, "bench_walk")
+    count = 0
+    i = 0
+    while count < entries:
+        subdir = os.path.join(top, "d{}".format(i // fanout), "d{}".format(i % fanout))
+        os.makedirs(subdir)
+        count += 1
+        for j in range(min(fanout, entries - count)):
+            with open(os.path.join(subdir, "f{}".format(j)), "wb"):
+                pass
+            count += 1
+        i += 1
+    return top
+
+
+def bench(name: str, func: Callable[[], Iterator[Any]]) -> list[Any]:
+    start = time.perf_counter()
+    result = list(func())
+    duration = time.perf_counter() - start
+    count = sum(len(dirs) + len(files) for _, dirs, files in result)
+    print("{:40} {:8.2f}s  {:>10.0f} entries/s".format(name, duration, count / duration))
+    return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark directory walking")
+    parser.add_argument('-n', '--entries', type=int, default=1000000,
+                        help="Number of entries in the generated tree")
+    parser.add_argument('-t', '--tree', type=str, default=None,
+                        help="Walk TREE instead of generating one")
+    parser.add_argument('-d', '--directory', type=str, default=None,
+                        help="Directory for the generated tree")
+    parser.add_argument('-j', '--jobs', type=int, nargs='+', default=[4, 16],
+                        help="Number of threads for the parallel walks")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.directory) as tmpdir:
+        top = args.tree or make_tree(tmpdir, args.entries, 100)
+        print("{}".format(top))
+
+        expected = bench("legacy recursive walk()", lambda: legacy_walk(top))
+        result = bench("walk()", lambda: walk(top))
+        assert result == expected
+        for jobs in args.jobs:
+            result = bench("walk(jobs={})".format(jobs), lambda: walk(top, jobs=jobs))
+            assert result == expected
+
+
+if __name__ == "__main__":
+    main()
+
+
+# EOF #
@@ -18,14 +18,15 @@
 from .fileinfo import FileInfo
 from .blobinfo import BlobInfo
 from .database import Database
-from .walk import walk
+from .walk import walk, walk_entries
 
 
 __all__ = [
     'FileInfo',
     'BlobInfo',
     'Database',
-    'walk'
+    'walk',
+    'walk_entries'
 ]
 
 
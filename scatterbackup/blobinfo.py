@@ -15,62 +15,98 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Optional
+from typing import cast, Optional, Sequence, Union
 
-import hashlib
-import zlib
+from scatterbackup.hasher import get_hasher
+
+
+def to_bytes(digest: Union[str, bytes, None]) -> Optional[bytes]:
+    if digest is None or isinstance(digest, bytes):
+        return digest
+    else:
+        return bytes.fromhex(digest)
+
+
+def to_hex(digest: Optional[bytes]) -> Optional[str]:
+    return None if digest is None else digest.hex()
 
 
 class BlobInfo:
+    """Size and checksums of a file. The digests are kept as bytes, which
+    takes about half the memory of the hex strings, the md5, sha1 and
+    blake2b attributes convert from and to hex on access. The
+    constructor accepts the digests either as hex strings or bytes."""
+
+    __slots__ = ("size", "md5_raw", "sha1_raw", "crc32", "blake2b_raw")
 
     def __init__(self,
                  size: int,
-                 md5: Optional[str] = None,
-                 sha1: Optional[str] = None,
-                 crc32: Optional[int] = None) -> None:
+                 md5: Union[str, bytes, None] = None,
+                 sha1: Union[str, bytes, None] = None,
+                 crc32: Optional[int] = None,
+                 blake2b: Union[str, bytes, None] = None) -> None:
         self.size: int = size
-        self.sha1: Optional[str] = sha1
-        self.md5: Optional[str] = md5
+        self.sha1_raw: Optional[bytes] = to_bytes(sha1)
+        self.md5_raw: Optional[bytes] = to_bytes(md5)
         self.crc32: Optional[int] = crc32
+        self.blake2b_raw: Optional[bytes] = to_bytes(blake2b)
+
+    @property
+    def md5(self) -> Optional[str]:
+        return to_hex(self.md5_raw)
+
+    @md5.setter
+    def md5(self, value: Optional[str]) -> None:
+        self.md5_raw = to_bytes(value)
+
+    @property
+    def sha1(self) -> Optional[str]:
+        return to_hex(self.sha1_raw)
+
+    @sha1.setter
+    def sha1(self, value: Optional[str]) -> None:
+        self.sha1_raw = to_bytes(value)
+
+    @property
+    def blake2b(self) -> Optional[str]:
+        return to_hex(self.blake2b_raw)
+
+    @blake2b.setter
+    def blake2b(self, value: Optional[str]) -> None:
+        self.blake2b_raw = to_bytes(value)
 
     def __eq__(self, other: object) -> bool:
         if not isinstance(other, BlobInfo):
             return False
 
-        sha1_ok = ((self.sha1 is not None and other.sha1 is not None) and
-                   self.sha1 == other.sha1)
-        md5_ok = ((self.md5 is not None and other.md5 is not None) and
-                  self.md5 == other.md5)
+        sha1_ok = ((self.sha1_raw is not None and other.sha1_raw is not None) and
+                   self.sha1_raw == other.sha1_raw)
+        md5_ok = ((self.md5_raw is not None and other.md5_raw is not None) and
+                  self.md5_raw == other.md5_raw)
         crc32_ok = ((self.crc32 is not None and other.crc32 is not None) and
                     self.crc32 == other.crc32)
+        blake2b_ok = ((self.blake2b_raw is not None and other.blake2b_raw is not None) and
+                      self.blake2b_raw == other.blake2b_raw)
 
         return (self.size == other.size and
-                (sha1_ok or md5_ok or crc32_ok))
+                (blake2b_ok or sha1_ok or md5_ok or crc32_ok))
 
-    def is_complete(self) -> bool:
-        return (self.sha1 is not None and
-                self.md5 is not None)
+    def is_complete(self, digests: Sequence[str] = ("md5", "sha1")) -> bool:
+        """Returns True when all of 'digests' are available, crc32 is
+        ignored as it isn't stored in the database"""
+        return all(getattr(self, name + "_raw") is not None
+                   for name in digests
+                   if name != "crc32")
 
     @staticmethod
     def from_file(path: str) -> 'BlobInfo':
-        """Calculate size, md5 and sha1 for a given file"""
-        size = 0
-        md5 = hashlib.md5()
-        sha1 = hashlib.sha1()
-        crc32 = 0
-        with open(path, 'rb') as fin:
-            data = fin.read(65536)
-            while data:
-                size += len(data)
-                md5.update(data)
-                sha1.update(data)
-                crc32 = zlib.crc32(data, crc32)
-                data = fin.read(65536)
-
-        md5_hex = md5.hexdigest()
-        sha1_hex = sha1.hexdigest()
-
-        return BlobInfo(size, md5_hex, sha1_hex, crc32)
+        """Calculate size and the configured digests for a given file"""
+        size, digests = get_hasher().hash_file(path)
+        return BlobInfo(size,
+                        md5=cast(Optional[str], digests.get("md5")),
+                        sha1=cast(Optional[str], digests.get("sha1")),
+                        crc32=cast(Optional[int], digests.get("crc32")),
+                        blake2b=cast(Optional[str], digests.get("blake2b")))
 
 
 # EOF #
@@ -18,16 +18,27 @@
 import logging
 import argparse
 
+import scatterbackup.config
 import scatterbackup.database
 import scatterbackup.sbtr
+import scatterbackup.util
+from scatterbackup.storage import StorageRegistry
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='scatterbackup database tool')
-    parser.add_argument('-d', '--database', metavar='FILE', action='store', type=str, nargs=1,
+    parser.add_argument('-d', '--database', metavar='FILE', action='store', type=str, default=None,
                         help='database file to use')
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(scatterbackup.database.DB_PROFILES),
+                        help="SQLite connection settings, default: bulk-write")
     parser.add_argument('-i', '--import', action='store', type=str, dest="import_file",
                         help='.sbtr file to import')
+    parser.add_argument('--migrate', action='store_true', default=False,
+                        help='convert the database to the current schema version')
+    parser.add_argument('--rebuild-indices', action='store_true', default=False,
+                        help='drop and recreate all indices')
+    parser.add_argument('--rebuild-dirstat', action='store_true', default=False,
+                        help='create or recompute the per-directory totals used by sb-du -s')
     return parser.parse_args()
 
 
@@ -36,14 +47,34 @@ def main() -> None:
 
     args = parse_args()
 
-    db = scatterbackup.database.Database(args.database)
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = scatterbackup.database.Database(args.database or scatterbackup.util.make_default_database(),
+                                         profile=args.db_profile or cfg.get_db_profile("sb-dbtool", "bulk-write"))
+
+    if args.migrate:
+        logging.info("migrating from schema version %d to %d",
+                     db.schema_version, scatterbackup.database.SCHEMA_VERSION)
+        db.migrate()
+
+    if args.rebuild_indices:
+        logging.info("rebuilding indices")
+        db.rebuild_indices()
+
+    if args.rebuild_dirstat:
+        logging.info("rebuilding dirstat")
+        db.rebuild_dirstat()
+        db.commit()
 
     if args.import_file is not None:
         logging.info("loading %s", args.import_file)
         fileinfos = scatterbackup.sbtr.fileinfos_from_sbtr(args.import_file)
         logging.info("%s: %d entries loaded", args.import_file, len(fileinfos))
-        for k, v in fileinfos.items():
-            db.store(v)
+        storage = StorageRegistry(db)
+        for fileinfo in fileinfos.values():
+            storage.assign(fileinfo)
+        db.store_many(fileinfos.values())
         logging.info("database commit")
         db.commit()
 
@@ -15,59 +15,40 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Iterator, Sequence
-
 import argparse
 import os
 
+import scatterbackup.config
 from scatterbackup.util import sb_init, make_default_database
-from scatterbackup.database import Database
-from scatterbackup.fileinfo import FileInfo
-
-
-def path_excluded(path: str, excludes: Sequence[str]) -> bool:
-    for ex in excludes:
-        if path.startswith(ex):
-            return True
-    return False
+from scatterbackup.database import Database, DB_PROFILES
 
 
 def diff(db: Database, oldpath: str, newpath: str, excludes: list[str], verbose: bool = False) -> None:
-    oldglob = os.path.join(oldpath, '*')
-    newglob = os.path.join(newpath, '*')
-
-    oldfileinfos: Iterator[FileInfo] = db.get_by_glob(oldglob)
-
-    for oldfileinfo in oldfileinfos:
-        path = os.path.relpath(oldfileinfo.path, oldpath)
-
-        if path_excluded(path, excludes):
-            if verbose:
-                print("excluded {}".format(path))
-            continue
-
-        newfileinfo = db.get_one_by_path(os.path.join(newpath, path))
-        if newfileinfo is None:
-            print("removed {}".format(path))
+    """Compare the two subtrees with a single ordered scan of each,
+    merged by their relative paths"""
+    olds = db.get_subtree(oldpath, excludes)
+    news = db.get_subtree(newpath, excludes)
+
+    old = next(olds, None)
+    new = next(news, None)
+    while old is not None or new is not None:
+        if new is None or (old is not None and old[0] < new[0]):
+            assert old is not None
+            print("removed {}".format(old[1]))
+            old = next(olds, None)
+        elif old is None or new[0] < old[0]:
+            print("added {}".format(new[1]))
+            new = next(news, None)
         else:
-            if oldfileinfo.blob == newfileinfo.blob:
+            _, path, old_kind, old_content = old
+            _, _, new_kind, new_content = new
+            if old_kind == new_kind and old_content == new_content:
                 if verbose:
                     print("ok {}".format(path))
             else:
                 print("modified {}".format(path))
-
-    newfileinfos = db.get_by_glob(newglob)
-    for newfileinfo in newfileinfos:
-        path = os.path.relpath(newfileinfo.path, newpath)
-
-        if path_excluded(path, excludes):
-            if verbose:
-                print("excluded {}".format(path))
-            continue
-
-        old_fileinfo = db.get_one_by_path(os.path.join(oldpath, path))
-        if old_fileinfo is None:
-            print("added {}".format(path))
+            old = next(olds, None)
+            new = next(news, None)
 
 
 def parse_args() -> argparse.Namespace:
@@ -78,6 +59,8 @@ def parse_args() -> argparse.Namespace:
                         help='new subtree')
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: analytics")
     parser.add_argument('-e', '--exclude', type=str, action='append', default=[],
                         help="Subpath to exclude")
     parser.add_argument('-v', '--verbose', action='store_true', default=False,
@@ -90,11 +73,15 @@ def parse_args() -> argparse.Namespace:
 def main() -> None:
     sb_init()
     args = parse_args()
-    db = Database(args.database or make_default_database(), args.debug_sql)
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = Database(args.database or make_default_database(), args.debug_sql,
+                  profile=args.db_profile or cfg.get_db_profile("sb-diffdb", "analytics"))
     diff(db,
          os.path.abspath(args.OLDPATH[0]),
          os.path.abspath(args.NEWPATH[0]),
-         [os.path.normpath(p) + "/" for p in args.exclude],
+         [os.path.normpath(p) for p in args.exclude],
          args.verbose)
 
 
@@ -15,8 +15,11 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from typing import IO
+
 import argparse
 import os
+import sys
 
 import scatterbackup
 import scatterbackup.database
@@ -31,6 +34,8 @@ def parse_args() -> argparse.Namespace:
                         help='Path to process')
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(scatterbackup.database.DB_PROFILES),
+                        help="SQLite connection settings, default: analytics")
     parser.add_argument('-c', '--config', type=str, default=None,
                         help="Load configuration file")
     parser.add_argument('-s', '--summarize', action='store_true', default=False,
@@ -38,6 +43,34 @@ def parse_args() -> argparse.Namespace:
     return parser.parse_args()
 
 
+def disk_usage(db: scatterbackup.database.Database, path: str, summarize: bool,
+               fout: IO[str] = sys.stdout) -> tuple[int, int]:
+    """Returns the number of regular files and the total bytes of all
+    entries at or below 'path', a directory itself is not included.
+    Without 'summarize' every entry is printed to 'fout'."""
+    # a directory covers everything below it, both ways of
+    # counting have to give the same totals
+    is_directory = db.lookup_directory(path) is not None
+
+    if summarize and is_directory:
+        # answered from the per-directory rollup, without looking
+        # at the individual files
+        dirstat = db.get_dirstat(path)
+        if dirstat is not None:
+            return dirstat.count, dirstat.size
+
+    file_count = 0
+    total_bytes = 0
+    pattern = os.path.join(path, "*") if is_directory else path
+    for fileinfo in db.get_by_glob(pattern):
+        if not summarize:
+            print("{:10}  {}".format(fileinfo.size, fileinfo.path), file=fout)
+        if fileinfo.kind == "file":
+            file_count += 1
+        total_bytes += fileinfo.size or 0
+    return file_count, total_bytes
+
+
 def main() -> None:
     sb_init()
 
@@ -46,19 +79,18 @@ def main() -> None:
     cfg = scatterbackup.config.Config()
     cfg.load(args.config)
 
-    db = scatterbackup.database.Database(args.database or make_default_database())
+    db = scatterbackup.database.Database(args.database or make_default_database(),
+                                         profile=args.db_profile or cfg.get_db_profile("sb-du", "analytics"))
 
     file_count = 0
     total_bytes = 0
     for path in args.PATH:
         path = os.path.abspath(path)
         print(path)
-        for fileinfo in db.get_by_glob(path):
-            if not args.summarize:
-                print("{:10}  {}".format(fileinfo.size, fileinfo.path))
-            file_count += 1
-            assert fileinfo.size is not None
-            total_bytes += fileinfo.size
+
+        count, size = disk_usage(db, path, args.summarize)
+        file_count += count
+        total_bytes += size
 
     print("Total: {} in {} files".format(bytes2human_decimal(total_bytes), file_count))
 
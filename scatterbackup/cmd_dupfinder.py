@@ -15,65 +15,204 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import IO, Optional
+from typing import Any, Callable, Optional
 
-import sys
 import argparse
+import hashlib
+import os
+import shlex
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
+import scatterbackup.config
+import scatterbackup.hasher
+from scatterbackup.blobinfo import BlobInfo
+from scatterbackup.database import Database, DB_PROFILES
 from scatterbackup.fileinfo import FileInfo
 from scatterbackup.generator import generate_fileinfos
+from scatterbackup.hasher import DEFAULT_BLOCK_SIZE
+from scatterbackup.storage import StorageRegistry
 from scatterbackup.units import size2bytes
+from scatterbackup.util import sb_init, make_default_database
 
 
-class DupfinderState:
+# number of bytes read from the start and the end of a file for the
+# sample digest, files up to twice that size are read completely
+SAMPLE_SIZE = 64 * 1024
 
-    def __init__(self, filename: str, fd: IO[bytes]) -> None:
-        self.filename = filename
-        self.fd = fd
-        self.block: Optional[bytes] = None
 
+def full_digest(fileinfo: FileInfo) -> Any:
+    """Returns the sha1 of the complete file content, the checksums
+    are kept in fileinfo.blob and reused when already present"""
+    if fileinfo.blob is None or fileinfo.blob.sha1_raw is None:
+        fileinfo.blob = BlobInfo.from_file(fileinfo.path)
+    return fileinfo.blob.sha1
 
-def find_duplicates_fd(files: list[DupfinderState]) -> list[list[DupfinderState]]:
-    if len(files) == 1:
-        return [files]
 
-    for f in files:
-        f.block = f.fd.read(1024 * 1024)
+def sample_digest(fileinfo: FileInfo) -> Any:
+    """Returns a digest of the head and the tail of the file, small
+    files are read completely and get their full digest"""
+    assert fileinfo.size is not None
+    if fileinfo.size <= 2 * SAMPLE_SIZE:
+        return full_digest(fileinfo)
 
-    groups: list[list[DupfinderState]] = []
-    for f in files:
-        found = False
-        for g in groups:
-            if g[0].block == f.block:
-                g.append(f)
-                found = True
-                break
-        if not found:
-            groups.append([f])
+    with open(fileinfo.path, "rb") as fin:
+        data = fin.read(SAMPLE_SIZE)
+        fin.seek(-SAMPLE_SIZE, os.SEEK_END)
+        data += fin.read(SAMPLE_SIZE)
+    return hashlib.sha1(data).digest()
 
-    ngroups = []
-    for g in groups:
-        if g[0].block == b'':
-            ngroups.append(g)
+
+def split_groups(executor: ThreadPoolExecutor,
+                 groups: list[list[FileInfo]],
+                 key: Callable[[FileInfo], Any],
+                 onerror: Optional[Callable[[OSError], None]] = None) -> list[list[FileInfo]]:
+    """Split every group by 'key', which is calculated on the worker
+    pool, groups with a single member are dropped. Each worker reads
+    one file at a time, so the number of open files is bounded by the
+    size of the pool."""
+    def safe_key(fileinfo: FileInfo) -> Any:
+        try:
+            return key(fileinfo)
+        except OSError as err:
+            if onerror is not None:
+                onerror(err)
+            return None
+
+    fileinfos = [fileinfo for group in groups for fileinfo in group]
+    keys = executor.map(safe_key, fileinfos)
+
+    result = []
+    for group in groups:
+        subgroups: dict[Any, list[FileInfo]] = {}
+        for fileinfo, k in zip(group, keys):
+            if k is not None:
+                subgroups.setdefault(k, []).append(fileinfo)
+        result += [g for g in subgroups.values() if len(g) > 1]
+    return result
+
+
+def group_size(group: list[FileInfo]) -> int:
+    assert group[0].size is not None
+    return group[0].size
+
+
+class DatabaseCache:
+    """Looks up the checksums of files in the database. Checksums are
+    only trusted while size and mtime of the file are the same as
+    when they were recorded. The listing of the last directory is
+    kept, so looking up files in path order is one query per
+    directory."""
+
+    def __init__(self, db: Database) -> None:
+        self.db = db
+        self.directory: Optional[str] = None
+        self.listing: dict[str, FileInfo] = {}
+
+    def lookup(self, fileinfo: FileInfo) -> Optional[FileInfo]:
+        """Returns the alive database row of fileinfo.path"""
+        directory = os.path.dirname(fileinfo.path)
+        if directory != self.directory:
+            self.directory = directory
+            self.listing = {row.path: row for row in self.db.get_directory_by_path(directory)}
+        return self.listing.get(fileinfo.path)
+
+    def __call__(self, fileinfo: FileInfo) -> Optional[BlobInfo]:
+        row = self.lookup(fileinfo)
+        if row is not None and \
+           row.kind == "file" and \
+           row.blob is not None and \
+           row.blob.sha1_raw is not None and \
+           row.size == fileinfo.size and \
+           row.mtime == fileinfo.mtime:
+            return row.blob
         else:
-            # FIXME: This recursion goes over the stack limit on big files
-            ngroups += find_duplicates_fd(g)
+            return None
+
+
+def find_duplicates(fileinfos: list[FileInfo],
+                    jobs: int = 1,
+                    size_only: bool = False,
+                    limit: int = 0,
+                    onerror: Optional[Callable[[OSError], None]] = None,
+                    verbose: bool = False,
+                    cache: Optional[Callable[[FileInfo], Optional[BlobInfo]]] = None) -> list[list[FileInfo]]:
+    """Returns the groups of files in 'fileinfos' with identical content.
+    Files are compared in stages, each one only looking at the groups
+    left over by the previous one: by size, by a digest of a sample of
+    the content and finally by a digest of the full content. Hardlinks
+    of a file that was already seen are ignored. 'cache' is asked for
+    the checksums of every file that survived the size stage, those
+    that it knows aren't read at all. The checksums that were used are
+    left in fileinfo.blob."""
+    by_size: dict[int, list[FileInfo]] = {}
+    inodes: set[tuple[Optional[int], Optional[int]]] = set()
+    for fileinfo in fileinfos:
+        assert fileinfo.size is not None
+        if fileinfo.size < limit:
+            continue
+
+        inode = (fileinfo.dev, fileinfo.ino)
+        if inode in inodes:
+            if verbose:
+                print("hardlink {}".format(fileinfo.path))
+            continue
+        inodes.add(inode)
+
+        by_size.setdefault(fileinfo.size, []).append(fileinfo)
+
+    groups = [g for g in by_size.values() if len(g) > 1]
+    if verbose:
+        for group in groups:
+            print("potential duplicates: {} bytes".format(group[0].size))
+            for fileinfo in group:
+                print("  {}".format(fileinfo.path))
+            print()
+
+    if size_only:
+        return groups
+
+    hits: list[list[FileInfo]] = []
+    if cache is not None:
+        # path order keeps the lookups of one directory together
+        for fileinfo in sorted((fi for g in groups for fi in g), key=lambda fi: fi.path):
+            blob = cache(fileinfo)
+            if blob is not None:
+                fileinfo.blob = blob
+
+        # a sample can't be compared with a cached digest, groups with
+        # cache hits go straight to the full digest
+        hits = [g for g in groups if any(fi.blob is not None for fi in g)]
+        groups = [g for g in groups if all(fi.blob is None for fi in g)]
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        groups = split_groups(executor, groups, sample_digest, onerror)
 
-    return ngroups
+        # the sample already covered the small files completely
+        done = [g for g in groups if group_size(g) <= 2 * SAMPLE_SIZE]
+        todo = [g for g in groups if group_size(g) > 2 * SAMPLE_SIZE]
+        return done + split_groups(executor, hits + todo, full_digest, onerror)
 
 
-def find_duplicates(filenames: list[str]) -> list[list[str]]:
-    fds: list[DupfinderState] = []
-    try:
-        for filename in filenames:
-            fds.append(DupfinderState(filename,
-                                      open(filename, "rb")))
-        groups = find_duplicates_fd(fds)
-        return [[p.filename for p in g] for g in groups]
+def store_checksums(db: Database, cache: DatabaseCache, fileinfos: list[FileInfo]) -> int:
+    """Write the files whose checksums were calculated to the database,
+    rows that are still up to date are left alone. Returns the number
+    of stored files."""
+    storage = StorageRegistry(db)
+    count = 0
+    for fileinfo in sorted(fileinfos, key=lambda fi: fi.path):
+        if fileinfo.blob is None:
+            continue  # never read
 
-    finally:
-        for fd in fds:
-            fd.fd.close()
+        storage.assign(fileinfo)
+        row = cache.lookup(fileinfo)
+        if row is not None:
+            if row == fileinfo:
+                continue
+            db.mark_removed(row)
+        db.store(fileinfo)
+        count += 1
+    return count
 
 
 def parse_args() -> argparse.Namespace:
@@ -88,45 +227,76 @@ def parse_args() -> argparse.Namespace:
                         help="Only compare file size, don't compare actual content")
     parser.add_argument('-l', '--limit', type=size2bytes, default=0, metavar="SIZE",
                         help="Only compare files larger then SIZE")
+    parser.add_argument('-j', '--jobs', type=int, default=4, metavar="N",
+                        help="Read N files in parallel")
+    parser.add_argument('-b', '--block-size', type=size2bytes, default=DEFAULT_BLOCK_SIZE, metavar="SIZE",
+                        help="Read files in blocks of SIZE when calculating checksums")
+    parser.add_argument('--cache', action='store_true', default=False,
+                        help="Reuse the checksums from the database for files whose size and mtime didn't change")
+    parser.add_argument('--store', action='store_true', default=False,
+                        help="Write the calculated checksums to the database in a new generation, implies --cache")
+    parser.add_argument('-d', '--database', type=str, default=None,
+                        help="Use database FILE")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read, with --store: default")
+    parser.add_argument('-c', '--config', type=str, default=None,
+                        help="Load configuration file")
+    parser.add_argument('--debug-sql', action='store_true', default=False,
+                        help="Debug SQL queries")
     return parser.parse_args()
 
 
 def main() -> None:
-    # FIXME: this is a hack, see find_duplicates_fd() above
-    sys.setrecursionlimit(10000)
+    sb_init()
 
     args = parse_args()
 
+    cfg = scatterbackup.config.Config()
+    cfg.load(args.config)
+
+    if args.store:
+        # stored checksums have to be complete for sb-update to reuse them
+        digests = cfg.digests if "sha1" in cfg.digests else cfg.digests + ["sha1"]
+    else:
+        digests = ["sha1"]
+    scatterbackup.hasher.configure(block_size=args.block_size, digests=digests)
+
+    db: Optional[Database] = None
+    cache: Optional[DatabaseCache] = None
+    if args.cache or args.store:
+        default_profile = "default" if args.store else "interactive-read"
+        db = Database(args.database or make_default_database(), args.debug_sql,
+                      profile=args.db_profile or cfg.get_db_profile("sb-dupfinder", default_profile))
+        cache = DatabaseCache(db)
+
+    def onerror(err: OSError) -> None:
+        if not args.quiet:
+            print("{}: {}".format(sys.argv[0], err), file=sys.stderr)
+
     fileinfos = []
     for path in args.FILES:
-        for fileinfo in generate_fileinfos(path, relative=False, prefix=None, checksums=False):
+        for fileinfo in generate_fileinfos(path, relative=False, prefix=None, onerror=onerror, checksums=False):
             if fileinfo.kind == "file":
                 fileinfos.append(fileinfo)
             else:
                 pass  # ignore non-files
 
-    fileinfos_by_size: dict[int, list[FileInfo]] = {}
-    for fileinfo in fileinfos:
-        if fileinfo.size not in fileinfos_by_size:
-            assert fileinfo.size is not None
-            fileinfos_by_size[fileinfo.size] = []
-        fileinfos_by_size[fileinfo.size].append(fileinfo)
-
-    for size, fileinfos in fileinfos_by_size.items():
-        if len(fileinfos) > 1 and size >= args.limit:
-            if args.verbose:
-                print("potential duplicates: {} bytes".format(size))
-                for fileinfo in fileinfos:
-                    print("  {}".format(fileinfo.path))
-                print()
-
-            groups = find_duplicates([p.path for p in fileinfos])
-            for g in groups:
-                if len(g) > 1:
-                    print("duplicates:")
-                    for f in g:
-                        print("  {}".format(f))
-                    print()
+    groups = find_duplicates(fileinfos, jobs=args.jobs, size_only=args.size_only, limit=args.limit,
+                             onerror=onerror, verbose=args.verbose, cache=cache)
+    for g in groups:
+        print("duplicates:")
+        for f in g:
+            print("  {}".format(f.path))
+        print()
+
+    if args.store:
+        assert db is not None and cache is not None
+        gen = db.init_generation(" ".join([shlex.quote(a) for a in sys.argv]))
+        count = store_checksums(db, cache, fileinfos)
+        db.deinit_generation(gen)
+        db.commit()
+        if args.verbose:
+            print("stored checksums of {} files".format(count))
 
 
 # EOF #
@@ -20,7 +20,9 @@ import os
 
 import scatterbackup
 import scatterbackup.util
-from scatterbackup.database import Database
+import scatterbackup.config
+from scatterbackup.database import Database, DB_PROFILES
+from scatterbackup.units import bytes2human_decimal, size2bytes
 
 
 def parse_args() -> argparse.Namespace:
@@ -29,15 +31,55 @@ def parse_args() -> argparse.Namespace:
                         help='directory containing the filese')
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: analytics")
+    parser.add_argument('-r', '--ranked', action='store_true', default=False,
+                        help="Sort by the number of bytes that removing the duplicates would free")
+    parser.add_argument('--min-size', type=size2bytes, default=0, metavar="SIZE",
+                        help="Ignore files smaller than SIZE, implies --ranked")
+    parser.add_argument('--top', type=int, default=0, metavar="N",
+                        help="Only show the N groups wasting the most space, implies --ranked")
+    parser.add_argument('--min-wasted', type=size2bytes, default=0, metavar="SIZE",
+                        help="Only show groups wasting at least SIZE, implies --ranked")
     return parser.parse_args()
 
 
+def print_ranked(db: Database, path: str, min_size: int, min_wasted: int, top: int) -> None:
+    total = 0
+    for i, group in enumerate(db.get_ranked_duplicates(path, min_size=min_size, min_wasted=min_wasted, top=top)):
+        if i != 0:
+            print()
+        print("{} wasted, {} files of {}".format(bytes2human_decimal(group.wasted),
+                                                  len(group.fileinfos),
+                                                  bytes2human_decimal(group.blob.size)))
+
+        inodes = set()
+        for fileinfo in group.fileinfos:
+            inode = (fileinfo.dev, fileinfo.ino)
+            print("{}  {}{}".format(group.blob.sha1, fileinfo.path,
+                                    "  (hardlink)" if inode in inodes else ""))
+            inodes.add(inode)
+        total += group.wasted
+
+    print()
+    print("Total: {} wasted".format(bytes2human_decimal(total)))
+
+
 def main() -> None:
     scatterbackup.util.sb_init()
 
     args = parse_args()
-    db = Database(args.database or scatterbackup.util.make_default_database())
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = Database(args.database or scatterbackup.util.make_default_database(),
+                  profile=args.db_profile or cfg.get_db_profile("sb-dupfinderdb", "analytics"))
     path = os.path.abspath(args.DIRECTORY[0])
+
+    if args.ranked or args.min_size or args.top or args.min_wasted:
+        print_ranked(db, path, args.min_size, args.min_wasted, args.top)
+        return
+
     duplicates = db.get_duplicates(path)
 
     for i, dups in enumerate(duplicates):
@@ -47,4 +89,5 @@ def main() -> None:
             assert fileinfo.blob is not None
             print("{}  {}".format(fileinfo.blob.sha1, fileinfo.path))
 
+
 # EOF #
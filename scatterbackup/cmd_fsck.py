@@ -17,14 +17,17 @@
 
 import argparse
 import scatterbackup.util
+import scatterbackup.config
 from scatterbackup.util import sb_init
-from scatterbackup.database import Database
+from scatterbackup.database import Database, DB_PROFILES
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Compare two .sbtr files')
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: bulk-write")
     parser.add_argument('-v', '--verbose', action='store_true', default=False,
                         help="Be more verbose")
     parser.add_argument('--rebuild-directory-table', action='store_true', default=False,
@@ -41,7 +44,11 @@ def parse_args() -> argparse.Namespace:
 def main() -> None:
     sb_init()
     args = parse_args()
-    db = Database(args.database or scatterbackup.util.make_default_database())
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = Database(args.database or scatterbackup.util.make_default_database(),
+                  profile=args.db_profile or cfg.get_db_profile("sb-fsck", "bulk-write"))
 
     db_changed = False
     if args.rebuild_directory_table:
@@ -15,6 +15,8 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from typing import cast
+
 import argparse
 import os
 import sys
@@ -22,7 +24,9 @@ import shlex
 
 import scatterbackup
 import scatterbackup.util
-from scatterbackup.database import Database
+import scatterbackup.config
+from scatterbackup.database import Database, DB_PROFILES
+from scatterbackup.blobinfo import BlobInfo
 from scatterbackup.fileinfo import FileInfo
 
 
@@ -30,63 +34,59 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Check if file is in backup')
     parser.add_argument('FILE', action='store', type=str, nargs='+',
                         help='Files to check')
-    parser.add_argument('-b', '--backup', type=str, default=[], action='append',
-                        help="Directory that is considered backup")
+    parser.add_argument('-b', '--backup', type=str, required=True, action='append',
+                        help="Directory that is considered backup, can be given multiple times")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read")
     return parser.parse_args()
 
 
-def fileinfos_from_path(db: Database, path: str) -> list[FileInfo]:
-    fileinfos: list[FileInfo] = []
-
-    if not os.path.isdir(path):
-        print("{}: warning: not a directory, ignoring".format(path), file=sys.stderr)
-
-    for root, dirs, files in os.walk(path):
-        for f in files:
-            result = list(db.get_by_path(os.path.join(root, f)))
-            if result == []:
-                print("{}: warning: not in database, ignoring".format(f), file=sys.stderr)
-            fileinfos += result
-
-    return fileinfos
-
+def in_backup(db: Database, fileinfos: list[FileInfo], backups: list[str]) -> set[int]:
+    """Returns the indices of the 'fileinfos' that have a copy below the
+    directories 'backups', all looked up in batches"""
+    indices = [i for i, fileinfo in enumerate(fileinfos) if fileinfo.blob is not None]
+    blobs = [cast(BlobInfo, fileinfos[i].blob) for i in indices]
 
-def is_in_backup(fileinfo: FileInfo, backup: list[FileInfo]) -> None:
-    found = False
-    for b in backup:
-        assert b.blob is not None
-        assert fileinfo.blob is not None
-        if b.blob.sha1 == fileinfo.blob.sha1:
-            print("mv -vi {} {}".format(shlex.quote(fileinfo.path), "dup/"))
+    found: set[int] = set()
+    for index, b in db.get_by_blobs(blobs, backups):
+        fileinfo = fileinfos[indices[index]]
+        if b.path != fileinfo.path:
             # print("INBACKUP: {} -> {}".format(fileinfo.path, b.path))
-            found = True
-
-    if not found:
-        print("NOTINBACKUP: {}".format(fileinfo.path))
+            found.add(indices[index])
+    return found
 
 
 def main() -> None:
     scatterbackup.util.sb_init()
 
     args = parse_args()
-    db = Database(args.database or scatterbackup.util.make_default_database())
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = Database(args.database or scatterbackup.util.make_default_database(),
+                  profile=args.db_profile or cfg.get_db_profile("sb-inbackup", "interactive-read"))
+
+    backups = [os.path.abspath(p) for p in args.backup]
+    for backup in backups:
+        if db.lookup_directory(backup) is None:
+            print("{}: warning: not a directory in database, ignoring".format(backup), file=sys.stderr)
 
-    files = [os.path.abspath(p) for p in args.FILE]
     fileinfos: list[FileInfo] = []
-    for f in files:
-        result = list(db.get_by_path(f))
-        if result == []:
+    for f in args.FILE:
+        fileinfo = db.get_one_by_path(os.path.abspath(f))
+        if fileinfo is None:
             print("{}: warning: not in database, ignoring".format(f), file=sys.stderr)
-        fileinfos += result
-
-    backup_fileinfos: list[FileInfo] = []
-    for p in args.backup:
-        backup_fileinfos += fileinfos_from_path(db, os.path.abspath(p))
+        else:
+            fileinfos.append(fileinfo)
 
-    for f in fileinfos:
-        is_in_backup(f, backup_fileinfos)
+    found = in_backup(db, fileinfos, backups)
+    for i, fileinfo in enumerate(fileinfos):
+        if i in found:
+            print("mv -vi {} {}".format(shlex.quote(fileinfo.path), "dup/"))
+        else:
+            print("NOTINBACKUP: {}".format(fileinfo.path))
 
 
 # EOF #
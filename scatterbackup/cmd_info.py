@@ -18,7 +18,7 @@
 import argparse
 
 from scatterbackup.util import sb_init
-from scatterbackup.database import Database
+from scatterbackup.database import Database, DB_PROFILES
 import scatterbackup.config
 import scatterbackup.util
 
@@ -29,6 +29,8 @@ def parse_args() -> argparse.Namespace:
                         help="be more verbose")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read")
     parser.add_argument('-c', '--config', type=str, default=None,
                         help="Load configuration file")
     return parser.parse_args()
@@ -42,7 +44,8 @@ def main() -> None:
     cfg = scatterbackup.config.Config()
     cfg.load(args.config)
 
-    db = Database(args.database or scatterbackup.util.make_default_database())
+    db = Database(args.database or scatterbackup.util.make_default_database(),
+                  profile=args.db_profile or cfg.get_db_profile("sb-info", "interactive-read"))
 
     db.print_info()
 
@@ -15,11 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import cast, Any, Callable, Sequence
+from typing import cast, Any, Callable, Iterable, Iterator, Optional, Sequence
 
 import os
 import argparse
 import datetime
+import heapq
 import logging
 import itertools
 from collections import defaultdict
@@ -28,7 +29,7 @@ import scatterbackup.util
 import scatterbackup.config
 import scatterbackup.database
 import scatterbackup.time
-from scatterbackup.database import Database
+from scatterbackup.database import Database, IDatabase, DB_PROFILES
 from scatterbackup.fileinfo import FileInfo
 from scatterbackup.format import Time, Bytes
 from scatterbackup.generation import GenerationRange
@@ -47,6 +48,8 @@ def parse_args() -> argparse.Namespace:
                         help="be less verbose")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read")
     parser.add_argument('-c', '--config', type=str, default=None,
                         help="Load configuration file")
     parser.add_argument('-r', '--recursive', type=str, default=None,
@@ -133,16 +136,26 @@ def gather_changed(fileinfos: Sequence[FileInfo]) -> tuple[list[tuple[FileInfo,
     return results, [fi[0] for fi in rest]
 
 
+# FileInfos by their move_key()
+MoveCandidates = dict[tuple[Any, ...], list[FileInfo]]
+
+
+def move_key(fi: FileInfo) -> tuple[Any, ...]:
+    """A move keeps the inode and the mtime, an inode number that was
+    reused for a new file comes with a new mtime"""
+    return (fi.dev, fi.ino, fi.kind, fi.mtime)
+
+
 def gather_renamed(fileinfos: Sequence[FileInfo]) -> tuple[list[tuple[FileInfo, FileInfo]], list[FileInfo]]:
-    by_ino = defaultdict(list)
+    by_inode = defaultdict(list)
     for fi in fileinfos:
-        by_ino[fi.ino].append(fi)
+        by_inode[move_key(fi)].append(fi)
 
     renamed: list[list[FileInfo]]
     rest: list[list[FileInfo]]
     renamed, rest = split(cast(Callable[[list[FileInfo]], bool],
                                lambda fs: len(fs) != 1),
-                          list(by_ino.values()))
+                          list(by_inode.values()))
 
     results: list[tuple[FileInfo, FileInfo]] = []
     for group in renamed:
@@ -153,14 +166,62 @@ def gather_renamed(fileinfos: Sequence[FileInfo]) -> tuple[list[tuple[FileInfo,
     return results, [fi[0] for fi in rest]
 
 
+def find_move_candidates(db: IDatabase, fileinfos: Sequence[FileInfo],
+                         gen_range: GenerationRange) -> MoveCandidates:
+    """Look up the FileInfos that share an inode with one of 'fileinfos'
+    and were added or deleted in 'gen_range', for all generations in a
+    single batch, by their move_key()"""
+    grange = GenerationRange(gen_range.start, gen_range.end, GenerationRange.INCLUDE_CHANGED)
+
+    candidates: MoveCandidates = defaultdict(list)
+    for candidate in db.get_by_inodes([(fi.dev, fi.ino) for fi in fileinfos
+                                       if fi.dev is not None and fi.ino is not None],
+                                      grange):
+        candidates[move_key(candidate)].append(candidate)
+    return candidates
+
+
+def gather_moved(candidates: MoveCandidates, fileinfos: Sequence[FileInfo],
+                 gen: int) -> tuple[list[tuple[FileInfo, FileInfo]], list[FileInfo]]:
+    """Find the other end of moves that crossed the boundary of the
+    logged paths among the 'candidates' of the files that were added or
+    deleted in 'gen'"""
+    results: list[tuple[FileInfo, FileInfo]] = []
+    rest: list[FileInfo] = []
+    for fi in fileinfos:
+        added = fi.birth == gen
+
+        other = None
+        for candidate in candidates.get(move_key(fi), []):
+            if candidate.path != fi.path and \
+               (candidate.death == gen if added else candidate.birth == gen):
+                other = candidate
+                break
+
+        if other is None:
+            rest.append(fi)
+        elif added:
+            results.append((other, fi))
+        else:
+            results.append((fi, other))
+
+    return results, rest
+
+
 def gather_added_deleted(fileinfos: Sequence[FileInfo], gen: int) -> tuple[list[FileInfo], list[FileInfo]]:
     return split(cast(Callable[[FileInfo], bool], lambda fs: fs.birth == gen),
                  fileinfos)
 
 
-def build_report(fileinfos: Sequence[FileInfo], gen: int) -> list[tuple[str, Any]]:
+def build_report(fileinfos: Sequence[FileInfo], gen: int,
+                 candidates: Optional[MoveCandidates] = None) -> list[tuple[str, Any]]:
+    """With the 'candidates' from find_move_candidates() moves from or
+    to paths outside of 'fileinfos' are reported as renames too"""
     changed, fileinfos = gather_changed(fileinfos)
     renamed, fileinfos = gather_renamed(fileinfos)
+    if candidates is not None:
+        moved, fileinfos = gather_moved(candidates, fileinfos, gen)
+        renamed += moved
     added, deleted = gather_added_deleted(fileinfos, gen)
 
     report = itertools.chain(
@@ -219,32 +280,58 @@ def path_to_glob(path: str) -> str:
         return path
 
 
-def process_path(db: Database, args: argparse.Namespace, paths: list[str], gen_range: GenerationRange) -> None:
-    path_globs = [path_to_glob(os.path.abspath(path)) for path in paths]
-
+def bucket_by_generation(fileinfos: Iterable[FileInfo],
+                         gen_range: GenerationRange) -> Iterator[tuple[int, list[FileInfo]]]:
+    """Returns (generation, fileinfos) for every generation in
+    'gen_range' that a FileInfo was born or died in. 'fileinfos' must
+    be ordered by the first generation in 'gen_range' they were born
+    or died in, as returned by Database.get_changed_by_glob(), so a
+    generation is complete as soon as a later one shows up."""
     assert gen_range.start is not None
     assert gen_range.end is not None
-    for gen in range(gen_range.start, gen_range.end):
-        grange = GenerationRange(gen, gen+1, GenerationRange.INCLUDE_CHANGED)
 
-        generation = db.get_generations(grange)[0]
+    buckets: defaultdict[int, list[FileInfo]] = defaultdict(list)
+    heap: list[int] = []
+    for fi in fileinfos:
+        gens = sorted({gen for gen in (fi.birth, fi.death)
+                       if gen is not None and gen_range.start <= gen < gen_range.end})
 
-        fileinfos = list(db.get_by_glob(path_globs, grange))
+        while heap != [] and heap[0] < gens[0]:
+            gen = heapq.heappop(heap)
+            yield gen, buckets.pop(gen)
 
-        # TODO: filter directory entries by default, might be a good
-        # idea to make this an option
-        fileinfos = [fi for fi in fileinfos if fi.kind != "directory"]
+        for gen in gens:
+            if gen not in buckets:
+                heapq.heappush(heap, gen)
+            buckets[gen].append(fi)
 
-        if fileinfos == []:
-            pass
-        else:
-            print("\n-- generation {}: [{} - {}] - {}"
-                  .format(gen,
-                          Time(generation.start_time),
-                          Time(generation.end_time),
-                          generation.command))
-            report = build_report(fileinfos, gen)
-            print_report(report)
+    while heap != []:
+        gen = heapq.heappop(heap)
+        yield gen, buckets.pop(gen)
+
+
+def process_path(db: Database, args: argparse.Namespace, paths: list[str], gen_range: GenerationRange) -> None:
+    path_globs = [path_to_glob(os.path.abspath(path)) for path in paths]
+
+    generations = {generation.generation: generation for generation in db.get_generations(gen_range)}
+
+    # TODO: filter directory entries by default, might be a good
+    # idea to make this an option
+    fileinfos = [fi for fi in db.get_changed_by_glob(path_globs, gen_range) if fi.kind != "directory"]
+
+    # the other ends of moves for all generations with one batch of
+    # queries, not one per generation
+    candidates = find_move_candidates(db, fileinfos, gen_range)
+
+    for gen, group in bucket_by_generation(fileinfos, gen_range):
+        generation = generations[gen]
+        print("\n-- generation {}: [{} - {}] - {}"
+              .format(gen,
+                      Time(generation.start_time),
+                      Time(generation.end_time),
+                      generation.command))
+        report = build_report(group, gen, candidates)
+        print_report(report)
 
 
 def print_generations(db: Database, args: argparse.Namespace, gen_range: GenerationRange) -> None:
@@ -267,7 +354,8 @@ def main() -> None:
     cfg = scatterbackup.config.Config()
     cfg.load(args.config)
 
-    db = scatterbackup.database.Database(args.database or scatterbackup.util.make_default_database())
+    db = scatterbackup.database.Database(args.database or scatterbackup.util.make_default_database(),
+                                         profile=args.db_profile or cfg.get_db_profile("sb-log", "interactive-read"))
 
     dbrange = db.get_generations_range()
     gen_range = GenerationRange.from_string(args.generation, dbrange)
@@ -21,9 +21,11 @@ import argparse
 import sys
 
 import scatterbackup
-from scatterbackup.database import Database
+import scatterbackup.config
+from scatterbackup.database import Database, DB_PROFILES
 from scatterbackup.generator import generate_fileinfos
 from scatterbackup.fileinfo import FileInfo
+from scatterbackup.storage import StorageRegistry
 
 
 def on_report(fileinfo: FileInfo, fout: IO[str] = sys.stdout) -> None:
@@ -69,6 +71,8 @@ def main() -> None:
                         help="Set the host name to None")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: bulk-write")
     parser.add_argument('-o', '--output', type=str, default=None,
                         help="Set the output filename")
     args = parser.parse_args()
@@ -84,10 +88,17 @@ def main() -> None:
 
     db: Optional[Database] = None
     if args.database is not None:
-        db = scatterbackup.Database(args.database)
+        cfg = scatterbackup.config.Config()
+        cfg.load()
+
+        db = scatterbackup.Database(args.database,
+                                    profile=args.db_profile or cfg.get_db_profile("sb-maketree", "bulk-write"))
+
+        storage = StorageRegistry(db)
 
         def on_report_with_database(fileinfo: FileInfo) -> None:
             assert db is not None
+            storage.assign(fileinfo)
             db.store(fileinfo)
 
         on_report_cb = on_report_with_database
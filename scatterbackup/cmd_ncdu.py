@@ -15,7 +15,7 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Any, Sequence
+from typing import Any, Iterator, Optional, TextIO
 
 import argparse
 import json
@@ -23,10 +23,10 @@ import os
 import sys
 import time
 import subprocess
-import tempfile
 
+import scatterbackup.config
 from scatterbackup.util import sb_init, make_default_database
-from scatterbackup.database import Database
+from scatterbackup.database import Database, DB_PROFILES
 from scatterbackup.fileinfo import FileInfo
 
 # st_dev is included when it changes
@@ -41,22 +41,20 @@ from scatterbackup.fileinfo import FileInfo
 
 
 NcduFileNode = dict[str, Any]
-NcduDirNode = list[Any]
-NcduRoot = list[Any]
 
 
-def ncdu_directory(node: FileInfo) -> NcduDirNode:
-    return [{"name": os.path.basename(node.path),
-             "asize": 0,
-             "dev": node.dev,
-             "ino": node.ino}]
+def ncdu_directory(node: FileInfo) -> NcduFileNode:
+    return {"name": os.path.basename(node.path),
+            "asize": 0,
+            "dev": node.dev,
+            "ino": node.ino}
 
 
-def ncdu_fake_directory(name: str) -> NcduDirNode:
-    return [{"name": os.path.basename(name) or "/",
-             "asize": 0,
-             "dev": 0,
-             "ino": 0}]
+def ncdu_fake_directory(name: str) -> NcduFileNode:
+    return {"name": os.path.basename(name) or "/",
+            "asize": 0,
+            "dev": 0,
+            "ino": 0}
 
 
 def ncdu_file(node: FileInfo) -> NcduFileNode:
@@ -72,114 +70,108 @@ def ncdu_file(node: FileInfo) -> NcduFileNode:
                 "notreg": True}
 
 
-def ncdu_from_fileinfos_with_header(fileinfos: Sequence[FileInfo]) -> NcduRoot:
-    return [1, 0,
-            {"progname": "scatterbackup",
-             "progver": "1.10",
-             "timestamp": int(time.time())},
-            ncdu_from_fileinfos(fileinfos)]
-
-
-def build_hierachy(directories: dict[str, NcduDirNode]) -> None:
-    nodes_without_parent = list(directories.items())
-
-    while nodes_without_parent != []:
-        dname, node = nodes_without_parent.pop()
-
-        parent_dname = os.path.dirname(dname)
-
-        if parent_dname == dname:
-            pass
+def ncdu_header() -> NcduFileNode:
+    return {"progname": "scatterbackup",
+            "progver": "1.10",
+            "timestamp": int(time.time())}
+
+
+def ncdu_children(db: Database, path: str) -> Iterator[tuple[str, Optional[FileInfo]]]:
+    """Yields the alive entries of the directory 'path', followed by the
+    subdirectories that have alive content, but no alive entry of their
+    own, as (path, None)"""
+    subdirs: set[str] = set()
+    for fileinfo in db.get_directory_by_path(path):
+        if fileinfo.path == path:
+            continue  # the root directory is stored inside itself
+
+        if fileinfo.kind == "directory":
+            subdirs.add(fileinfo.path)
+        yield fileinfo.path, fileinfo
+
+    for child in db.get_child_directories(path):
+        if child not in subdirs:
+            # the directory table never shrinks, skip what was removed
+            dirstat = db.get_dirstat(child)
+            if dirstat is not None:
+                if dirstat.size or dirstat.count:
+                    yield child, None
+            elif db.has_alive_below(child):
+                yield child, None
+
+
+def write_ncdu(db: Database, path: str, fout: TextIO) -> None:
+    """Write the tree below the directory 'path' as ncdu JSON to 'fout'.
+    The tree is walked depth-first along the directory table, only the
+    listings of the directories leading to the current one are open, so
+    memory use depends on the depth of the tree, not on its size."""
+    root = db.get_one_by_path(path)
+    root_node = ncdu_directory(root) if root is not None else ncdu_fake_directory(path)
+    root_node["name"] = path
+
+    fout.write("[1,0,")
+    json.dump(ncdu_header(), fout)
+    fout.write(",[")
+    json.dump(root_node, fout)
+
+    stack = [ncdu_children(db, path)]
+    while stack != []:
+        child, fileinfo = next(stack[-1], (None, None))
+        if child is None:
+            fout.write("]")
+            stack.pop()
+        elif fileinfo is None or fileinfo.kind == "directory":
+            fout.write(",[")
+            json.dump(ncdu_directory(fileinfo) if fileinfo is not None else ncdu_fake_directory(child), fout)
+            stack.append(ncdu_children(db, child))
         else:
-            parent_node = directories.get(parent_dname)
-
-            if parent_node is None:
-                parent_node = ncdu_fake_directory(parent_dname)
-                nodes_without_parent.append((parent_dname, parent_node))
-                directories[parent_dname] = parent_node
-
-            parent_node.append(node)
-
-
-def get_node_or_fake(directories: dict[str, NcduDirNode], dname: str) -> NcduDirNode:
-    node = directories.get(dname)
-
-    if node is not None:
-        return node
-    else:
-        node = ncdu_fake_directory(dname)
-        directories[dname] = node
-        return node
+            fout.write(",")
+            json.dump(ncdu_file(fileinfo), fout)
 
-
-def collapse_empty_dirs(directories: dict[str, NcduDirNode]) -> NcduDirNode:
-    dname = "/"
-    node = directories[dname]
-
-    while len(node) == 2 and isinstance(node[1], list) and node[1] != []:
-        dname = os.path.join(dname, node[1][0]['name'])
-        node = node[1]
-
-    node[0]['name'] = dname
-    return node
-
-
-def ncdu_from_fileinfos(fileinfos: Sequence[FileInfo]) -> NcduDirNode:
-    dir_fileinfos = (f for f in fileinfos if f.kind == "directory")
-    file_fileinfos = (f for f in fileinfos if f.kind != "directory")
-    directories: dict[str, NcduDirNode] = {d.path: ncdu_directory(d) for d in dir_fileinfos}
-
-    # attach all the files to their directories or fake directories
-    for fileinfo in file_fileinfos:
-        parent = get_node_or_fake(directories, os.path.dirname(fileinfo.path))
-        parent.append(ncdu_file(fileinfo))
-
-    build_hierachy(directories)
-
-    root = collapse_empty_dirs(directories)
-    # root = directories["/"]
-
-    return root
+    fout.write("]")
 
 
 def main() -> None:
     sb_init()
 
-    parser = argparse.ArgumentParser(description='Convert .sbtr to ncdu syntax')
+    parser = argparse.ArgumentParser(description='Show a directory from the database in ncdu')
     parser.add_argument('FILE', action='store', type=str, nargs=1,
-                        help='.sbtr file to load')
+                        help='directory to show')
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read")
     parser.add_argument('-o', '--output', metavar="FILE", type=str, default=None,
                         help="Output results to FILE instead of starting ncdu")
     parser.add_argument('--debug-sql', action='store_true', default=False,
                         help="Debug SQL queries")
     args = parser.parse_args()
 
-    db = Database(args.database or make_default_database(), args.debug_sql)
-
-    # fileinfos = scatterbackup.sbtr.fileinfos_from_sbtr(args.FILE[0])
+    cfg = scatterbackup.config.Config()
+    cfg.load()
 
-    # FIXME: do some benchmarking on glob vs directory table for tree retrieval
-    # fileinfos = list(db.get_directory_by_path(os.path.abspath(args.FILE[0])))
+    db = Database(args.database or make_default_database(), args.debug_sql,
+                  profile=args.db_profile or cfg.get_db_profile("sb-ncdu", "interactive-read"))
 
-    print("gather fileinfos")
-    fileinfos = list(db.get_by_glob(os.path.join(os.path.abspath(args.FILE[0]), "*")))
+    path = os.path.abspath(args.FILE[0])
+    if db.lookup_directory(path) is None:
+        print("{}: {}: directory not in database".format(sys.argv[0], path), file=sys.stderr)
+        sys.exit(1)
 
-    print("building .js data")
-    ncdu_js = ncdu_from_fileinfos_with_header(fileinfos)
     if args.output is None:
-        with tempfile.NamedTemporaryFile("w") as fout:
-            print("dumping .js")
-            json.dump(ncdu_js, fp=fout)
-            fout.flush()
-            print("calling ncdu")
-            subprocess.call(["ncdu", "-f", fout.name])
+        # ncdu reads the tree from the pipe while it is written
+        with subprocess.Popen(["ncdu", "-f", "-"], stdin=subprocess.PIPE, text=True) as proc:
+            assert proc.stdin is not None
+            try:
+                write_ncdu(db, path, proc.stdin)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass  # ncdu quit before the tree was complete
     elif args.output == "-":
-        json.dump(ncdu_js, fp=sys.stdout)
+        write_ncdu(db, path, sys.stdout)
     else:
         with open(args.output, "w") as fout:
-            json.dump(ncdu_js, fp=fout)
+            write_ncdu(db, path, fout)
 
 
 # EOF #
@@ -23,7 +23,8 @@ import sys
 
 import scatterbackup
 import scatterbackup.util
-from scatterbackup.database import Database
+import scatterbackup.config
+from scatterbackup.database import Database, DB_PROFILES
 from scatterbackup.fileinfo import FileInfo
 from scatterbackup.format import FileInfoFormatter
 from scatterbackup.generation import GenerationRange
@@ -55,6 +56,8 @@ def parse_args() -> argparse.Namespace:
                         help="be more verbose")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: interactive-read")
     parser.add_argument('-g', '--glob', type=str, action='append', default=[],
                         help="Search by glob pattern")
     parser.add_argument('-G', '--iglob', type=str, action='append', default=[],
@@ -63,6 +66,8 @@ def parse_args() -> argparse.Namespace:
                         help="Query the database for the given sha1")
     parser.add_argument('--by-md5', type=str, action='append', default=[],
                         help="Query the database for the given md5")
+    parser.add_argument('--by-blake2b', type=str, action='append', default=[],
+                        help="Query the database for the given blake2b")
     parser.add_argument('-j', '--json', action='store_true',
                         help="Return results as json")
     parser.add_argument('-a', '--all', action='store_true', default=False,
@@ -78,6 +83,8 @@ def parse_args() -> argparse.Namespace:
                            help="Print results in md5sum style")
     fmt_group.add_argument('--sha1sum', action='store_true', default=False,
                            help="Print results in sha1sum style")
+    fmt_group.add_argument('--b2sum', action='store_true', default=False,
+                           help="Print results in b2sum style")
 
     return parser.parse_args()
 
@@ -101,7 +108,11 @@ def main() -> None:
     sb_init()
 
     args = parse_args()
-    db = Database(args.database or scatterbackup.util.make_default_database(), args.debug_sql)
+    cfg = scatterbackup.config.Config()
+    cfg.load()
+
+    db = Database(args.database or scatterbackup.util.make_default_database(), args.debug_sql,
+                  profile=args.db_profile or cfg.get_db_profile("sb-query", "interactive-read"))
 
     # setup output format
     if args.json:
@@ -113,6 +124,8 @@ def main() -> None:
             fmt = "{md5:32}  {path}"
         elif args.sha1sum:
             fmt = "{sha1:40}  {path}"
+        elif args.b2sum:
+            fmt = "{blake2b:128}  {path}"
         else:
             fmt = "{mode} {owner:8} {group:8} {size:>8} {time} {path}"
 
@@ -131,7 +144,8 @@ def main() -> None:
        args.glob == [] and \
        args.iglob == [] and \
        args.by_sha1 == [] and \
-       args.by_md5 == []:
+       args.by_md5 == [] and \
+       args.by_blake2b == []:
         fileinfos = db.get_all()
         for fileinfo in fileinfos:
             process_fileinfo(fileinfo, print_fun, "ALL")
@@ -172,5 +186,11 @@ def main() -> None:
             for fileinfo in fileinfos:
                 process_fileinfo(fileinfo, print_fun, checksum)
 
+        # --by-blake2b
+        for checksum in args.by_blake2b:
+            fileinfos = db.get_by_checksum('blake2b', checksum)
+            for fileinfo in fileinfos:
+                process_fileinfo(fileinfo, print_fun, checksum)
+
 
 # EOF #
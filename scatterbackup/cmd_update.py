@@ -15,21 +15,31 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import IO, Iterator, Optional, Sequence, TypeVar
+from typing import IO, Callable, Iterator, Optional, Sequence, TypeVar
 
 import argparse
+import contextlib
+import functools
 import sys
 import shlex
 import os
+import time
 
 import scatterbackup.sbtr
 import scatterbackup
 import scatterbackup.util
 import scatterbackup.config
-from scatterbackup.util import sb_init, full_join, split
+import scatterbackup.hasher
+from scatterbackup.util import sb_init, full_join, split, LRUCache
 from scatterbackup.generator import scan_fileinfos
-from scatterbackup.database import Database, NullDatabase, IDatabase
+from scatterbackup.database import Database, NullDatabase, IDatabase, DB_PROFILES
 from scatterbackup.fileinfo import FileInfo
+from scatterbackup.blobinfo import BlobInfo
+from scatterbackup.generation import GenerationRange
+from scatterbackup.hashpool import HashPool
+from scatterbackup.hasher import DEFAULT_DIGESTS
+from scatterbackup.storage import StorageRegistry
+from scatterbackup.units import size2bytes
 
 # sb-update / -v -n
 # sb-update / -q
@@ -38,6 +48,8 @@ from scatterbackup.fileinfo import FileInfo
 
 T = TypeVar('T')
 
+InodeKey = tuple[int, int, int, int, int]
+
 
 def on_report_with_database(db: IDatabase, fileinfo: FileInfo) -> None:
     db.store(fileinfo)
@@ -71,6 +83,22 @@ def join_fileinfos(lhs: Sequence[FileInfo], rhs: Sequence[FileInfo]) -> Iterator
     return full_join(lhs, rhs, fileinfo_to_path)  # type: ignore
 
 
+def inode_key(fileinfo: FileInfo) -> Optional[InodeKey]:
+    """Identifies the content of a file independent of its path, the
+    ctime changes with any modification of the inode"""
+    if fileinfo.dev is None or fileinfo.ino is None or fileinfo.size is None or \
+       fileinfo.mtime is None or fileinfo.ctime is None:
+        return None
+    else:
+        return (fileinfo.dev, fileinfo.ino, fileinfo.size, int(fileinfo.mtime), int(fileinfo.ctime))
+
+
+def path_key(path: str) -> list[str]:
+    """Sort key that orders paths the same way a sorted topdown walk
+    visits them, a directory comes before its content"""
+    return [p for p in path.split(os.sep) if p]
+
+
 class UpdateAction:
 
     def __init__(self, db: IDatabase) -> None:
@@ -80,6 +108,38 @@ class UpdateAction:
         self.relative = False
         self.prefix = None
         self.excludes: list[str] = []
+        self.jobs = 1
+        self.scan_jobs = 1
+        self.digests: list[str] = list(DEFAULT_DIGESTS)
+        self.hashpool: Optional[HashPool] = None
+
+        # replaces st_dev of the scanned FileInfos with a stable id
+        self.storage = StorageRegistry(db)
+
+        # FileInfos waiting to be written with IDatabase.store_many()
+        self.store_buffer: list[FileInfo] = []
+        self.store_buffer_size = 1000
+
+        # checksums of recently seen files with more than one link,
+        # older ones are found with IDatabase.get_by_inode()
+        self.inode_cache: LRUCache[InodeKey, BlobInfo] = LRUCache(100000)
+
+        # the first link of an inode whose checksums are still being
+        # calculated, the other links wait for it instead of hashing
+        # the same content again
+        self.pending_inodes: dict[InodeKey, FileInfo] = {}
+
+        # checkpoints allow an interrupted run to be continued with
+        # --resume, 'resume_key' is the path_key() of the last directory
+        # that the interrupted run finished, sb-watch turns them off as
+        # it has nothing to resume
+        self.checkpoints = True
+        self.resume = False
+        self.resume_key: Optional[list[str]] = None
+        self.checkpoint_root: Optional[str] = None
+        self.checkpoint_path: Optional[str] = None
+        self.checkpoint_time = time.time()
+        self.checkpoint_interval = 60.0
 
     def log_error(self, err: OSError) -> None:
         # pylint: disable=no-self-use
@@ -92,110 +152,330 @@ class UpdateAction:
         if self.verbose >= verbose:
             print(msg)
 
-    def add_checksums(self, fi: FileInfo, ref: Optional[FileInfo]) -> None:
+    def needs_checksums(self, fi: FileInfo, ref: Optional[FileInfo]) -> bool:
+        """Recycle the checksums from 'ref' if possible, returns True when
+        they have to be calculated from the file content"""
         if fi.kind != 'file':
-            return  # no checksum needed
+            return False  # no checksum needed
 
         if ref is not None and \
            ref.blob is not None and \
-           ref.blob.is_complete() and \
+           ref.blob.is_complete(self.digests) and \
            ref.mtime == fi.mtime and \
            ref.size == fi.size:
             # recycle checksum from reference FileInfo
             # self.log_info(1, "{}: recycling checksums".format(fi.path))
             fi.blob = ref.blob
+            return False
         elif self.checksums:
-            self.log_info(1, "{}: calculating checksums".format(fi.path))
+            blob = self.lookup_checksums(fi)
+            if blob is not None:
+                # hardlink or moved file
+                self.log_info(1, "{}: recycling checksums of inode {}".format(fi.path, fi.ino))
+                fi.blob = blob
+                return False
+            else:
+                return True
+        else:
+            return False
+
+    def lookup_checksums(self, fi: FileInfo) -> Optional[BlobInfo]:
+        """Returns the checksums of the inode of 'fi' when they were
+        already calculated for another path"""
+        key = inode_key(fi)
+        if key is None:
+            return None
+
+        blob = self.inode_cache.get(key)
+        if blob is None:
+            blob = self.lookup_inode(fi)
+
+        if blob is not None and blob.size == fi.size and blob.is_complete(self.digests):
+            return blob
+        else:
+            return None
+
+    def lookup_inode(self, fi: FileInfo) -> Optional[BlobInfo]:
+        """Returns the checksums last stored for the inode of 'fi' under
+        any path, alive or not. Moving a file changes its ctime, but
+        neither size nor mtime, so only those have to match."""
+        assert fi.dev is not None and fi.ino is not None
+        # rows older than the most recent one are older content
+        other = next(self.db.get_by_inode(fi.dev, fi.ino, GenerationRange.MATCH_ALL), None)
+        if other is not None and \
+           other.kind == "file" and \
+           other.size == fi.size and \
+           other.mtime == fi.mtime:
+            return other.blob
+        else:
+            return None
+
+    def remember_checksums(self, fi: FileInfo) -> None:
+        if fi.nlink is not None and fi.nlink > 1:
+            key = inode_key(fi)
+            if key is not None:
+                if fi.blob is not None:
+                    self.inode_cache.put(key, fi.blob)
+                if self.pending_inodes.get(key) is fi:
+                    del self.pending_inodes[key]
+
+    def pending_hardlink(self, fi: FileInfo) -> Optional[FileInfo]:
+        """Returns the other link of the inode of 'fi' whose checksums are
+        already scheduled, otherwise 'fi' becomes that link"""
+        if fi.nlink is None or fi.nlink <= 1:
+            return None
+
+        key = inode_key(fi)
+        if key is None:
+            return None
+
+        leader = self.pending_inodes.get(key)
+        if leader is None:
+            self.pending_inodes[key] = fi
+        return leader
+
+    def update_hardlink(self, leader: FileInfo, fs_fi: FileInfo, db_fi: Optional[FileInfo]) -> None:
+        """update_file() for a link of an inode that was hashed through
+        'leader', scheduled behind it, so its checksums are done"""
+        if leader.blob is not None and leader.blob.size == fs_fi.size and leader.blob.is_complete(self.digests):
+            self.log_info(1, "{}: recycling checksums of inode {}".format(fs_fi.path, fs_fi.ino))
+            fs_fi.blob = leader.blob
+        else:
+            # reading 'leader' failed
+            try:
+                fs_fi.calc_checksums()
+            except OSError as err:
+                self.log_error(err)
+        self.update_file(fs_fi, db_fi)
+
+    def add_checksums(self, fi: FileInfo, ref: Optional[FileInfo]) -> None:
+        if self.needs_checksums(fi, ref):
             try:
                 fi.calc_checksums()
             except OSError as err:
                 self.log_error(err)
 
+    def schedule(self, fi: Optional[FileInfo], action: Callable[[], None]) -> None:
+        """Run 'action' once the checksums of 'fi' are calculated, with
+        --jobs the checksums are calculated in the background and the
+        actions are run in the order they were scheduled"""
+        if self.hashpool is None:
+            if fi is not None:
+                try:
+                    fi.calc_checksums()
+                except OSError as err:
+                    self.log_error(err)
+            action()
+        else:
+            self.hashpool.submit(fi, action)
+
+    def store(self, fi: FileInfo) -> None:
+        self.store_buffer.append(fi)
+        if len(self.store_buffer) >= self.store_buffer_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write the buffered FileInfos to the database, followed by the
+        checkpoint that covers them"""
+        self.db.store_many(self.store_buffer)
+        self.store_buffer = []
+
+        if self.checkpoint_path is not None:
+            assert self.checkpoint_root is not None
+            self.db.store_checkpoint(self.checkpoint_root, self.checkpoint_path, False)
+            self.checkpoint_path = None
+        self.checkpoint_time = time.time()
+
+    def checkpoint(self, root: str, path: str) -> None:
+        """Called once the content of directory 'path' and everything
+        before it in walk order below 'root' is processed"""
+        self.checkpoint_root = root
+        self.checkpoint_path = path
+        if time.time() - self.checkpoint_time > self.checkpoint_interval:
+            # make sure progress is on disk even when the run is
+            # killed instead of interrupted
+            self.flush()
+            self.db.commit()
+
+    def is_done(self, path: str) -> bool:
+        """True when the content of directory 'path' was already processed
+        by the run that is resumed"""
+        return self.resume_key is not None and path_key(path) <= self.resume_key
+
+    def is_subtree_done(self, path: str) -> bool:
+        """True when directory 'path' and everything below it was already
+        processed by the run that is resumed"""
+        if not self.is_done(path):
+            return False
+        else:
+            assert self.resume_key is not None
+            key = path_key(path)
+            return self.resume_key[:len(key)] != key
+
+    def update_directory(self, fs_fi: Optional[FileInfo], db_fi: Optional[FileInfo]) -> None:
+        if fs_fi is None:
+            assert db_fi is not None
+            self.log_info(1, "{}: directory removed".format(db_fi.path))
+            self.db.mark_removed_recursive(db_fi)
+        elif db_fi is None:
+            self.log_info(1, "{}: storing directory in db".format(fs_fi.path))
+            self.store(fs_fi)
+        else:
+            if file_changed(fs_fi, db_fi):
+                # print("OLD:", fs_fi.json())
+                # print("NEW:", db_fi.json())
+                self.log_info(1, "{}: directory changed".format(fs_fi.path))
+                self.db.mark_removed(db_fi)
+                self.store(fs_fi)
+            else:
+                self.log_info(3, "{}: directory already in db, nothing to do".format(fs_fi.path))
+
+    def update_file(self, fs_fi: Optional[FileInfo], db_fi: Optional[FileInfo]) -> None:
+        if fs_fi is not None:
+            self.remember_checksums(fs_fi)
+
+        if fs_fi is None:
+            assert db_fi is not None
+            self.log_info(1, "{}: file removed".format(db_fi.path))
+            self.db.mark_removed(db_fi)
+        elif db_fi is None:
+            self.log_info(1, "{}: storing file in db".format(fs_fi.path))
+            self.store(fs_fi)
+        else:
+            if file_changed(fs_fi, db_fi):
+                # print("OLD:", fs_fi.json())
+                # print("NEW:", db_fi.json())
+                self.log_info(1, "{}: file changed".format(fs_fi.path))
+                self.db.mark_removed(db_fi)
+                self.store(fs_fi)
+            else:
+                self.log_info(3, "{}: file already in db, nothing to do".format(fs_fi.path))
+
     def process_dirs(self, fs_dirs: Sequence[FileInfo], db_dirs: Sequence[FileInfo]) -> None:
+        for fs_fi in fs_dirs:
+            self.storage.assign(fs_fi)
+
         joined = join_fileinfos(fs_dirs, db_dirs)
         # for f, d in joined:
         #     print("   fs: {!r:40} db: {!r:40}".format(f, d))
         for fs_fi, db_fi in joined:
-            if fs_fi is None:
-                assert db_fi is not None
-                self.log_info(1, "{}: directory removed".format(db_fi.path))
-                self.db.mark_removed_recursive(db_fi)
-            elif db_fi is None:
-                self.log_info(1, "{}: storing directory in db".format(fs_fi.path))
-                self.db.store(fs_fi)
-            else:
-                if file_changed(fs_fi, db_fi):
-                    # print("OLD:", fs_fi.json())
-                    # print("NEW:", db_fi.json())
-                    self.log_info(1, "{}: directory changed".format(fs_fi.path))
-                    self.db.mark_removed(db_fi)
-                    self.db.store(fs_fi)
-                else:
-                    self.log_info(3, "{}: directory already in db, nothing to do".format(fs_fi.path))
+            self.schedule(None, functools.partial(self.update_directory, fs_fi, db_fi))
 
     def process_files(self, fs_files: Sequence[FileInfo], db_files: Sequence[FileInfo]) -> None:
+        for fs_fi in fs_files:
+            self.storage.assign(fs_fi)
+
         joined = join_fileinfos(fs_files, db_files)
         # for f, d in joined:
         #   print("   fs: {!r:40} db: {!r:40}".format(f, d))
         for fs_fi, db_fi in joined:
-            if fs_fi is None:
-                assert db_fi is not None
-                self.log_info(1, "{}: file removed".format(db_fi.path))
-                self.db.mark_removed(db_fi)
-            elif db_fi is None:
-                self.add_checksums(fs_fi, None)
-                self.log_info(1, "{}: storing file in db".format(fs_fi.path))
-                self.db.store(fs_fi)
-            else:
-                # recycle checksum from database
-                self.add_checksums(fs_fi, db_fi)
-
-                if file_changed(fs_fi, db_fi):
-                    # print("OLD:", fs_fi.json())
-                    # print("NEW:", db_fi.json())
-                    self.log_info(1, "{}: file changed".format(fs_fi.path))
-                    self.db.mark_removed(db_fi)
-                    self.db.store(fs_fi)
+            # recycle checksum from database
+            if fs_fi is not None and self.needs_checksums(fs_fi, db_fi):
+                leader = self.pending_hardlink(fs_fi)
+                if leader is not None:
+                    self.schedule(None, functools.partial(self.update_hardlink, leader, fs_fi, db_fi))
                 else:
-                    self.log_info(3, "{}: file already in db, nothing to do".format(fs_fi.path))
+                    self.log_info(1, "{}: calculating checksums".format(fs_fi.path))
+                    self.schedule(fs_fi, functools.partial(self.update_file, fs_fi, db_fi))
+            else:
+                self.schedule(None, functools.partial(self.update_file, fs_fi, db_fi))
+
+    def finish(self, path: str) -> None:
+        """Called once everything below 'path' is processed"""
+        self.flush()
+        self.db.store_checkpoint(path, path, True)
 
     def process_directory(self, fi_fs: FileInfo, recursive: bool = True) -> None:
         # root directory
-        fi_db = self.db.get_one_by_path(fi_fs.path)
-        self.process_dirs([fi_fs],
-                          [fi_db] if fi_db is not None else [])
+        if not self.is_done(fi_fs.path):
+            fi_db = self.db.get_one_by_path(fi_fs.path)
+            self.process_dirs([fi_fs],
+                              [fi_db] if fi_db is not None else [])
 
-        # content of root directory
+        # content of root directory, walked in sorted order so that
+        # checkpoints stay valid across runs
         fs_gen = scan_fileinfos(fi_fs.path,
-                                relative=self.relative,
                                 # prefix=prefix,  # FIXME: prefix not implemented
                                 checksums=False,
                                 excludes=self.excludes,
-                                onerror=self.log_error)
+                                onerror=self.log_error,
+                                sort=True,
+                                prune=self.is_subtree_done,
+                                jobs=self.scan_jobs)
 
         if not recursive:
             fs_gen = iter([next(fs_gen)])
 
         for root, fs_dirs, fs_files in fs_gen:
+            if self.is_done(root):
+                self.log_info(2, "skipping {}, already processed".format(root))
+                continue
+
             self.log_info(2, "processing {}".format(root))
             result = self.db.get_directory_by_path(root)
             db_dirs, db_files = fileinfos_split(list(result))
 
             self.process_dirs(fs_dirs, db_dirs)
             self.process_files(fs_files, db_files)
+            if self.checkpoints:
+                self.schedule(None, functools.partial(self.checkpoint, fi_fs.path, root))
 
     def process_file(self, fi_fs: FileInfo) -> None:
         fi_db = self.db.get_one_by_path(fi_fs.path)
         self.process_files([fi_fs],
                            [fi_db] if fi_db is not None else [])
 
+    @contextlib.contextmanager
+    def hashing(self) -> Iterator[None]:
+        """All paths scanned inside the block share one HashPool, their
+        checksums are completed and written to the database when the
+        block is left"""
+        if self.jobs > 1:
+            self.hashpool = HashPool(self.jobs, onerror=self.log_error)
+
+        try:
+            yield
+
+            if self.hashpool is not None:
+                self.hashpool.join()
+        finally:
+            if self.hashpool is not None:
+                self.hashpool.shutdown()
+                self.hashpool = None
+
+            # FileInfos that made it into the buffer are complete,
+            # write them and the last checkpoint even when interrupted
+            self.flush()
+
     def process_path(self, path: str, recursive: bool = True) -> None:
+        with self.hashing():
+            self.scan_path(path, recursive)
+
+    def scan_path(self, path: str, recursive: bool = True) -> None:
+        """Like process_path(), but must be called inside a hashing()
+        block, the results are only complete once it is left"""
+        self.resume_key = None
+
+        if self.resume:
+            checkpoint = self.db.get_checkpoint(path)
+            if checkpoint is not None:
+                last_path, finished = checkpoint
+                if finished:
+                    self.log_info(0, "{}: already finished, skipping".format(path))
+                    return
+                else:
+                    self.log_info(0, "{}: resuming after {}".format(path, last_path))
+                    self.resume_key = path_key(last_path)
+
         fi = FileInfo.from_file(path)
         if fi.kind == "directory":
-            self.process_directory(fi)
+            self.process_directory(fi, recursive)
         else:
             self.process_file(fi)
 
+        if self.checkpoints:
+            self.schedule(None, functools.partial(self.finish, path))
+
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description='Collect FileInfo')
@@ -215,6 +495,8 @@ def parse_args() -> argparse.Namespace:
                         help="Use a fake prefix to make a relative path absolute")
     parser.add_argument('-d', '--database', type=str, default=None,
                         help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: bulk-write")
     parser.add_argument('-c', '--config', type=str, default=None,
                         help="Load configuration file")
     parser.add_argument('-i', '--import-file', type=str, default=None,
@@ -223,6 +505,14 @@ def parse_args() -> argparse.Namespace:
                         help="Set the output filename")
     parser.add_argument('-D', '--non-recursive', action='store_true', default=False,
                         help="Only process given directory")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="Calculate checksums with N threads in parallel")
+    parser.add_argument('--scan-jobs', type=int, default=1, metavar="N",
+                        help="List up to N directories in parallel, helps on network filesystems")
+    parser.add_argument('-b', '--block-size', type=size2bytes, default=None, metavar="SIZE",
+                        help="Read files in blocks of SIZE when calculating checksums")
+    parser.add_argument('--resume', action='store_true', default=False,
+                        help="Continue an interrupted run, skipping the directories it already processed")
     parser.add_argument('--debug-sql', action='store_true', default=False,
                         help="Debug SQL queries")
     return parser.parse_args()
@@ -236,13 +526,25 @@ def main() -> None:
     cfg = scatterbackup.config.Config()
     cfg.load(args.config)
 
+    scatterbackup.hasher.configure(block_size=args.block_size or cfg.hash_block_size,
+                                   threaded=cfg.hash_threads,
+                                   digests=cfg.digests)
+
     db: IDatabase
     if args.dry_run:
         db = NullDatabase()
     else:
-        db = Database(args.database or scatterbackup.util.make_default_database(), args.debug_sql)
+        db = Database(args.database or scatterbackup.util.make_default_database(), args.debug_sql,
+                      profile=args.db_profile or cfg.get_db_profile("sb-update", "bulk-write"))
 
-    gen = db.init_generation(" ".join([shlex.quote(a) for a in sys.argv]))
+    resumed_gen = db.resume_generation() if args.resume else None
+    if resumed_gen is not None:
+        print("Resuming generation {}".format(resumed_gen))
+        gen = resumed_gen
+    else:
+        if args.resume:
+            print("No unfinished generation found, starting a new one")
+        gen = db.init_generation(" ".join([shlex.quote(a) for a in sys.argv]))
 
     try:
         if args.import_file:
@@ -251,14 +553,21 @@ def main() -> None:
             # db.max_insert_size = None
 
             with scatterbackup.sbtr.open_sbtr(args.import_file) as fin:
-                i = 0
-                for line in fin:
-                    if i % 10000 == 0:
-                        print("{} entries imported".format(i))
-                    fileinfo = scatterbackup.FileInfo.from_json(line)
-                    db.store(fileinfo)
-                    i += 1
-                print("{} entries imported".format(i))
+                count = 0
+                storage = StorageRegistry(db)
+
+                def read_fileinfos() -> Iterator[FileInfo]:
+                    nonlocal count
+                    for line in fin:
+                        if count % 10000 == 0:
+                            print("{} entries imported".format(count))
+                        fileinfo = scatterbackup.FileInfo.from_json(line)
+                        storage.assign(fileinfo)
+                        yield fileinfo
+                        count += 1
+
+                db.store_many(read_fileinfos())
+                print("{} entries imported".format(count))
         else:
             if args.PATH == []:
                 print("Using default directories from '~/.config/scatterbackup/config.yaml':")
@@ -276,6 +585,10 @@ def main() -> None:
                 update.relative = args.relative if args.prefix is None else True
                 update.prefix = args.prefix
                 update.excludes = cfg.excludes
+                update.jobs = args.jobs
+                update.scan_jobs = args.scan_jobs
+                update.digests = cfg.digests
+                update.resume = resumed_gen is not None
 
                 update.process_path(path, not args.non_recursive)
 
@@ -284,7 +597,7 @@ def main() -> None:
 
     except KeyboardInterrupt:
         print("KeyboardInterrupt received, shutting down")
-        # FIXME: Write a continuation point here
+        print("Use 'sb-update --resume' to continue")
         db.commit()
 
 
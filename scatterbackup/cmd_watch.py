@@ -0,0 +1,301 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Callable, Optional
+
+import argparse
+import errno
+import os
+import shlex
+import sys
+import time
+
+import scatterbackup.config
+import scatterbackup.hasher
+import scatterbackup.util
+from scatterbackup.cmd_update import UpdateAction
+from scatterbackup.database import Database, DB_PROFILES
+from scatterbackup.generator import match_excludes, scan_directory
+from scatterbackup.inotify import (Inotify, Event, IN_CHANGES, IN_ONLYDIR, IN_DONT_FOLLOW,
+                                   IN_EXCL_UNLINK, IN_Q_OVERFLOW, IN_IGNORED, IN_UNMOUNT, IN_ISDIR,
+                                   IN_CREATE, IN_MOVED_TO, IN_MOVED_FROM,
+                                   IN_DELETE_SELF, IN_MOVE_SELF)
+from scatterbackup.units import size2bytes
+from scatterbackup.util import sb_init
+
+
+class Watcher:
+    """Keeps an inotify watch on every directory below 'roots' and
+    collects the directories whose content changed"""
+
+    def __init__(self, inotify: Inotify, roots: list[str],
+                 excludes: Optional[list[str]] = None,
+                 onerror: Optional[Callable[[OSError], None]] = None) -> None:
+        self.inotify = inotify
+        self.roots = roots
+        self.excludes = excludes
+        self.onerror = onerror
+
+        self.wd_to_path: dict[int, str] = {}
+        self.path_to_wd: dict[str, int] = {}
+
+        # directories whose direct content changed
+        self.dirty: set[str] = set()
+
+        # directories that appeared and have to be processed recursively
+        self.dirty_trees: set[str] = set()
+
+        # the kernel dropped events, everything has to be rescanned
+        self.overflow = False
+
+        # time of the first and the last event since the last take()
+        self.first_event: Optional[float] = None
+        self.last_event: Optional[float] = None
+
+    def watch_all(self) -> None:
+        for root in self.roots:
+            self.watch_tree(root)
+
+    def watch_tree(self, path: str) -> None:
+        for root, _, _ in scan_directory(path, self.excludes, onerror=self.onerror):
+            self.watch(root)
+
+    def watch(self, path: str) -> None:
+        try:
+            wd = self.inotify.add_watch(path, IN_CHANGES | IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK)
+        except OSError as err:
+            if err.errno == errno.ENOSPC:
+                print("{}: inotify watch limit reached, increase fs.inotify.max_user_watches"
+                      .format(sys.argv[0]), file=sys.stderr)
+            if self.onerror is not None:
+                self.onerror(err)
+            return
+
+        # the directory might have been watched under a different name
+        # before it was moved
+        old_path = self.wd_to_path.get(wd)
+        if old_path is not None and self.path_to_wd.get(old_path) == wd:
+            del self.path_to_wd[old_path]
+
+        self.wd_to_path[wd] = path
+        self.path_to_wd[path] = wd
+
+    def unwatch_tree(self, path: str) -> None:
+        prefix = os.path.join(path, "")
+        for p, wd in list(self.path_to_wd.items()):
+            if p == path or p.startswith(prefix):
+                del self.path_to_wd[p]
+                del self.wd_to_path[wd]
+                try:
+                    self.inotify.rm_watch(wd)
+                except OSError:
+                    pass  # directory is already gone
+
+    def handle(self, event: Event) -> None:
+        if event.mask & IN_Q_OVERFLOW:
+            self.overflow = True
+            self.touch()
+            return
+
+        path = self.wd_to_path.get(event.wd)
+        if path is None:
+            return
+
+        if event.mask & (IN_IGNORED | IN_UNMOUNT):
+            # watch was removed, the directory is gone or its filesystem
+            # was unmounted, IN_IGNORED follows IN_UNMOUNT for the same wd
+            del self.wd_to_path[event.wd]
+            if self.path_to_wd.get(path) == event.wd:
+                del self.path_to_wd[path]
+
+            if event.mask & IN_UNMOUNT and os.path.isdir(path):
+                # a mount point, the directory below it is visible again
+                self.watch_tree(path)
+                self.dirty_trees.add(path)
+                self.touch()
+            return
+
+        if event.mask & (IN_DELETE_SELF | IN_MOVE_SELF):
+            # the parent directory gets an event of its own
+            return
+
+        if event.name:
+            child = os.path.join(path, event.name)
+            if match_excludes(child, self.excludes):
+                return
+
+            if event.mask & IN_ISDIR:
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    # content created before the watch was added
+                    # doesn't generate events
+                    self.watch_tree(child)
+                    self.dirty_trees.add(child)
+                elif event.mask & IN_MOVED_FROM:
+                    self.unwatch_tree(child)
+
+        self.dirty.add(path)
+        self.touch()
+
+    def touch(self) -> None:
+        now = time.monotonic()
+        if self.first_event is None:
+            self.first_event = now
+        self.last_event = now
+
+    def timeout(self, delay: float, max_delay: float) -> Optional[float]:
+        """Returns the seconds until the collected changes should be
+        processed, None when there are none"""
+        if self.first_event is None or self.last_event is None:
+            return None
+        else:
+            deadline = min(self.last_event + delay, self.first_event + max_delay)
+            return max(0.0, deadline - time.monotonic())
+
+    def take(self) -> tuple[bool, list[str], list[str]]:
+        """Returns and clears the collected changes"""
+        result = (self.overflow, sorted(self.dirty), sorted(self.dirty_trees))
+
+        self.overflow = False
+        self.dirty = set()
+        self.dirty_trees = set()
+        self.first_event = None
+        self.last_event = None
+
+        return result
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Watch directories and keep the database up to date')
+    parser.add_argument('PATH', action='store', type=str, nargs='*',
+                        help='PATH to watch')
+    parser.add_argument('-v', '--verbose', action='count', default=0,
+                        help="Increase verbosity")
+    parser.add_argument('-N', '--no-checksum', action='store_true', default=False,
+                        help="don't calculate checksums")
+    parser.add_argument('-d', '--database', type=str, default=None,
+                        help="Store results in database")
+    parser.add_argument('--db-profile', type=str, default=None, choices=list(DB_PROFILES),
+                        help="SQLite connection settings, default: bulk-write")
+    parser.add_argument('-c', '--config', type=str, default=None,
+                        help="Load configuration file")
+    parser.add_argument('-j', '--jobs', type=int, default=1, metavar="N",
+                        help="Calculate checksums with N threads in parallel")
+    parser.add_argument('-b', '--block-size', type=size2bytes, default=None, metavar="SIZE",
+                        help="Read files in blocks of SIZE when calculating checksums")
+    parser.add_argument('--delay', type=float, default=5.0, metavar="SECONDS",
+                        help="Process changes once no new ones arrived for SECONDS")
+    parser.add_argument('--max-delay', type=float, default=60.0, metavar="SECONDS",
+                        help="Process changes at the latest SECONDS after the first one")
+    parser.add_argument('--no-scan', action='store_true', default=False,
+                        help="Skip the full scan on startup, use when the database is already up to date")
+    parser.add_argument('--debug-sql', action='store_true', default=False,
+                        help="Debug SQL queries")
+    return parser.parse_args()
+
+
+def main() -> None:
+    sb_init()
+
+    args = parse_args()
+
+    cfg = scatterbackup.config.Config()
+    cfg.load(args.config)
+
+    scatterbackup.hasher.configure(block_size=args.block_size or cfg.hash_block_size,
+                                   threaded=cfg.hash_threads,
+                                   digests=cfg.digests)
+
+    db = Database(args.database or scatterbackup.util.make_default_database(), args.debug_sql,
+                  profile=args.db_profile or cfg.get_db_profile("sb-watch", "bulk-write"))
+
+    if args.PATH == []:
+        paths = [os.path.abspath(d) for d in cfg.defaults]
+    else:
+        paths = [os.path.abspath(d) for d in args.PATH]
+
+    command = " ".join([shlex.quote(a) for a in sys.argv])
+
+    def make_update() -> UpdateAction:
+        update = UpdateAction(db)
+        update.verbose = args.verbose
+        update.checksums = not args.no_checksum
+        update.excludes = cfg.excludes
+        update.jobs = args.jobs
+        update.digests = cfg.digests
+        # every flush is a generation of its own and finishes quickly,
+        # there is nothing to resume
+        update.checkpoints = False
+        return update
+
+    def process(update: UpdateAction, path: str, recursive: bool) -> None:
+        try:
+            update.scan_path(path, recursive)
+        except FileNotFoundError:
+            # removed again, the parent directory takes care of it
+            update.log_info(1, "{}: gone".format(path))
+        except OSError as err:
+            update.log_error(err)
+
+    def flush(overflow: bool, dirs: list[str], trees: list[str]) -> None:
+        gen = db.init_generation(command)
+        update = make_update()
+
+        # a single HashPool for all directories of the flush
+        with update.hashing():
+            if overflow:
+                # events were lost, neither the watches nor the dirty
+                # directories can be trusted
+                update.log_info(0, "rescanning {}".format(" ".join(paths)))
+                watcher.watch_all()
+                for path in paths:
+                    process(update, path, True)
+            else:
+                update.log_info(0, "processing {} directories and {} new trees".format(len(dirs), len(trees)))
+                for path in trees:
+                    process(update, path, True)
+                for path in dirs:
+                    process(update, path, False)
+
+        db.deinit_generation(gen)
+        db.commit()
+
+    with Inotify() as inotify:
+        watcher = Watcher(inotify, paths, cfg.excludes, onerror=make_update().log_error)
+
+        print("Watching {}".format(" ".join(paths)))
+        watcher.watch_all()
+
+        try:
+            # changes from before the watches were added are unknown
+            if not args.no_scan:
+                flush(True, [], [])
+
+            while True:
+                for event in inotify.read(watcher.timeout(args.delay, args.max_delay)):
+                    if event.mask & IN_Q_OVERFLOW:
+                        print("{}: inotify event queue overflowed".format(sys.argv[0]), file=sys.stderr)
+                    watcher.handle(event)
+
+                if watcher.timeout(args.delay, args.max_delay) == 0.0:
+                    flush(*watcher.take())
+
+        except KeyboardInterrupt:
+            print("KeyboardInterrupt received, shutting down")
+            db.commit()
+
+
+# EOF #
@@ -22,6 +22,9 @@ import logging
 import yaml
 
 import scatterbackup.util
+from scatterbackup.database import check_db_profile
+from scatterbackup.hasher import DEFAULT_BLOCK_SIZE, DEFAULT_DIGESTS, check_digests
+from scatterbackup.units import size2bytes
 
 
 class Config:
@@ -29,6 +32,12 @@ class Config:
     def __init__(self) -> None:
         self.excludes: list[str] = []
         self.defaults: list[str] = []
+        self.hash_block_size: int = DEFAULT_BLOCK_SIZE
+        self.hash_threads: bool = False
+        self.digests: list[str] = list(DEFAULT_DIGESTS)
+
+        # maps command names like 'sb-update' to a database profile
+        self.db_profiles: dict[str, str] = {}
 
     def load(self, filename: Optional[str] = None) -> None:
         if filename is None:
@@ -44,6 +53,18 @@ class Config:
 
             self.excludes = cfg.get("excludes", [])
             self.defaults = cfg.get("defaults", [])
+            self.hash_block_size = size2bytes(str(cfg.get("hash_block_size", DEFAULT_BLOCK_SIZE)))
+            self.hash_threads = cfg.get("hash_threads", False)
+            self.digests = cfg.get("digests", list(DEFAULT_DIGESTS))
+            check_digests(self.digests)
+            self.db_profiles = cfg.get("db_profiles", {})
+            for profile in self.db_profiles.values():
+                check_db_profile(profile)
+
+    def get_db_profile(self, command: str, default: str) -> str:
+        """Returns the database profile configured for 'command', or
+        'default' when there is none"""
+        return self.db_profiles.get(command, default)
 
 
 # EOF #
@@ -15,10 +15,12 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import cast, Any, Iterator, Optional, Final, Union
+from typing import cast, Any, Iterable, Iterator, NamedTuple, Optional, Final, Sequence, Union
 
+import itertools
 import os
 import sqlite3
+import sys
 import time
 import logging
 from abc import abstractmethod, ABC
@@ -27,6 +29,128 @@ from scatterbackup.generation import Generation, GenerationRange
 from scatterbackup.fileinfo import FileInfo
 from scatterbackup.blobinfo import BlobInfo
 from scatterbackup.sql import WHERE, AND, OR, sql_pretty_print
+from scatterbackup.util import LRUCache
+
+
+# number of directory ids kept in memory by store_directory()
+DIRECTORY_CACHE_SIZE = 100000
+
+# number of blob ids kept in memory by store_blob()
+BLOB_CACHE_SIZE = 100000
+
+# number of (dev, ino) pairs looked up per query by get_by_inodes(),
+# two variables each, below SQLite's old default limit of 999
+INODE_BATCH_SIZE = 400
+
+# number of contents looked up per query by get_by_blobs()
+BLOB_BATCH_SIZE = 100
+
+# digests that are stored in the blob table
+CHECKSUM_TYPES = ["md5", "sha1", "blake2b"]
+
+# Version of the database layout, kept in 'PRAGMA user_version':
+#
+#  1: one blobinfo row with hex digests for every fileinfo row
+#  2: one blob row with binary digests for every unique content,
+#     referenced by fileinfo.blob_id
+#  3: fileinfo keeps only the basename in 'name', the full path is
+#     reconstructed from the directory table via directory_id
+#  4: fileinfo.dev is the id of the filesystem in the storageinfo
+#     table instead of st_dev, which changes across reboots
+SCHEMA_VERSION = 4
+
+# full path of a fileinfo row in schema version 3, the root directory
+# is stored with an empty name
+PATH_FROM_NAME = ("(CASE "
+                  "WHEN fileinfo.name = '' THEN directory.path "
+                  "WHEN directory.path = '/' THEN '/' || fileinfo.name "
+                  "ELSE directory.path || '/' || fileinfo.name END)")
+
+# PRAGMAs set by Database.set_profile(), every profile sets all of
+# them, so that switching profiles doesn't leave settings behind.
+# Negative cache_size values are in KiB.
+DB_PROFILES: dict[str, dict[str, Union[int, str]]] = {
+    # SQLite defaults
+    "default": {
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "temp_store": "DEFAULT",
+        "mmap_size": 0,
+        "query_only": 0,
+    },
+
+    # sb-update and friends, in WAL mode synchronous=NORMAL can only
+    # lose the last transactions on power loss, not corrupt the database
+    "bulk-write": {
+        "synchronous": "NORMAL",
+        "cache_size": -256 * 1024,
+        "temp_store": "MEMORY",
+        "mmap_size": 256 * 1024 * 1024,
+        "query_only": 0,
+    },
+
+    # short lookups with quick startup, e.g. sb-query
+    "interactive-read": {
+        "synchronous": "NORMAL",
+        "cache_size": -64 * 1024,
+        "temp_store": "MEMORY",
+        "mmap_size": 256 * 1024 * 1024,
+        "query_only": 1,
+    },
+
+    # queries that touch most of the database, e.g. sb-du
+    "analytics": {
+        "synchronous": "NORMAL",
+        "cache_size": -1024 * 1024,
+        "temp_store": "MEMORY",
+        "mmap_size": 4 * 1024 * 1024 * 1024,
+        "query_only": 1,
+    },
+}
+
+
+def check_db_profile(profile: str) -> None:
+    if profile not in DB_PROFILES:
+        raise Exception("unknown database profile: {!r}, must be one of: {}"
+                        .format(profile, ", ".join(DB_PROFILES)))
+
+
+# columns of the fileinfo table shared by all schema versions,
+# without the id
+FILEINFO_COLUMNS = ["type", "path",
+                    "dev", "ino",
+                    "mode", "nlink",
+                    "uid", "gid",
+                    "rdev",
+                    "size", "blksize", "blocks",
+                    "atime", "ctime", "mtime",
+                    "time",
+                    "birth", "death",
+                    "directory_id"]
+
+
+class DirStat(NamedTuple):
+    """Totals of the alive entries below a directory, recursively"""
+
+    size: int
+    blocks: int
+
+    # number of regular files
+    count: int
+
+    # newest mtime, only grows until the rollup is rebuilt
+    mtime: Optional[float]
+
+
+class DuplicateGroup(NamedTuple):
+    """Alive files sharing the same content"""
+
+    blob: BlobInfo
+
+    # bytes freed by keeping a single copy, hardlinks count as one copy
+    wasted: int
+
+    fileinfos: list[FileInfo]
 
 
 def path_iter(path: str) -> Iterator[str]:
@@ -68,6 +192,41 @@ def grange_to_sql(grange: Optional[GenerationRange], args: list[Any]) -> str:
     return grange_stmt
 
 
+def glob_prefix(pattern: str) -> str:
+    """Returns the part of the glob 'pattern' before the first wildcard"""
+    for i, c in enumerate(pattern):
+        if c in "*?[":
+            return pattern[:i]
+    return pattern
+
+
+def prefix_range(prefix: bytes) -> Optional[bytes]:
+    """Returns the smallest string that is larger than every string
+    starting with 'prefix', None when there is none"""
+    prefix = prefix.rstrip(b"\xff")
+    if not prefix:
+        return None
+    else:
+        return prefix[:-1] + bytes([prefix[-1] + 1])
+
+
+def blob_digests(blob: BlobInfo) -> list[tuple[str, bytes]]:
+    """Returns the names and values of the digests of 'blob', the
+    strongest first"""
+    return [(name, getattr(blob, name + "_raw"))
+            for name in ("blake2b", "sha1", "md5")
+            if getattr(blob, name + "_raw") is not None]
+
+
+def digests_match(digests: Sequence[tuple[str, bytes]], row: dict[str, Optional[bytes]]) -> bool:
+    """Returns True when the content with 'digests' and the one with
+    the digests 'row' are the same: they share at least one digest and
+    none of the shared ones differ. Contents hashed with different
+    digest sets still match through the ones they have in common."""
+    shared = [(value, row[name]) for name, value in digests if row[name] is not None]
+    return shared != [] and all(value == other for value, other in shared)
+
+
 def generation_from_row(row: list[Any]) -> Generation:
     if len(row) != 4:
         raise Exception("generation_from_row: to many columns: {}".format(row))
@@ -79,7 +238,8 @@ def fileinfo_from_row(row: list[Any]) -> FileInfo:
     fileinfo = FileInfo(row[2])
 
     fileinfo.rowid = row[0]
-    fileinfo.kind = row[1]
+    # only a handful of distinct values, share the string objects
+    fileinfo.kind = sys.intern(row[1]) if row[1] is not None else None
     fileinfo.path = row[2]
     fileinfo.dev = row[3]
     fileinfo.ino = row[4]
@@ -102,6 +262,14 @@ def fileinfo_from_row(row: list[Any]) -> FileInfo:
     if len(row) == 20:
         pass  # no BlobInfo requested
     elif len(row) == 25:
+        # layout of Database.fileinfo_select
+        if row[20] is not None:
+            fileinfo.blob = BlobInfo(size=row[20],
+                                     md5=row[21],
+                                     sha1=row[22],
+                                     blake2b=row[23])
+        fileinfo.target = row[24]
+    elif len(row) == 26:
         if row[21] is None:
             pass  # no BlobInfo available
         elif row[21] != row[0]:
@@ -109,8 +277,9 @@ def fileinfo_from_row(row: list[Any]) -> FileInfo:
         else:
             fileinfo.blob = BlobInfo(size=row[22],
                                      md5=row[23],
-                                     sha1=row[24])
-    elif len(row) == 28:
+                                     sha1=row[24],
+                                     blake2b=row[25])
+    elif len(row) == 29:
         if row[21] is None:
             pass  # no BlobInfo available
         elif row[21] != row[0]:
@@ -118,12 +287,13 @@ def fileinfo_from_row(row: list[Any]) -> FileInfo:
         else:
             fileinfo.blob = BlobInfo(size=row[22],
                                      md5=row[23],
-                                     sha1=row[24])
+                                     sha1=row[24],
+                                     blake2b=row[25])
 
-        if row[25] is not None:
-            if row[26] != row[0]:
-                raise Exception("fileinfo_id doesn't match: {} != {}".format(row[0], row[26]))
-            fileinfo.target = row[27]
+        if row[26] is not None:
+            if row[27] != row[0]:
+                raise Exception("fileinfo_id doesn't match: {} != {}".format(row[0], row[27]))
+            fileinfo.target = row[28]
     else:
         raise Exception("unknown row length: {}: {}".format(len(row), row))
 
@@ -136,6 +306,10 @@ class IDatabase(ABC):
     def store(self, fileinfo: FileInfo) -> None:
         pass
 
+    @abstractmethod
+    def store_many(self, fileinfos: Iterable[FileInfo]) -> None:
+        pass
+
     @abstractmethod
     def commit(self) -> None:
         pass
@@ -148,6 +322,18 @@ class IDatabase(ABC):
     def deinit_generation(self, rowid: int) -> None:
         pass
 
+    @abstractmethod
+    def resume_generation(self) -> Optional[int]:
+        pass
+
+    @abstractmethod
+    def store_checkpoint(self, root: str, path: str, finished: bool) -> None:
+        pass
+
+    @abstractmethod
+    def get_checkpoint(self, root: str) -> Optional[tuple[str, bool]]:
+        pass
+
     @abstractmethod
     def get_one_by_path(self, path: str, grange: Optional[GenerationRange] = None) -> Optional[FileInfo]:
         pass
@@ -156,6 +342,23 @@ class IDatabase(ABC):
     def get_directory_by_path(self, path: str) -> Iterator[FileInfo]:
         pass
 
+    @abstractmethod
+    def get_by_inode(self, dev: int, ino: int, grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        pass
+
+    @abstractmethod
+    def get_by_inodes(self, inodes: Iterable[tuple[int, int]],
+                      grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        pass
+
+    @abstractmethod
+    def get_storage_id(self, name: str) -> int:
+        pass
+
+    @abstractmethod
+    def uses_storage_ids(self) -> bool:
+        pass
+
     @abstractmethod
     def mark_removed(self, fileinfo: FileInfo) -> None:
         pass
@@ -167,7 +370,14 @@ class IDatabase(ABC):
 
 class Database(IDatabase):
 
-    def __init__(self, filename: str, sql_debug: bool = False) -> None:
+    def __init__(self, filename: str, sql_debug: bool = False,
+                 schema_version: int = SCHEMA_VERSION,
+                 profile: str = "default") -> None:
+        """'schema_version' is the layout used when a new database is
+        created, existing ones keep theirs until migrate() is called.
+        'profile' is one of DB_PROFILES."""
+        check_db_profile(profile)
+
         self.sql_debug = sql_debug
 
         self.insert_count = 0  # number of inserts since last commit
@@ -185,19 +395,195 @@ class Database(IDatabase):
 
         self.current_generation: Optional[int] = None
 
+        # maps directory paths to directory.id
+        self.directory_cache: LRUCache[str, int] = LRUCache(DIRECTORY_CACHE_SIZE)
+
+        # maps (size, md5, sha1, blake2b) to blob.id
+        self.blob_cache: LRUCache[tuple[int, Optional[bytes], Optional[bytes], Optional[bytes]], int] = \
+            LRUCache(BLOB_CACHE_SIZE)
+
+        # changes to the dirstat table that are written on commit(),
+        # maps the directory path to [size, blocks, count, mtime]
+        self.dirstat_deltas: dict[str, list[Any]] = {}
+        self.has_dirstat = False
+
+        self.new_schema_version = schema_version
+        self.schema_version = schema_version
+        self.fileinfo_columns: list[str] = []
+        self.fileinfo_select = ""
+        self.fileinfo_insert = ""
+        self.blob_table = ""
+        self.blob_join = ""
+        self.fileinfo_from = ""
+        self.path_column = ""
+        self.path_key = ""
+
         cur = self.con.cursor()
         self.execute(cur, "PRAGMA journal_mode = WAL")
+        # the PRAGMA returns the new mode, as long as it isn't fetched
+        # the statement is in progress and blocks commit()
+        cur.fetchall()
         self.init_tables()
 
+        # after init_tables(), as the profile might make the connection
+        # read-only
+        self.set_profile(profile)
+
+    def set_profile(self, profile: str) -> None:
+        """Apply the PRAGMAs of 'profile', pending changes are committed
+        first, as some of them can't be changed inside a transaction"""
+        check_db_profile(profile)
+
+        self.con.commit()
+        cur = self.con.cursor()
+        for name, value in DB_PROFILES[profile].items():
+            self.execute(cur, "PRAGMA {} = {}".format(name, value))
+        self.profile = profile
+
+    def init_schema_version(self) -> None:
+        cur = self.con.cursor()
+        self.execute(cur, "PRAGMA user_version")
+        version = cast(int, cur.fetchall()[0][0])
+        if version == 0:
+            # databases from before the versioning have a fileinfo
+            # table already, everything else is new
+            self.execute(
+                cur,
+                "SELECT name "
+                "FROM sqlite_master "
+                "WHERE type = 'table' AND name = 'fileinfo'")
+            version = 1 if cur.fetchall() != [] else self.new_schema_version
+            self.execute(cur, "PRAGMA user_version = {:d}".format(version))
+        elif version > SCHEMA_VERSION:
+            raise Exception("database schema version {} is newer than the supported version {}"
+                            .format(version, SCHEMA_VERSION))
+
+        self.set_schema_version(version)
+
+    def set_schema_version(self, version: int) -> None:
+        self.schema_version = version
+
+        if version >= 2:
+            self.fileinfo_columns = FILEINFO_COLUMNS + ["blob_id"]
+            self.blob_table = "blob"
+            self.blob_join = "JOIN blob ON blob.id = fileinfo.blob_id "
+        else:
+            self.fileinfo_columns = FILEINFO_COLUMNS
+            self.blob_table = "blobinfo"
+            self.blob_join = "JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
+
+        if version >= 3:
+            self.fileinfo_columns = ["name" if column == "path" else column
+                                     for column in self.fileinfo_columns]
+            self.fileinfo_from = "FROM fileinfo JOIN directory ON directory.id = fileinfo.directory_id "
+            self.path_column = PATH_FROM_NAME
+            self.path_key = "fileinfo.directory_id, fileinfo.name"
+        else:
+            self.fileinfo_from = "FROM fileinfo "
+            self.path_column = "fileinfo.path"
+            self.path_key = "fileinfo.path"
+
+        blob_columns = ", ".join("{}.{}".format(self.blob_table, column)
+                                 for column in ["size"] + CHECKSUM_TYPES)
+
+        # SELECT and FROM part of the queries that return whole
+        # FileInfos, see fileinfo_from_row() for the layout
+        self.fileinfo_select = (
+            "SELECT {}, {}, linkinfo.target "
+            "{}"
+            "LEFT {}"
+            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id "
+            .format(", ".join(self.path_column if column == "path" else "fileinfo." + column
+                              for column in ["id"] + FILEINFO_COLUMNS),
+                    blob_columns,
+                    self.fileinfo_from,
+                    self.blob_join))
+
+        self.fileinfo_insert = (
+            "INSERT INTO fileinfo ({}) VALUES ({})"
+            .format(", ".join(["id"] + self.fileinfo_columns),
+                    ", ".join(["?"] + ["cast(? as TEXT)" if column in ("path", "name") else "?"
+                                       for column in self.fileinfo_columns])))
+
+    def path_condition(self, path: str, args: list[Any]) -> str:
+        """Returns an SQL condition matching the FileInfos at 'path' and
+        appends its arguments to 'args'"""
+        if self.schema_version >= 3:
+            directory_id = self.lookup_directory(os.path.dirname(path))
+            args += [directory_id, os.fsencode(os.path.basename(path))]
+            return "fileinfo.directory_id = ? AND fileinfo.name = cast(? as TEXT)"
+        else:
+            args.append(os.fsencode(path))
+            return "fileinfo.path = cast(? as TEXT)"
+
+    def glob_condition(self, pattern: str, args: list[Any]) -> str:
+        """Returns an SQL condition matching the FileInfos whose path
+        matches the glob 'pattern' and appends its arguments to 'args',
+        the query must be FROM self.fileinfo_from"""
+        if self.schema_version >= 3:
+            # the directory of every match starts with the directory
+            # part of the literal prefix, this allows the directory
+            # index to narrow things down before the full path is
+            # assembled
+            directory = os.fsencode(os.path.dirname(glob_prefix(pattern)))
+            end = prefix_range(directory)
+            if end is None:
+                args += [directory + b"*", os.fsencode(pattern)]
+                return "(directory.path GLOB cast(? as TEXT) AND {} GLOB cast(? as TEXT))".format(self.path_column)
+            else:
+                # GLOB can't use an index when the pattern is a cast()
+                # expression, the range on the literal prefix can
+                args += [directory, end, directory + b"*", os.fsencode(pattern)]
+                return ("(directory.path >= cast(? as TEXT) AND directory.path < cast(? as TEXT) AND "
+                        "directory.path GLOB cast(? as TEXT) AND {} GLOB cast(? as TEXT))").format(self.path_column)
+        else:
+            prefix = os.fsencode(glob_prefix(pattern))
+            end = prefix_range(prefix)
+            if end is None:
+                args.append(os.fsencode(pattern))
+                return "fileinfo.path GLOB cast(? as TEXT)"
+            else:
+                args += [prefix, end, os.fsencode(pattern)]
+                return ("(fileinfo.path >= cast(? as TEXT) AND fileinfo.path < cast(? as TEXT) AND "
+                        "fileinfo.path GLOB cast(? as TEXT))")
+
+    def subtree_condition(self, root: str, args: list[Any]) -> str:
+        """Returns an SQL condition matching the FileInfos below the
+        directory 'root' and appends its arguments to 'args', the query
+        must be FROM self.fileinfo_from"""
+        prefix_raw = os.fsencode(os.path.join(root, ""))
+        end = prefix_range(prefix_raw)
+        if self.schema_version >= 3:
+            args += [os.fsencode(root), end, os.fsencode(root), prefix_raw]
+            return ("(directory.path >= cast(? as TEXT) AND directory.path < cast(? as TEXT) AND "
+                    "(directory.path = cast(? as TEXT) OR directory.path >= cast(? as TEXT)) AND "
+                    "fileinfo.name != '')")
+        else:
+            args += [prefix_raw, end]
+            return "(fileinfo.path >= cast(? as TEXT) AND fileinfo.path < cast(? as TEXT))"
+
+    def table_exists(self, name: str) -> bool:
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT name "
+            "FROM sqlite_master "
+            "WHERE type = 'table' AND name = ?",
+            [name])
+        return cur.fetchall() != []
+
     def init_tables(self) -> None:
+        new_database = not self.table_exists("fileinfo")
+        self.init_schema_version()
+
         cur = self.con.cursor()
         self.execute(
             cur,
             "CREATE TABLE IF NOT EXISTS fileinfo("
             "id INTEGER PRIMARY KEY, "
             # "storage_id INTEGER, "
-            "type TEXT, "
-            "path TEXT, "
+            "type TEXT, " +
+            ("name TEXT, " if self.schema_version >= 3 else "path TEXT, ") +
 
             "dev INTEGER, "
             "ino INTEGER, "
@@ -224,18 +610,28 @@ class Database(IDatabase):
             "birth INTEGER, "
             "death INTEGER, "
 
-            "directory_id INTEGER"
+            "directory_id INTEGER" +
+            (", blob_id INTEGER" if self.schema_version >= 2 else "") +
             ")")
 
-        self.execute(
-            cur,
-            "CREATE TABLE IF NOT EXISTS blobinfo("
-            "id INTEGER PRIMARY KEY, "
-            "fileinfo_id INTEGER, "
-            "size INTEGER, "
-            "md5 TEXT, "
-            "sha1 TEXT"
-            ")")
+        if self.schema_version >= 2:
+            self.create_blob_table()
+        else:
+            self.execute(
+                cur,
+                "CREATE TABLE IF NOT EXISTS blobinfo("
+                "id INTEGER PRIMARY KEY, "
+                "fileinfo_id INTEGER, "
+                "size INTEGER, "
+                "md5 TEXT, "
+                "sha1 TEXT, "
+                "blake2b TEXT"
+                ")")
+
+            # databases created before blake2b support lack the column
+            self.execute(cur, "PRAGMA table_info(blobinfo)")
+            if "blake2b" not in [row[1] for row in cur.fetchall()]:
+                self.execute(cur, "ALTER TABLE blobinfo ADD COLUMN blake2b TEXT")
 
         self.create_directory_table()
 
@@ -247,6 +643,9 @@ class Database(IDatabase):
             "target TEXT "
             ")")
 
+        # filesystems by a name that is stable across reboots, see
+        # scatterbackup.storage, the ids are stored in fileinfo.dev
+        # from schema version 4 on
         self.execute(
             cur,
             "CREATE TABLE IF NOT EXISTS storageinfo("
@@ -263,6 +662,24 @@ class Database(IDatabase):
             "command TEXT"
             ")")
 
+        # progress of an sb-update run, 'path' is the last directory
+        # below 'root' that was completely processed in walk order
+        self.execute(
+            cur,
+            "CREATE TABLE IF NOT EXISTS checkpoint("
+            "id INTEGER PRIMARY KEY, "
+            "generation_id INTEGER, "
+            "root TEXT, "
+            "path TEXT, "
+            "finished INTEGER"
+            ")")
+
+        # an empty database has complete totals from the start, older
+        # ones only get them from 'sb-dbtool --rebuild-dirstat'
+        if new_database:
+            self.create_dirstat_table()
+        self.has_dirstat = self.table_exists("dirstat")
+
         def py_dirname(p: Optional[bytes]) -> Optional[bytes]:
             """SQL text with invalid UTF-8 can't be passed directly to a custom
             functions, only 'None' will be received. The UTF-8 needs
@@ -284,22 +701,231 @@ class Database(IDatabase):
 
         self.con.create_function("py_dirname", 1, py_dirname)
 
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_index ON fileinfo (path)")
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_directory_id_index ON fileinfo (directory_id)")
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo2_index ON fileinfo (death, path)")
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_death_index ON fileinfo (death)")
+        self.create_indices()
+
+        self.con.commit()
+
+    def create_indices(self) -> None:
+        """Create the indices that don't exist yet"""
+        cur = self.con.cursor()
+
+        if self.schema_version >= 3:
+            self.create_name_indices()
+        else:
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_index ON fileinfo (path)")
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_directory_id_index ON fileinfo (directory_id)")
+            # most rows are dead history, lookups of the live ones only
+            # need to search these
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_alive_path_index ON fileinfo (path) "
+                         "WHERE death IS NULL")
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_alive_directory_id_index ON fileinfo (directory_id) "
+                         "WHERE death IS NULL")
+            # superseded by fileinfo_alive_path_index
+            self.execute(cur, "DROP INDEX IF EXISTS fileinfo2_index")
+        # alive rows are covered by the partial indices above, any
+        # comparison on death implies 'death IS NOT NULL'
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_dead_index ON fileinfo (death) "
+                     "WHERE death IS NOT NULL")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo_death_index")
         self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_birth_index ON fileinfo (birth)")
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_inode_index ON fileinfo (dev, ino)")
 
         self.execute(cur, "CREATE UNIQUE INDEX IF NOT EXISTS directory_path_index ON directory (path)")
         self.execute(cur, "CREATE INDEX IF NOT EXISTS directory_parent_id_index ON directory (parent_id)")
 
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_fileinfo_id_index ON blobinfo (fileinfo_id)")
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_sha1_index ON blobinfo (sha1)")
-        self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_md5_index ON blobinfo (md5)")
+        self.execute(cur, "CREATE UNIQUE INDEX IF NOT EXISTS storageinfo_name_index ON storageinfo (name)")
+
+        if self.schema_version >= 2:
+            self.create_blob_indices()
+        else:
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_fileinfo_id_index ON blobinfo (fileinfo_id)")
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_sha1_index ON blobinfo (sha1)")
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_md5_index ON blobinfo (md5)")
+            self.execute(cur, "CREATE INDEX IF NOT EXISTS blobinfo_blake2b_index ON blobinfo (blake2b)")
 
         self.execute(cur, "CREATE INDEX IF NOT EXISTS linkinfo_fileinfo_id_index ON linkinfo (fileinfo_id)")
 
-        self.con.commit()
+        self.execute(cur, "CREATE UNIQUE INDEX IF NOT EXISTS checkpoint_index ON checkpoint (generation_id, root)")
+
+    def create_blob_table(self) -> None:
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "CREATE TABLE IF NOT EXISTS blob("
+            "id INTEGER PRIMARY KEY, "
+            "size INTEGER, "
+            "md5 BLOB, "
+            "sha1 BLOB, "
+            "blake2b BLOB"
+            ")")
+
+    def create_blob_indices(self) -> None:
+        cur = self.con.cursor()
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_blob_id_index ON fileinfo (blob_id)")
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS blob_sha1_index ON blob (sha1)")
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS blob_md5_index ON blob (md5)")
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS blob_blake2b_index ON blob (blake2b)")
+
+    def create_name_indices(self) -> None:
+        cur = self.con.cursor()
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_name_index ON fileinfo (directory_id, name)")
+        self.execute(cur, "CREATE INDEX IF NOT EXISTS fileinfo_alive_name_index ON fileinfo (directory_id, name) "
+                     "WHERE death IS NULL")
+
+    def migrate(self) -> None:
+        """Convert the database to the current schema version. Each step
+        happens in a single transaction, other connections can keep
+        reading the old layout until it is committed."""
+        if self.schema_version >= SCHEMA_VERSION:
+            print("database is already at schema version {}".format(self.schema_version))
+            return
+
+        while self.schema_version < SCHEMA_VERSION:
+            version = self.schema_version + 1
+
+            self.con.commit()
+            cur = self.con.cursor()
+            self.execute(cur, "BEGIN IMMEDIATE")
+
+            if version == 2:
+                self.migrate_blobinfo()
+            elif version == 3:
+                self.migrate_path()
+            elif version == 4:
+                self.migrate_storage()
+
+            self.execute(cur, "PRAGMA user_version = {:d}".format(version))
+            self.con.commit()
+
+            self.set_schema_version(version)
+            print("Migration to schema version {} complete".format(version))
+
+        print("Use 'sb-fsck --vacuum' to reclaim the free space")
+
+    def migrate_blobinfo(self) -> None:
+        cur = self.con.cursor()
+
+        print("Creating blob table")
+        self.execute(cur, "ALTER TABLE fileinfo ADD COLUMN blob_id INTEGER")
+        self.create_blob_table()
+        self.create_blob_indices()
+
+        self.execute(cur, "SELECT COUNT(*) FROM blobinfo")
+        total = cur.fetchall()[0][0]
+
+        print("Moving {} BlobInfos to the blob table".format(total))
+        count = 0
+        blobinfo_cur = self.con.cursor()
+        self.execute(
+            blobinfo_cur,
+            "SELECT fileinfo_id, size, md5, sha1, blake2b "
+            "FROM blobinfo")
+        while True:
+            rows = blobinfo_cur.fetchmany(self._max_insert_count)
+            if rows == []:
+                break
+
+            self.executemany(
+                cur,
+                "UPDATE fileinfo "
+                "SET blob_id = ? "
+                "WHERE id = ?",
+                [[self.store_blob(BlobInfo(size=size, md5=md5, sha1=sha1, blake2b=blake2b)), fileinfo_id]
+                 for fileinfo_id, size, md5, sha1, blake2b in rows])
+
+            count += len(rows)
+            print("{}/{} BlobInfos moved".format(count, total))
+        blobinfo_cur.close()
+
+        print("Deleting blobinfo table")
+        self.execute(cur, "DROP TABLE blobinfo")
+
+    def migrate_path(self) -> None:
+        cur = self.con.cursor()
+
+        print("Adding name column to fileinfo table")
+        self.execute(cur, "ALTER TABLE fileinfo ADD COLUMN name TEXT")
+
+        self.execute(cur, "SELECT COUNT(*) FROM fileinfo")
+        total = cur.fetchall()[0][0]
+
+        # directory_id is set again, so that the name is guaranteed to
+        # be relative to the right directory
+        print("Splitting {} paths into directory and name".format(total))
+        count = 0
+        path_cur = self.con.cursor()
+        self.execute(
+            path_cur,
+            "SELECT id, cast(path AS BLOB) "
+            "FROM fileinfo")
+        while True:
+            rows = path_cur.fetchmany(self._max_insert_count)
+            if rows == []:
+                break
+
+            self.executemany(
+                cur,
+                "UPDATE fileinfo "
+                "SET directory_id = ?, name = cast(? AS TEXT) "
+                "WHERE id = ?",
+                [[self.store_directory(os.fsdecode(os.path.dirname(path))), os.path.basename(path), fileinfo_id]
+                 for fileinfo_id, path in rows])
+
+            count += len(rows)
+            print("{}/{} paths split".format(count, total))
+        path_cur.close()
+
+        print("Deleting path column")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo_index")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo2_index")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo_alive_path_index")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo_directory_id_index")
+        self.execute(cur, "DROP INDEX IF EXISTS fileinfo_alive_directory_id_index")
+        self.execute(cur, "ALTER TABLE fileinfo DROP COLUMN path")
+        self.create_name_indices()
+
+    def migrate_storage(self) -> None:
+        # scatterbackup.storage depends on this module
+        from scatterbackup.storage import device_uuids, find_storage_name
+
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT DISTINCT dev "
+            "FROM fileinfo "
+            "WHERE dev IS NOT NULL")
+        devs = [row[0] for row in cur.fetchall()]
+
+        # an st_dev is only known to still be the same filesystem when
+        # a directory stored with it still has it, the others get a
+        # storageinfo row of their own, so they can't collide, see
+        # find_storage_name()
+        print("Registering the filesystems of {} device numbers".format(len(devs)))
+        uuids = device_uuids()
+        dev_map: list[tuple[int, int]] = []
+        for dev in devs:
+            self.execute(
+                cur,
+                "SELECT " + self.path_column + " " +
+                self.fileinfo_from +
+                "WHERE fileinfo.dev = ? AND fileinfo.type = 'directory' AND fileinfo.death IS NULL "
+                "LIMIT 1",
+                [dev])
+            rows = cur.fetchall()
+
+            name = find_storage_name(rows[0][0], dev, uuids) if rows != [] else "dev:{:d}".format(dev)
+            dev_map.append((dev, self.get_storage_id(name)))
+
+        print("Replacing device numbers with storageinfo ids")
+        self.execute(cur, "CREATE TEMP TABLE dev_map(dev INTEGER PRIMARY KEY, storage_id INTEGER)")
+        self.executemany(cur, "INSERT INTO dev_map (dev, storage_id) VALUES (?, ?)", dev_map)
+        # a single UPDATE, as the new ids can be equal to old device numbers
+        self.execute(
+            cur,
+            "UPDATE fileinfo "
+            "SET dev = (SELECT storage_id FROM dev_map WHERE dev_map.dev = fileinfo.dev) "
+            "WHERE dev IS NOT NULL")
+        self.execute(cur, "DROP TABLE dev_map")
 
     def init_generation(self, cmd: str) -> int:
         current_time = int(round(time.time() * 1000**3))
@@ -327,7 +953,65 @@ class Database(IDatabase):
             "  id = ?",
             [current_time, rowid])
 
-    def store_directory(self, path: str) -> int:
+        # checkpoints are only needed to resume an unfinished generation
+        self.execute(
+            cur,
+            "DELETE FROM checkpoint "
+            "WHERE generation_id = ?",
+            [rowid])
+
+    def resume_generation(self) -> Optional[int]:
+        """Continue the most recent generation if it was never finished,
+        returns its id or None"""
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT id, end "
+            "FROM generation "
+            "ORDER BY id DESC "
+            "LIMIT 1")
+        rows = cur.fetchall()
+        if rows == [] or rows[0][1] is not None:
+            return None
+        else:
+            self.current_generation = cast(int, rows[0][0])
+            return self.current_generation
+
+    def store_checkpoint(self, root: str, path: str, finished: bool) -> None:
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "INSERT OR REPLACE INTO checkpoint "
+            "(generation_id, root, path, finished) "
+            "VALUES "
+            "(?, cast(? AS TEXT), cast(? AS TEXT), ?)",
+            [self.current_generation, os.fsencode(root), os.fsencode(path), int(finished)])
+
+    def get_checkpoint(self, root: str) -> Optional[tuple[str, bool]]:
+        """Returns the last processed path below 'root' in the current
+        generation and whether 'root' was finished"""
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT path, finished "
+            "FROM checkpoint "
+            "WHERE "
+            "  generation_id = ? AND "
+            "  root = cast(? AS TEXT)",
+            [self.current_generation, os.fsencode(root)])
+        rows = cur.fetchall()
+        if rows == []:
+            return None
+        else:
+            return (rows[0][0], bool(rows[0][1]))
+
+    def lookup_directory(self, path: str) -> Optional[int]:
+        """Returns the directory.id of 'path' or None when the directory
+        isn't in the database"""
+        directory_id = self.directory_cache.get(path)
+        if directory_id is not None:
+            return directory_id
+
         cur = self.con.cursor()
         self.execute(
             cur,
@@ -336,71 +1020,172 @@ class Database(IDatabase):
             "WHERE path = cast(? AS TEXT)",
             [os.fsencode(path)])
         rows = cur.fetchall()
-        if len(rows) == 1:
-            return cast(int, rows[0][0])
+        if rows == []:
+            return None
         else:
-            # self.execute(cur, "SAVEPOINT store_directory")
+            directory_id = cast(int, rows[0][0])
+            self.directory_cache.put(path, directory_id)
+            return directory_id
+
+    def get_child_directories(self, path: str) -> Iterator[str]:
+        """Returns the paths of the directories in the directory table
+        whose parent is 'path', including ones without alive content"""
+        directory_id = self.lookup_directory(path)
+        if directory_id is None:
+            return iter(())
 
-            # create path entries
-            self.executemany(
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT path "
+            "FROM directory "
+            "WHERE parent_id = ? AND id != parent_id",
+            [directory_id])
+        return (row[0] for row in cur)
+
+    def has_alive_below(self, path: str) -> bool:
+        """Returns True when there is an alive entry anywhere below the
+        directory 'path', used when there is no dirstat table"""
+        args: list[Any] = []
+        stmt = self.subtree_condition(path, args)
+
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT 1 " +
+            self.fileinfo_from +
+            "WHERE fileinfo.death IS NULL AND " + stmt + " "
+            "LIMIT 1",
+            args)
+        return cur.fetchall() != []
+
+    def get_storage_id(self, name: str) -> int:
+        """Returns the id of the filesystem 'name' in the storageinfo
+        table, it is registered when it isn't known yet"""
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT id "
+            "FROM storageinfo "
+            "WHERE name = ?",
+            [name])
+        rows = cur.fetchall()
+        if rows != []:
+            return cast(int, rows[0][0])
+
+        self.execute(
+            cur,
+            "INSERT INTO storageinfo (name) "
+            "VALUES (?)",
+            [name])
+        assert cur.lastrowid is not None
+        return cur.lastrowid
+
+    def uses_storage_ids(self) -> bool:
+        """True when fileinfo.dev holds storageinfo ids, False for
+        databases from before schema version 4, which have st_dev"""
+        return self.schema_version >= 4
+
+    def store_directory(self, path: str) -> int:
+        """Returns the directory.id of 'path', the directory and all its
+        missing ancestors are added to the directory table as needed"""
+        directory_id = self.lookup_directory(path)
+        if directory_id is not None:
+            return directory_id
+
+        # find the closest ancestor that is already known
+        missing = [path]
+        parent_id: Optional[int] = None
+        for p in itertools.islice(path_iter(path), 1, None):
+            parent_id = self.lookup_directory(p)
+            if parent_id is not None:
+                break
+            missing.append(p)
+
+        # insert the missing directories top down, so that parent_id
+        # is always known
+        cur = self.con.cursor()
+        for p in reversed(missing):
+            self.execute(
                 cur,
                 "INSERT OR IGNORE INTO directory "
-                "VALUES (NULL, cast(? AS TEXT), NULL)",
-                [[os.fsencode(p)] for p in path_iter(path)])
-
-            # update parent_ids
-            if False:  # this is slow  # type: ignore
-                self.execute(  # type: ignore
-                    cur,
-                    "UPDATE directory "
-                    "SET parent_id = ("
-                    "  SELECT t.id FROM directory AS t "
-                    "  WHERE t.path = cast(py_dirname(cast(directory.path AS BLOB)) AS TEXT))"
-                    "WHERE parent_id IS NULL")
+                "(path, parent_id) "
+                "VALUES (cast(? AS TEXT), ?)",
+                [os.fsencode(p), parent_id])
+            if cur.rowcount == 1:
+                directory_id = cast(int, cur.lastrowid)
             else:
+                # somebody else was faster
                 self.execute(
                     cur,
-                    "SELECT id, path "
+                    "SELECT id "
                     "FROM directory "
-                    "WHERE parent_id IS NULL")
-                parent_is_null = [(row[0], os.path.dirname(row[1])) for row in cur]
+                    "WHERE path = cast(? AS TEXT)",
+                    [os.fsencode(p)])
+                directory_id = cast(int, cur.fetchall()[0][0])
 
-                for d_id, parent_path in parent_is_null:
-                    self.execute(
-                        cur,
-                        "SELECT id "
-                        "FROM directory "
-                        "WHERE path = cast(? AS TEXT)",
-                        [os.fsencode(parent_path)])
-                    rows = cur.fetchall()
-                    if rows == []:
-                        # FIXME: this happens when the above INSERT is
-                        # interrupted before the parent_id are set
-                        # properly
-                        pass
-                    else:
-                        parent_id = rows[0][0]
-
-                        self.execute(
-                            cur,
-                            "UPDATE directory "
-                            "SET parent_id = ?"
-                            "WHERE id = ?",
-                            [parent_id, d_id])
-
-            # self.execute(cur, "RELEASE store_directory")
-
-            # retry to query the directory_id
+            self.directory_cache.put(p, directory_id)
+            parent_id = directory_id
+
+        return cast(int, directory_id)
+
+    def store_blob(self, blob: BlobInfo) -> int:
+        """Returns the blob.id of the content described by 'blob', a new
+        row is only added when the content isn't known yet"""
+        key = (blob.size, blob.md5_raw, blob.sha1_raw, blob.blake2b_raw)
+        blob_id = self.blob_cache.get(key)
+        if blob_id is not None:
+            return blob_id
+
+        cur = self.con.cursor()
+
+        # any shared digest identifies the content, not only the
+        # strongest, the digests configured might have changed since
+        # the content was stored
+        rows = []
+        digests = blob_digests(blob)
+        if digests != []:
             self.execute(
                 cur,
-                "SELECT id "
-                "FROM directory "
-                "WHERE path = cast(? AS TEXT)",
-                [os.fsencode(path)])
-            rows = cur.fetchall()
-            return cast(int, rows[0][0])
+                "SELECT id, md5, sha1, blake2b "
+                "FROM blob "
+                "WHERE size = ? AND (" + " OR ".join("{} = ?".format(name) for name, _ in digests) + ") "
+                "ORDER BY id",
+                [blob.size] + [value for _, value in digests])
+            rows = [row for row in cur.fetchall()
+                    if digests_match(digests, {"md5": row[1], "sha1": row[2], "blake2b": row[3]})]
+
+        if rows == []:
+            self.execute(
+                cur,
+                "INSERT INTO blob "
+                "(size, md5, sha1, blake2b) "
+                "VALUES (?, ?, ?, ?)",
+                [blob.size, blob.md5_raw, blob.sha1_raw, blob.blake2b_raw])
+            blob_id = cast(int, cur.lastrowid)
+        else:
+            blob_id, md5, sha1, blake2b = rows[0]
 
-    def store(self, fileinfo: FileInfo) -> None:
+            # the content might have been stored with a different set
+            # of digests configured
+            if (md5 is None and blob.md5_raw is not None) or \
+               (sha1 is None and blob.sha1_raw is not None) or \
+               (blake2b is None and blob.blake2b_raw is not None):
+                self.execute(
+                    cur,
+                    "UPDATE blob "
+                    "SET "
+                    "  md5 = coalesce(md5, ?), "
+                    "  sha1 = coalesce(sha1, ?), "
+                    "  blake2b = coalesce(blake2b, ?) "
+                    "WHERE id = ?",
+                    [blob.md5_raw, blob.sha1_raw, blob.blake2b_raw, blob_id])
+
+        self.blob_cache.put(key, cast(int, blob_id))
+        return cast(int, blob_id)
+
+    def fileinfo_row(self, fileinfo: FileInfo) -> list[Any]:
+        """Returns the values for the fileinfo table, without the id"""
         birth: Optional[int]
         if fileinfo.birth is not None:
             birth = fileinfo.birth
@@ -411,41 +1196,52 @@ class Database(IDatabase):
             dname = os.path.dirname(fileinfo.path)
             fileinfo.directory_id = self.store_directory(dname)
 
+        row: list[Any] = [fileinfo.kind,
+                          os.fsencode(os.path.basename(fileinfo.path)
+                                      if self.schema_version >= 3 else fileinfo.path),
+                          fileinfo.dev,
+                          fileinfo.ino,
+                          fileinfo.mode,
+                          fileinfo.nlink,
+                          fileinfo.uid,
+                          fileinfo.gid,
+                          fileinfo.rdev,
+                          fileinfo.size,
+                          fileinfo.blksize,
+                          fileinfo.blocks,
+                          fileinfo.atime,
+                          fileinfo.ctime,
+                          fileinfo.mtime,
+                          fileinfo.time,
+                          birth,
+                          fileinfo.death,
+                          fileinfo.directory_id]
+
+        if self.schema_version >= 2:
+            row.append(self.store_blob(fileinfo.blob) if fileinfo.blob is not None else None)
+
+        return row
+
+    def store(self, fileinfo: FileInfo) -> None:
         cur = self.con.cursor()
 
         # print("store...", fileinfo.path)
         self.execute(
             cur,
-            "INSERT INTO fileinfo VALUES"
-            "(NULL, ?, cast(? as TEXT), ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
-            [fileinfo.kind,
-             os.fsencode(fileinfo.path),
-             fileinfo.dev,
-             fileinfo.ino,
-             fileinfo.mode,
-             fileinfo.nlink,
-             fileinfo.uid,
-             fileinfo.gid,
-             fileinfo.rdev,
-             fileinfo.size,
-             fileinfo.blksize,
-             fileinfo.blocks,
-             fileinfo.atime,
-             fileinfo.ctime,
-             fileinfo.mtime,
-             fileinfo.time,
-             birth,
-             fileinfo.death,
-             fileinfo.directory_id])
+            self.fileinfo_insert,
+            [None] + self.fileinfo_row(fileinfo))
 
         fileinfo_id = cur.lastrowid
 
-        if fileinfo.blob is not None:
+        self.update_dirstat(fileinfo, 1)
+
+        if fileinfo.blob is not None and self.schema_version < 2:
             self.execute(
                 cur,
-                "INSERT INTO blobinfo VALUES"
-                "(NULL, ?, ?, ?, ?)",
-                [fileinfo_id, fileinfo.blob.size, fileinfo.blob.md5, fileinfo.blob.sha1])
+                "INSERT INTO blobinfo "
+                "(fileinfo_id, size, md5, sha1, blake2b) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [fileinfo_id, fileinfo.blob.size, fileinfo.blob.md5, fileinfo.blob.sha1, fileinfo.blob.blake2b])
 
         if fileinfo.target is not None:
             self.execute(
@@ -460,6 +1256,72 @@ class Database(IDatabase):
         if fileinfo.blob is not None:
             self.insert_size += fileinfo.blob.size
 
+        self.auto_commit()
+
+    def store_many(self, fileinfos: Iterable[FileInfo]) -> None:
+        """Like store(), but writes the rows in batches of
+        _max_insert_count with a single executemany() per table"""
+        it = iter(fileinfos)
+        while True:
+            batch = list(itertools.islice(it, self._max_insert_count))
+            if batch == []:
+                break
+            self._store_batch(batch)
+
+    def _store_batch(self, fileinfos: list[FileInfo]) -> None:
+        rows = [self.fileinfo_row(fileinfo) for fileinfo in fileinfos]
+
+        cur = self.con.cursor()
+
+        # The first INSERT acquires the write lock and the rowid. No
+        # other connection can insert until the next commit and new
+        # rowids are allocated as max(rowid) + 1, so the rest of the
+        # batch can be given consecutive ids up front, which is what
+        # allows the blobinfo and linkinfo rows to be written in bulk.
+        self.execute(
+            cur,
+            self.fileinfo_insert,
+            [None] + rows[0])
+        first_id = cast(int, cur.lastrowid)
+        fileinfo_ids = range(first_id, first_id + len(fileinfos))
+
+        if len(rows) > 1:
+            self.executemany(
+                cur,
+                self.fileinfo_insert,
+                [[fileinfo_id] + row for fileinfo_id, row in zip(fileinfo_ids[1:], rows[1:])])
+
+        blob_rows = [[fileinfo_id, fi.blob.size, fi.blob.md5, fi.blob.sha1, fi.blob.blake2b]
+                     for fileinfo_id, fi in zip(fileinfo_ids, fileinfos)
+                     if fi.blob is not None]
+        if blob_rows != [] and self.schema_version < 2:
+            self.executemany(
+                cur,
+                "INSERT INTO blobinfo "
+                "(fileinfo_id, size, md5, sha1, blake2b) "
+                "VALUES (?, ?, ?, ?, ?)",
+                blob_rows)
+
+        link_rows = [[fileinfo_id, fi.target]
+                     for fileinfo_id, fi in zip(fileinfo_ids, fileinfos)
+                     if fi.target is not None]
+        if link_rows != []:
+            self.executemany(
+                cur,
+                "INSERT INTO linkinfo VALUES"
+                "(NULL, ?, ?)",
+                link_rows)
+
+        for fileinfo in fileinfos:
+            self.update_dirstat(fileinfo, 1)
+
+        self.insert_count += len(fileinfos)
+        self.insert_size += sum(row[1] for row in blob_rows)
+
+        self.auto_commit()
+
+    def auto_commit(self) -> None:
+        """Commit if certain thresholds are crossed"""
         if (self._max_insert_count is not None and self.insert_count >= self._max_insert_count) or \
            (self._max_insert_size is not None and self.insert_size >= self._max_insert_size):
             # if time.time() > self.last_commit_time + 5.0:
@@ -476,15 +1338,35 @@ class Database(IDatabase):
             # "WITH RECURSIVE" is *much* faster when we use a plain
             # value in the initial-select instead of this SELECT
             # statement
-            self.execute(
-                cur,
-                "SELECT id FROM directory WHERE path = cast(? AS TEXT)",
-                [os.fsencode(fileinfo.path)])
-            rows = cur.fetchall()
-            if len(rows) != 1:
+            root_directory_id = self.lookup_directory(fileinfo.path)
+            if root_directory_id is None:
                 print("mark_removed_recursive: directory not found: {}".format(fileinfo.path))
             else:
-                root_directory_id = rows[0][0]
+                if self.has_dirstat:
+                    # the whole subtree leaves the rollups of the ancestors
+                    self.flush_dirstat()
+                    self.execute(
+                        cur,
+                        "SELECT size, blocks, count "
+                        "FROM dirstat "
+                        "WHERE directory_id = ?",
+                        [root_directory_id])
+                    for size, blocks, count in cur.fetchall():
+                        self.add_dirstat_delta(os.path.dirname(fileinfo.path), -size, -blocks, -count, None)
+
+                    self.execute(
+                        cur,
+                        "WITH RECURSIVE "
+                        "child_dirs(x) AS ( "
+                        "  VALUES(?) "
+                        "  UNION ALL "
+                        "  SELECT id "
+                        "  FROM directory, child_dirs "
+                        "  WHERE parent_id = x "
+                        ") "
+                        "DELETE FROM dirstat "
+                        "WHERE directory_id IN child_dirs",
+                        [root_directory_id])
 
                 # remove all the children of the root node
                 self.execute(
@@ -507,6 +1389,7 @@ class Database(IDatabase):
                      self.current_generation])
 
             # remove the root node itself
+            self.update_dirstat(fileinfo, -1)
             self.execute(
                 cur,
                 "UPDATE fileinfo "
@@ -518,6 +1401,7 @@ class Database(IDatabase):
         if fileinfo.rowid is None:
             print("mark_removed: no rowid given", fileinfo.path)
         else:
+            self.update_dirstat(fileinfo, -1)
             cur = self.con.cursor()
             self.execute(
                 cur,
@@ -526,32 +1410,169 @@ class Database(IDatabase):
                 "WHERE fileinfo.id = ?",
                 [self.current_generation, fileinfo.rowid])
 
-    def get_directory_by_path(self, path: str) -> Iterator[FileInfo]:
-        """Returns the directory given by 'path', does not recurse into the directory"""
+    def create_dirstat_table(self) -> None:
+        """Create the table with the recursive totals of the alive
+        entries below each directory, maintained by store() and
+        mark_removed()"""
         cur = self.con.cursor()
         self.execute(
             cur,
-            "SELECT id "
+            "CREATE TABLE IF NOT EXISTS dirstat("
+            "directory_id INTEGER PRIMARY KEY, "
+            "size INTEGER, "
+            "blocks INTEGER, "
+            "count INTEGER, "
+            "mtime INTEGER"
+            ")")
+        self.has_dirstat = True
+
+    def update_dirstat(self, fileinfo: FileInfo, sign: int) -> None:
+        """Record that the alive 'fileinfo' was added (sign=1) or removed
+        (sign=-1) in the rollups of its ancestors"""
+        if not self.has_dirstat or fileinfo.death is not None:
+            return
+
+        self.add_dirstat_delta(os.path.dirname(fileinfo.path),
+                               sign * (fileinfo.size or 0),
+                               sign * (fileinfo.blocks or 0),
+                               sign if fileinfo.kind == "file" else 0,
+                               fileinfo.mtime if sign > 0 else None)
+
+    def add_dirstat_delta(self, path: str, size: int, blocks: int, count: int, mtime: Optional[float]) -> None:
+        if not self.has_dirstat:
+            return
+
+        delta = self.dirstat_deltas.get(path)
+        if delta is None:
+            self.dirstat_deltas[path] = [size, blocks, count, mtime]
+        else:
+            delta[0] += size
+            delta[1] += blocks
+            delta[2] += count
+            if mtime is not None and (delta[3] is None or mtime > delta[3]):
+                delta[3] = mtime
+
+    def flush_dirstat(self) -> None:
+        """Write the pending changes to the dirstat table, a change to a
+        directory is added to all its ancestors"""
+        if not self.dirstat_deltas:
+            return
+
+        totals: dict[str, list[Any]] = {}
+        for path, (size, blocks, count, mtime) in self.dirstat_deltas.items():
+            for p in path_iter(path):
+                total = totals.get(p)
+                if total is None:
+                    totals[p] = [size, blocks, count, mtime]
+                else:
+                    total[0] += size
+                    total[1] += blocks
+                    total[2] += count
+                    if mtime is not None and (total[3] is None or mtime > total[3]):
+                        total[3] = mtime
+        self.dirstat_deltas = {}
+
+        cur = self.con.cursor()
+        self.executemany(
+            cur,
+            "INSERT INTO dirstat "
+            "(directory_id, size, blocks, count, mtime) "
+            "VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (directory_id) DO UPDATE SET "
+            "  size = size + excluded.size, "
+            "  blocks = blocks + excluded.blocks, "
+            "  count = count + excluded.count, "
+            "  mtime = max(coalesce(mtime, excluded.mtime), coalesce(excluded.mtime, mtime))",
+            [[self.store_directory(p)] + total for p, total in totals.items()])
+
+    def rebuild_dirstat(self) -> None:
+        """Recompute the dirstat table from the fileinfo table, creates
+        it when it doesn't exist yet"""
+        self.create_dirstat_table()
+        self.dirstat_deltas = {}
+
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT directory_id, total(size), total(blocks), total(type = 'file'), max(mtime) "
+            "FROM fileinfo "
+            "WHERE death is NULL AND directory_id IS NOT NULL "
+            "GROUP BY directory_id")
+        totals: dict[int, list[Any]] = {directory_id: [int(size), int(blocks), int(count), mtime]
+                                         for directory_id, size, blocks, count, mtime in cur}
+
+        # children have longer paths than their parents, so they are
+        # complete before they get added to the parent
+        self.execute(
+            cur,
+            "SELECT id, parent_id "
             "FROM directory "
-            "WHERE "
-            "  path = cast(? AS TEXT)",
-            [os.fsencode(path)])
+            "ORDER BY length(path) DESC")
+        for directory_id, parent_id in cur.fetchall():
+            total = totals.get(directory_id)
+            if total is None or parent_id is None or parent_id == directory_id:
+                continue
+
+            parent = totals.get(parent_id)
+            if parent is None:
+                totals[parent_id] = list(total)
+            else:
+                parent[0] += total[0]
+                parent[1] += total[1]
+                parent[2] += total[2]
+                if total[3] is not None and (parent[3] is None or total[3] > parent[3]):
+                    parent[3] = total[3]
+
+        self.execute(cur, "DELETE FROM dirstat")
+        if totals:
+            self.executemany(
+                cur,
+                "INSERT INTO dirstat "
+                "(directory_id, size, blocks, count, mtime) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [[directory_id] + total for directory_id, total in totals.items()])
+
+    def get_dirstat(self, path: str) -> Optional[DirStat]:
+        """Returns the totals of everything below the directory 'path',
+        None when the directory isn't in the database or the database
+        has no dirstat table yet"""
+        if not self.has_dirstat:
+            return None
+
+        self.flush_dirstat()
+
+        directory_id = self.lookup_directory(path)
+        if directory_id is None:
+            return None
+
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            "SELECT size, blocks, count, mtime "
+            "FROM dirstat "
+            "WHERE directory_id = ?",
+            [directory_id])
         rows = cur.fetchall()
+        if rows == []:
+            return DirStat(0, 0, 0, None)
+        else:
+            return DirStat(*rows[0])
 
-        if len(rows) != 1:
+    def get_directory_by_path(self, path: str) -> Iterator[FileInfo]:
+        """Returns the directory given by 'path', does not recurse into the directory"""
+        rowid = self.lookup_directory(path)
+
+        if rowid is None:
             return iter(())
         else:
-            rowid, = rows[0]
-
+            cur = self.con.cursor()
             self.execute(
                 cur,
-                "SELECT * "
-                "FROM fileinfo "
-                "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-                "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id "
+                self.fileinfo_select +
                 "WHERE "
                 "  fileinfo.death is NULL AND "
-                "  fileinfo.directory_id = ?",
+                "  fileinfo.directory_id = ? "
+                "ORDER BY fileinfo.id",
                 [rowid])
 
             return (fileinfo_from_row(row)
@@ -572,29 +1593,73 @@ class Database(IDatabase):
         files as specified by grange"""
         args: list[Any] = []
         grange_stmt = grange_to_sql(grange, args)
+        path_stmt = self.path_condition(path, args)
 
         cur = self.con.cursor()
         self.execute(
             cur,
-            "SELECT * "
-            "FROM fileinfo "
-            "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id " +
+            self.fileinfo_select +
             WHERE(
                 AND(grange_stmt,
-                    "path = cast(? as TEXT)")) +
+                    path_stmt)) +
             "ORDER BY birth ASC",
-            args + [os.fsencode(path)])
+            args)
         return (fileinfo_from_row(row) for row in cur)
 
+    def get_by_inode(self, dev: int, ino: int, grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        """Returns the FileInfos of the inode, the most recent first,
+        which includes all hardlinks and the paths the inode was
+        moved from. 'dev' is the storageinfo id the FileInfos were
+        stored with, or st_dev, see uses_storage_ids(). When grange is None only alive ones are returned."""
+        args: list[Any] = []
+        grange_stmt = grange_to_sql(grange, args)
+        args += [dev, ino]
+
+        cur = self.con.cursor()
+        self.execute(
+            cur,
+            self.fileinfo_select +
+            WHERE(
+                AND(grange_stmt,
+                    "fileinfo.dev = ? AND fileinfo.ino = ?")) +
+            " ORDER BY fileinfo.id DESC",
+            args)
+        return (fileinfo_from_row(row) for row in cur)
+
+    def get_by_inodes(self, inodes: Iterable[tuple[int, int]],
+                      grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        """Like get_by_inode() for many (dev, ino) pairs at once, with
+        one query per INODE_BATCH_SIZE pairs. The FileInfos of an
+        inode come most recent first, the inodes in no particular order."""
+        it = iter(sorted(set(inodes)))
+        while True:
+            batch = list(itertools.islice(it, INODE_BATCH_SIZE))
+            if batch == []:
+                break
+
+            args: list[Any] = []
+            grange_stmt = grange_to_sql(grange, args)
+            for dev, ino in batch:
+                args += [dev, ino]
+
+            cur = self.con.cursor()
+            self.execute(
+                cur,
+                self.fileinfo_select +
+                WHERE(
+                    AND(grange_stmt,
+                        # a plain IN (VALUES ...) doesn't use the index
+                        "(fileinfo.dev, fileinfo.ino) IN (SELECT column1, column2 FROM (VALUES {}))"
+                        .format(", ".join(["(?, ?)"] * len(batch))))) +
+                " ORDER BY fileinfo.id DESC",
+                args)
+            yield from (fileinfo_from_row(row) for row in cur)
+
     def get_all(self) -> Iterator[FileInfo]:
         cur = self.con.cursor()
         self.execute(
             cur,
-            "SELECT * "
-            "FROM fileinfo "
-            "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id ")
+            self.fileinfo_select)
         return (fileinfo_from_row(row) for row in cur)
 
     def sql_print_debug(self, cur: sqlite3.Cursor, sql: str, args_lst: list[Any]) -> None:
@@ -604,7 +1669,8 @@ class Database(IDatabase):
             print("ARGS: {}".format(args))
         print()
 
-        self.execute(cur, "EXPLAIN QUERY PLAN " + sql, args_lst[0])
+        # not self.execute(), that would debug the EXPLAIN as well
+        cur.execute("EXPLAIN QUERY PLAN " + sql, args_lst[0])
         for row in cur:
             print("explain>", row)
 
@@ -643,120 +1709,368 @@ class Database(IDatabase):
                     grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
         patterns = patterns if isinstance(patterns, list) else [patterns]
 
-        grange_args: list[bytes] = []
+        grange_args: list[Any] = []
         grange_stmt: str = grange_to_sql(grange, grange_args)
 
-        glob_args: list[bytes] = []
+        glob_args: list[Any] = []
         glob_stmt_lst: list[str] = []
 
         for pattern in patterns:
-            glob_args.append(os.fsencode(pattern))
-            glob_stmt_lst.append("path glob cast(? as TEXT)")
+            glob_stmt_lst.append(self.glob_condition(pattern, glob_args))
 
         glob_stmt = OR(*glob_stmt_lst)
 
         cur = self.con.cursor()
         self.execute(
             cur,
-            "SELECT * "
-            "FROM fileinfo "
-            "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id " +
+            self.fileinfo_select +
             WHERE(
                 AND(grange_stmt, glob_stmt)),
             grange_args + glob_args)
 
         return (fileinfo_from_row(row) for row in cur)
 
-    def get_by_checksum(self,
-                        checksum_type: str,
-                        checksum: str,
-                        grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
-        grange_args: list[str] = []
-        grange_stmt: str = grange_to_sql(grange, grange_args)
+    def get_changed_by_glob(self,
+                            patterns: Union[list[str], str],
+                            grange: GenerationRange) -> Iterator[FileInfo]:
+        """Returns the FileInfos matching 'patterns' that were born or
+        died in 'grange' in a single scan, ordered by the first
+        generation of 'grange' they were born or died in. Once a
+        FileInfo of generation N arrived, all FileInfos changed before
+        N are complete."""
+        assert grange.start is not None and grange.end is not None
+        patterns = patterns if isinstance(patterns, list) else [patterns]
+
+        args: list[Any] = []
+        grange_stmt = grange_to_sql(GenerationRange(grange.start, grange.end, GenerationRange.INCLUDE_CHANGED),
+                                    args)
+        glob_stmt = OR(*[self.glob_condition(pattern, args) for pattern in patterns])
+        args.append(grange.start)
 
         cur = self.con.cursor()
         self.execute(
             cur,
-            "WITH "
-            "matching_fileinfos AS ( "
-            "  SELECT fileinfo_id "
-            "  FROM blobinfo "
-            "  WHERE "
-            "    {} = ?) "
+            self.fileinfo_select +
+            WHERE(AND(grange_stmt, glob_stmt)) +
+            " ORDER BY "
+            "  CASE WHEN fileinfo.birth >= ? THEN fileinfo.birth ELSE fileinfo.death END ASC, "
+            "  fileinfo.id ASC",
+            args)
 
-            "SELECT * "
-            "FROM fileinfo "
-            "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id "
-            .format(checksum_type) +
-            WHERE(
-                AND(grange_stmt,
-                    "  fileinfo.id in matching_fileinfos")),
-            grange_args + [checksum])
         return (fileinfo_from_row(row) for row in cur)
 
-    def get_duplicates(self, path: str) -> Iterator[list[FileInfo]]:
-        # doing the GLOB early speeds things up a good bit, even so it
-        # has to be done twice
-        stmt = (
-            "WITH "
+    def get_subtree(self, root: str, excludes: Sequence[str] = ()) -> Iterator[tuple[Any, str, str, Any]]:
+        """Returns (key, relpath, kind, content) for every alive entry
+        below the directory 'root', ordered by 'key'. The keys of
+        entries with the same relative path are equal no matter the
+        root, so two subtrees can be merged by them. 'content' is
+        equal for the same content, the blob.id from schema version 2
+        on. The relative paths 'excludes' and everything inside them are
+        skipped in SQLite."""
+        prefix = os.path.join(root, "")
+        prefix_raw = os.fsencode(prefix)
 
-            "  matching_fileinfo_ids AS ("
-            "    SELECT id "
-            "    FROM fileinfo "
-            "    WHERE "
-            "      fileinfo.death is NULL AND"
-            "      path GLOB CAST(? AS TEXT) "
-            "  ), "
+        args: list[Any] = []
+        cur = self.con.cursor()
+        if self.schema_version >= 3:
+            # with the directory table as the outer loop the rows come
+            # in directory.path order from its index, only the entries
+            # of each directory get sorted by name
+            stmt = self.subtree_condition(root, args)
+            for exclude in excludes:
+                exclude_raw = os.fsencode(os.path.join(prefix, exclude, ""))
+                stmt += (" AND NOT (directory.path = cast(? as TEXT) AND fileinfo.name = cast(? as TEXT)) AND "
+                         "directory.path != cast(? as TEXT) AND "
+                         "NOT (directory.path >= cast(? as TEXT) AND directory.path < cast(? as TEXT))")
+                args += [os.path.dirname(exclude_raw[:-1]), os.path.basename(exclude_raw[:-1]),
+                         exclude_raw[:-1], exclude_raw, prefix_range(exclude_raw)]
 
-            "  duplicate_sha1s AS ("
-            "    SELECT sha1 "
-            "    FROM blobinfo "
-            "    WHERE fileinfo_id IN matching_fileinfo_ids "
-            "    GROUP BY sha1 "
-            "    HAVING COUNT(*) > 1"
-            "  ),"
+            self.execute(
+                cur,
+                "SELECT directory.path, fileinfo.name, fileinfo.type, fileinfo.blob_id "
+                "FROM directory "
+                "CROSS JOIN fileinfo ON fileinfo.directory_id = directory.id "
+                "WHERE "
+                "  fileinfo.death is NULL AND " +
+                stmt + " "
+                "ORDER BY directory.path, fileinfo.name",
+                args)
+
+            # the key of the directory is its path relative to 'root'
+            # with a leading slash, the empty string for 'root' itself
+            root_len = len(os.fsencode(root).rstrip(b"/"))
+            for dname, name, kind, content in cur:
+                dname_key = b"" if dname == root else os.fsencode(dname)[root_len:]
+                yield ((dname_key, os.fsencode(name)),
+                       os.path.join(dname[len(prefix):], name), kind, content)
+        else:
+            stmt = self.subtree_condition(root, args)
+            for exclude in excludes:
+                exclude_raw = os.fsencode(os.path.join(prefix, exclude, ""))
+                stmt += (" AND fileinfo.path != cast(? as TEXT) AND "
+                         "NOT (fileinfo.path >= cast(? as TEXT) AND fileinfo.path < cast(? as TEXT))")
+                args += [exclude_raw[:-1], exclude_raw, prefix_range(exclude_raw)]
 
-            "  duplicate_fileinfo_ids AS ("
-            "    SELECT fileinfo_id "
-            "    FROM blobinfo "
-            "    INNER JOIN duplicate_sha1s ON duplicate_sha1s.sha1 = blobinfo.sha1 "
-            "  )"
+            self.execute(
+                cur,
+                "SELECT fileinfo.path, fileinfo.type, " +
+                ("fileinfo.blob_id " if self.schema_version >= 2 else
+                 "blobinfo.size, blobinfo.md5, blobinfo.sha1, blobinfo.blake2b ") +
+                self.fileinfo_from +
+                ("" if self.schema_version >= 2 else "LEFT " + self.blob_join) +
+                "WHERE "
+                "  fileinfo.death is NULL AND " +
+                stmt + " "
+                "ORDER BY fileinfo.path",
+                args)
+
+            for path, kind, *content in cur:
+                yield (os.fsencode(path)[len(prefix_raw):], path[len(prefix):], kind,
+                       content[0] if len(content) == 1 else tuple(content))
+
+    def get_by_blobs(self, blobs: Sequence[BlobInfo],
+                     roots: Sequence[str] = ()) -> Iterator[tuple[int, FileInfo]]:
+        """Returns (index, fileinfo) for the alive FileInfos with the same
+        content as blobs[index], only the ones below the directories
+        'roots' when given. Contents match by any digest both have, see
+        digests_match(). The contents are looked up through the digest
+        indices, BLOB_BATCH_SIZE per query, the subtrees only filter the
+        few rows found that way."""
+        for start in range(0, len(blobs), BLOB_BATCH_SIZE):
+            batch = [(index, blob, blob_digests(blob))
+                     for index, blob in enumerate(blobs[start:start + BLOB_BATCH_SIZE], start)]
+            batch = [(index, blob, digests) for index, blob, digests in batch if digests != []]
+            if batch == []:
+                continue
+
+            args: list[Any] = []
+            conditions = []
+            for _, blob, digests in batch:
+                for name, value in digests:
+                    conditions.append("({} = ? AND size = ?)".format(name))
+                    args += [value if self.schema_version >= 2 else value.hex(), blob.size]
+
+            if self.schema_version >= 2:
+                blob_stmt = "fileinfo.blob_id IN (SELECT id FROM blob WHERE {})".format(" OR ".join(conditions))
+            else:
+                blob_stmt = ("fileinfo.id IN (SELECT fileinfo_id FROM blobinfo WHERE {})"
+                             .format(" OR ".join(conditions)))
 
-            "SELECT * "
-            "FROM fileinfo "
-            "LEFT JOIN blobinfo ON blobinfo.fileinfo_id = fileinfo.id "
-            "LEFT JOIN linkinfo ON linkinfo.fileinfo_id = fileinfo.id "
-            "WHERE "
-            "  fileinfo.death is NULL AND "
-            "  fileinfo.id IN duplicate_fileinfo_ids AND "
-            "  path GLOB CAST(? AS TEXT)"
-            "ORDER BY blobinfo.sha1 ASC"
-        )
+            roots_stmt = OR(*[self.subtree_condition(root, args) for root in roots])
+
+            cur = self.con.cursor()
+            self.execute(
+                cur,
+                self.fileinfo_select +
+                WHERE(
+                    AND("fileinfo.death is NULL", blob_stmt, roots_stmt)),
+                args)
+
+            for row in cur:
+                fileinfo = fileinfo_from_row(row)
+                assert fileinfo.blob is not None
+                other = {name: getattr(fileinfo.blob, name + "_raw") for name in CHECKSUM_TYPES}
+                for index, blob, digests in batch:
+                    if fileinfo.blob.size == blob.size and digests_match(digests, other):
+                        yield index, fileinfo
+
+    def get_by_checksum(self,
+                        checksum_type: str,
+                        checksum: str,
+                        grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        """Returns the files with the given checksum, 'checksum_type' is
+        one of 'md5', 'sha1' or 'blake2b'"""
+        if checksum_type not in CHECKSUM_TYPES:
+            raise Exception("unknown checksum type: {}".format(checksum_type))
+
+        grange_args: list[Any] = []
+        grange_stmt: str = grange_to_sql(grange, grange_args)
 
         cur = self.con.cursor()
-        arg = os.path.join(os.fsencode(path), b"*")
-        self.execute(cur, stmt, [arg, arg])
+        if self.schema_version >= 2:
+            try:
+                digest = bytes.fromhex(checksum)
+            except ValueError as err:
+                raise Exception("invalid checksum: {}".format(checksum)) from err
+
+            self.execute(
+                cur,
+                self.fileinfo_select +
+                WHERE(
+                    AND(grange_stmt,
+                        "fileinfo.blob_id IN (SELECT id FROM blob WHERE {} = ?)".format(checksum_type))),
+                grange_args + [digest])
+        else:
+            self.execute(
+                cur,
+                "WITH "
+                "matching_fileinfos AS ( "
+                "  SELECT fileinfo_id "
+                "  FROM blobinfo "
+                "  WHERE "
+                "    {} = ?) ".format(checksum_type) +
+                self.fileinfo_select +
+                WHERE(
+                    AND(grange_stmt,
+                        "  fileinfo.id in matching_fileinfos")),
+                grange_args + [checksum])
+        return (fileinfo_from_row(row) for row in cur)
 
-        current_sha1 = None
+    def get_duplicates(self, path: str) -> Iterator[list[FileInfo]]:
+        args: list[Any] = []
+        pattern = os.path.join(path, "*")
+        if self.schema_version >= 2:
+            # identical content shares the blob row
+            stmt = (
+                "WITH "
+
+                "  duplicate_blob_ids AS ("
+                "    SELECT blob_id " +
+                self.fileinfo_from +
+                "    WHERE "
+                "      fileinfo.death is NULL AND "
+                "      blob_id IS NOT NULL AND "
+                "      {} "
+                "    GROUP BY blob_id "
+                "    HAVING COUNT(*) > 1"
+                "  ) ".format(self.glob_condition(pattern, args)) +
+
+                self.fileinfo_select +
+                "WHERE "
+                "  fileinfo.death is NULL AND "
+                "  fileinfo.blob_id IN duplicate_blob_ids AND "
+                "  {} "
+                "ORDER BY fileinfo.blob_id ASC".format(self.glob_condition(pattern, args))
+            )
+        else:
+            # doing the GLOB early speeds things up a good bit, even so it
+            # has to be done twice
+            stmt = (
+                "WITH "
+
+                "  matching_fileinfo_ids AS ("
+                "    SELECT id "
+                "    FROM fileinfo "
+                "    WHERE "
+                "      fileinfo.death is NULL AND "
+                "      {} "
+                "  ), ".format(self.glob_condition(pattern, args)) +
+
+                "  duplicate_sha1s AS ("
+                "    SELECT sha1 "
+                "    FROM blobinfo "
+                "    WHERE fileinfo_id IN matching_fileinfo_ids "
+                "    GROUP BY sha1 "
+                "    HAVING COUNT(*) > 1"
+                "  ),"
+
+                "  duplicate_fileinfo_ids AS ("
+                "    SELECT fileinfo_id "
+                "    FROM blobinfo "
+                "    INNER JOIN duplicate_sha1s ON duplicate_sha1s.sha1 = blobinfo.sha1 "
+                "  )" +
+
+                self.fileinfo_select +
+                "WHERE "
+                "  fileinfo.death is NULL AND "
+                "  fileinfo.id IN duplicate_fileinfo_ids AND "
+                "  {} "
+                "ORDER BY blobinfo.sha1 ASC".format(self.glob_condition(pattern, args))
+            )
+
+        cur = self.con.cursor()
+        self.execute(cur, stmt, args)
+
+        current_key = None
         group: list[FileInfo] = []
         for row in cur:
             fileinfo = fileinfo_from_row(row)
 
             assert fileinfo.blob is not None
-            if current_sha1 != fileinfo.blob.sha1:
+            key = (fileinfo.blob.size, fileinfo.blob.md5_raw, fileinfo.blob.sha1_raw, fileinfo.blob.blake2b_raw)
+            if current_key != key:
                 if group != []:
                     yield group
 
                 group = []
-                current_sha1 = fileinfo.blob.sha1
+                current_key = key
 
             group.append(fileinfo)
 
         if group != []:
             yield group
 
+    def get_ranked_duplicates(self, path: str,
+                              min_size: int = 0,
+                              min_wasted: int = 0,
+                              top: int = 0) -> Iterator[DuplicateGroup]:
+        """Returns the groups of duplicate files below 'path', the
+        groups wasting the most bytes come first. Hardlinks of the same
+        inode are collapsed into one copy, groups that are nothing but
+        hardlinks are skipped. Only files of at least 'min_size' bytes
+        and groups wasting at least 'min_wasted' bytes are returned,
+        'top' limits the number of groups, 0 for no limit. The ranking
+        has to look at the whole subtree, but the FileInfos are only
+        fetched for the groups that are returned, row by row."""
+        root = os.path.normpath(path)
+        if self.schema_version >= 2:
+            key_column = "fileinfo.blob_id"
+        else:
+            # the digests stored for a file depend on the configuration
+            # at the time, group by the strongest one available
+            key_column = ("(CASE "
+                          "WHEN blobinfo.blake2b IS NOT NULL THEN 'blake2b:' || blobinfo.blake2b "
+                          "WHEN blobinfo.sha1 IS NOT NULL THEN 'sha1:' || blobinfo.sha1 "
+                          "WHEN blobinfo.md5 IS NOT NULL THEN 'md5:' || blobinfo.md5 "
+                          "END)")
+
+        args: list[Any] = [min_size]
+        stmt = (
+            "WITH "
+
+            # one row per inode and content
+            "  inodes AS ("
+            "    SELECT DISTINCT {key} AS key, {blob}.size AS size, fileinfo.dev, fileinfo.ino " +
+            self.fileinfo_from +
+            self.blob_join +
+            "    WHERE "
+            "      fileinfo.death IS NULL AND "
+            "      {key} IS NOT NULL AND "
+            "      {blob}.size >= ? AND "
+            "      {subtree} "
+            "  ), "
+        ).format(key=key_column, blob=self.blob_table, subtree=self.subtree_condition(root, args))
+
+        # the FileInfo columns follow the group key and its wasted bytes
+        assert self.fileinfo_select.startswith("SELECT ")
+        args += [min_wasted, top if top > 0 else -1]
+        stmt += (
+            "  ranked AS ("
+            "    SELECT key, MAX(size) * (COUNT(*) - 1) AS wasted "
+            "    FROM inodes "
+            "    GROUP BY key "
+            "    HAVING COUNT(*) > 1 AND wasted >= ? "
+            "    ORDER BY wasted DESC, key ASC "
+            "    LIMIT ?"
+            "  ) "
+            "SELECT ranked.key, ranked.wasted, " +
+            self.fileinfo_select[len("SELECT "):] +
+            "JOIN ranked ON ranked.key = {key} "
+            "WHERE "
+            "  fileinfo.death IS NULL AND "
+            "  {subtree} "
+            "ORDER BY ranked.wasted DESC, ranked.key ASC, {path} ASC"
+        ).format(key=key_column, path=self.path_column, subtree=self.subtree_condition(root, args))
+
+        cur = self.con.cursor()
+        self.execute(cur, stmt, args)
+
+        for (_, wasted), rows in itertools.groupby(cur, key=lambda row: (row[0], row[1])):
+            fileinfos = [fileinfo_from_row(row[2:]) for row in rows]
+            blob = fileinfos[0].blob
+            assert blob is not None
+            yield DuplicateGroup(blob, wasted, fileinfos)
+
     def get_generations_range(self) -> GenerationRange:
         cur = self.con.cursor()
         self.execute(
@@ -796,20 +2110,23 @@ class Database(IDatabase):
         'fileinfo_query' where changed
 
         """
+        args: list[Any] = []
+        birth_glob_stmt = self.glob_condition(fileinfo_query, args)
+        death_glob_stmt = self.glob_condition(fileinfo_query, args)
+
         cur = self.con.cursor()
         self.execute(
             cur,
-            "SELECT DISTINCT birth AS gen "
-            "FROM fileinfo "
-            "WHERE path GLOB ? "
+            "SELECT DISTINCT birth AS gen " +
+            self.fileinfo_from +
+            "WHERE {} "
             "UNION "
-            "SELECT DISTINCT death AS gen "
-            "FROM fileinfo "
-            "WHERE path GLOB ? AND "
+            "SELECT DISTINCT death AS gen ".format(birth_glob_stmt) +
+            self.fileinfo_from +
+            "WHERE {} AND "
             "      death IS NOT NULL "
-            "ORDER BY gen",
-            [fileinfo_query,
-             fileinfo_query])
+            "ORDER BY gen".format(death_glob_stmt),
+            args)
 
         return list(cur)
 
@@ -818,11 +2135,10 @@ class Database(IDatabase):
         # check for path that have multiple alive FileInfo associated with them
         self.execute(
             cur,
-            "SELECT * "
-            "FROM fileinfo "
+            self.fileinfo_select +
             "WHERE death is NULL "
-            "GROUP BY path "
-            "HAVING COUNT(*) > 1")
+            "GROUP BY {} "
+            "HAVING COUNT(*) > 1".format(self.path_key))
         for row in cur:
             fileinfo = fileinfo_from_row(row)
             print("error: double-alive: {}".format(fileinfo.path))
@@ -830,22 +2146,32 @@ class Database(IDatabase):
         # check for FileInfo that have never been born
         self.execute(
             cur,
-            "SELECT * "
-            "FROM fileinfo "
+            self.fileinfo_select +
             "WHERE birth is NULL ")
         for row in cur:
             fileinfo = fileinfo_from_row(row)
             print("error: birth must not be NULL: {}".format(fileinfo.path))
 
-        # check for orphaned BlobInfo
-        self.execute(
-            cur,
-            "SELECT count(*) "
-            "FROM blobinfo "
-            "WHERE fileinfo_id NOT IN (SELECT id from fileinfo)")
-        rows = cur.fetchall()
-        if rows[0][0] > 0:
-            print("error: {} orphaned BlobInfo".format(rows[0][0]))
+        if self.schema_version >= 2:
+            # check for FileInfo pointing to a non-existing blob
+            self.execute(
+                cur,
+                "SELECT count(*) "
+                "FROM fileinfo "
+                "WHERE blob_id IS NOT NULL AND blob_id NOT IN (SELECT id from blob)")
+            rows = cur.fetchall()
+            if rows[0][0] > 0:
+                print("error: {} FileInfo with missing blob".format(rows[0][0]))
+        else:
+            # check for orphaned BlobInfo
+            self.execute(
+                cur,
+                "SELECT count(*) "
+                "FROM blobinfo "
+                "WHERE fileinfo_id NOT IN (SELECT id from fileinfo)")
+            rows = cur.fetchall()
+            if rows[0][0] > 0:
+                print("error: {} orphaned BlobInfo".format(rows[0][0]))
 
         # check for self referencing parent_ids in directory table
         self.execute(
@@ -865,6 +2191,7 @@ class Database(IDatabase):
               "time: {:.2f}".format(t - self.last_commit_time),
               "speed: {:.2f} MB/s".format((self.insert_size / 1000 / 1000) / (t - self.last_commit_time)))
 
+        self.flush_dirstat()
         self.con.commit()
         self.last_commit_time = t
         self.insert_count = 0
@@ -892,6 +2219,12 @@ class Database(IDatabase):
             "FROM directory")
         print("{} directories in database".format(cur.fetchall()[0][0]))
 
+        self.execute(
+            cur,
+            "SELECT COUNT(*) "
+            "FROM {}".format(self.blob_table))
+        print("{} blobs in database (schema version {})".format(cur.fetchall()[0][0], self.schema_version))
+
     def create_directory_table(self) -> None:
         cur = self.con.cursor()
         self.execute(
@@ -903,7 +2236,13 @@ class Database(IDatabase):
             ")")
 
     def rebuild_directory_table(self) -> None:
+        if self.schema_version >= 3:
+            raise Exception("the directory table can't be rebuilt in schema version {}, "
+                            "it is the only place the paths are stored".format(self.schema_version))
+
         cur = self.con.cursor()
+        self.directory_cache.clear()
+
         print("Deleting old directory table")
         self.execute(
             cur,
@@ -935,8 +2274,40 @@ class Database(IDatabase):
             "  SELECT id FROM directory "
             "  WHERE directory.path = cast(py_dirname(cast(fileinfo.path AS BLOB)) AS TEXT))")
 
+        if self.has_dirstat:
+            print("Rebuilding dirstat table")
+            self.rebuild_dirstat()
+
     def cleanup_double_alive(self) -> None:
         cur = self.con.cursor()
+        if self.schema_version >= 3:
+            self.execute(
+                cur,
+                "WITH "
+
+                "duplicate_path AS ("
+                "  SELECT directory_id, name "
+                "  FROM fileinfo "
+                "  WHERE death is NULL "
+                "  GROUP BY directory_id, name "
+                "  HAVING COUNT(*) > 1), "
+
+                "keep_id AS ("
+                "  SELECT MAX(fileinfo.id) "
+                "  FROM duplicate_path "
+                "  LEFT JOIN fileinfo ON "
+                "    fileinfo.directory_id = duplicate_path.directory_id AND "
+                "    fileinfo.name = duplicate_path.name "
+                "  GROUP BY fileinfo.directory_id, fileinfo.name) "
+
+                "DELETE FROM fileinfo "
+                "WHERE "
+                "  (directory_id, name) IN duplicate_path AND "
+                "  id NOT IN keep_id")
+            if self.has_dirstat:
+                self.rebuild_dirstat()
+            return
+
         self.execute(
             cur,
             "WITH "
@@ -958,6 +2329,8 @@ class Database(IDatabase):
             "WHERE "
             "  path IN duplicate_path AND "
             "  id NOT IN keep_id")
+        if self.has_dirstat:
+            self.rebuild_dirstat()
 
     def rebuild_indices(self) -> None:
         cur = self.con.cursor()
@@ -975,10 +2348,17 @@ class Database(IDatabase):
             print("dropping {}".format(name))
             self.execute(cur, "DROP INDEX {}".format(name))
 
+        print("creating indices")
+        self.create_indices()
+        self.con.commit()
+
     def dump(self) -> None:
         """Dump the content of the database to stdout"""
         cur = self.con.cursor()
-        for tbl in ['fileinfo', 'directory', 'blobinfo', 'linkinfo', 'generation']:
+        tables = ['fileinfo', 'directory', self.blob_table, 'linkinfo', 'generation', 'checkpoint']
+        if self.has_dirstat:
+            tables.append('dirstat')
+        for tbl in tables:
             print("\n{}:".format(tbl))
             self.execute(cur, "SELECT * FROM {}".format(tbl))
             for row in cur:
@@ -992,7 +2372,7 @@ class Database(IDatabase):
 class NullDatabase(IDatabase):
 
     def __init__(self) -> None:
-        pass
+        self.storage_ids: dict[str, int] = {}
 
     def init_generation(self, cmd: str) -> int:
         return 0
@@ -1000,10 +2380,23 @@ class NullDatabase(IDatabase):
     def deinit_generation(self, rowid: int) -> None:
         pass
 
+    def resume_generation(self) -> Optional[int]:
+        return None
+
+    def store_checkpoint(self, root: str, path: str, finished: bool) -> None:
+        pass
+
+    def get_checkpoint(self, root: str) -> Optional[tuple[str, bool]]:
+        return None
+
     def store(self, fileinfo: FileInfo) -> None:
         # pylint: disable=no-self-use
         print("store:", fileinfo.json())
 
+    def store_many(self, fileinfos: Iterable[FileInfo]) -> None:
+        for fileinfo in fileinfos:
+            self.store(fileinfo)
+
     def commit(self) -> None:
         pass
 
@@ -1019,5 +2412,18 @@ class NullDatabase(IDatabase):
     def get_directory_by_path(self, path: str) -> Iterator[FileInfo]:
         return iter(())
 
+    def get_by_inode(self, dev: int, ino: int, grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        return iter(())
+
+    def get_by_inodes(self, inodes: Iterable[tuple[int, int]],
+                      grange: Optional[GenerationRange] = None) -> Iterator[FileInfo]:
+        return iter(())
+
+    def get_storage_id(self, name: str) -> int:
+        return self.storage_ids.setdefault(name, len(self.storage_ids) + 1)
+
+    def uses_storage_ids(self) -> bool:
+        return True
+
 
 # EOF #
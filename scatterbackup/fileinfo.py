@@ -28,13 +28,23 @@ from scatterbackup.blobinfo import BlobInfo
 
 class FileInfo:
 
+    # millions of FileInfos are kept in memory by some commands, so
+    # they don't get a per instance __dict__
+    __slots__ = ("rowid", "kind", "path", "dev", "ino", "mode", "nlink",
+                 "uid", "gid", "rdev", "size", "blksize", "blocks",
+                 "atime", "ctime", "mtime", "time", "birth", "death",
+                 "blob", "target", "directory_id")
+
     def __init__(self, path: str) -> None:
         self.rowid: Optional[int] = None
 
         self.kind: Optional[str] = None
         self.path: str = path
 
-        self.dev: Optional[int] = None  # FIXME: this is not stable across reboots
+        # st_dev, which is not stable across reboots, FileInfos stored by
+        # sb-update have the storageinfo id instead when the database
+        # has schema version 4 or later, see scatterbackup.storage
+        self.dev: Optional[int] = None
         self.ino: Optional[int] = None
 
         self.mode: Optional[int] = None
@@ -137,6 +147,8 @@ class FileInfo:
                 js['blob']['md5'] = self.blob.md5  # type: ignore
             if self.blob.crc32 is not None:
                 js['blob']['crc32'] = self.blob.crc32  # type: ignore
+            if self.blob.blake2b is not None:
+                js['blob']['blake2b'] = self.blob.blake2b  # type: ignore
 
         assign('target', self.target)
 
@@ -156,10 +168,19 @@ class FileInfo:
     @staticmethod
     def from_file(path: str, checksums: bool = True, relative: bool = False, base: Optional[str] = None) -> 'FileInfo':
         abspath = path if relative else os.path.abspath(path)
+        return FileInfo.from_stat(abspath, os.lstat(path), checksums)
 
-        result = FileInfo(abspath)
+    @staticmethod
+    def from_dir_entry(entry: 'os.DirEntry[str]', checksums: bool = True, path: Optional[str] = None) -> 'FileInfo':
+        """Like from_file(), but uses the lstat() result cached in 'entry'
+        and entry.path as is, unless another 'path' is given"""
+        return FileInfo.from_stat(entry.path if path is None else path,
+                                  entry.stat(follow_symlinks=False),
+                                  checksums)
 
-        statinfo = os.lstat(path)
+    @staticmethod
+    def from_stat(abspath: str, statinfo: os.stat_result, checksums: bool = True) -> 'FileInfo':
+        result = FileInfo(abspath)
 
         m = statinfo.st_mode
         if stat.S_ISREG(m):
@@ -240,7 +261,8 @@ class FileInfo:
             result.blob = BlobInfo(blob.get('size'),
                                    md5=blob.get('md5'),
                                    sha1=blob.get('sha1'),
-                                   crc32=blob.get('crc32'))
+                                   crc32=blob.get('crc32'),
+                                   blake2b=blob.get('blake2b'))
 
         result.target = js.get('target')
 
@@ -288,6 +288,11 @@ class FileInfoFormatter:
         assert self.fileinfo.blob.md5 is not None
         return Checksum(self.fileinfo.blob.md5 if self.fileinfo.blob else "<md5:unknown>")
 
+    def blake2b(self) -> Checksum:
+        assert self.fileinfo.blob is not None
+        assert self.fileinfo.blob.blake2b is not None
+        return Checksum(self.fileinfo.blob.blake2b if self.fileinfo.blob else "<blake2b:unknown>")
+
     def target(self) -> str:
         assert self.fileinfo.target is not None
         return self.fileinfo.target
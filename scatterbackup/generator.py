@@ -33,59 +33,73 @@ def match_excludes(path: str, excludes: Optional[Sequence[str]] = None) -> bool:
     return False
 
 
-def scan_directory(path: str,
-                   excludes: Optional[list[str]] = None,
-                   onerror: Optional[Callable[[OSError], None]] = None) -> Iterator[tuple[str, list[str], list[str]]]:
-    """Wrapper around scatterbackup.walk() that applies a list of exclude
-    directives and returns result as absolute path
+def scan_entries(path: str,
+                 excludes: Optional[list[str]] = None,
+                 onerror: Optional[Callable[[OSError], None]] = None,
+                 sort: bool = False,
+                 prune: Optional[Callable[[str], bool]] = None,
+                 jobs: int = 1) -> Iterator[tuple[str, list['os.DirEntry[str]'], list['os.DirEntry[str]']]]:
+    """Wrapper around scatterbackup.walk_entries() that applies a list of
+    exclude directives, the entries have absolute paths
+
+    With 'sort' subdirectories are visited in sorted order, which
+    makes the walk order reproducible. Directories for which 'prune'
+    returns True are not descended into, but still returned as part of
+    their parent directory. 'jobs' is passed on to scatterbackup.walk_entries().
     """
     if excludes is None:
         excludes = []
 
     path = os.path.abspath(path)
 
-    for root, dirs, files in scatterbackup.walk(path, onerror=onerror):
+    for root, dirs, files in scatterbackup.walk_entries(path, onerror=onerror, jobs=jobs, stat=jobs > 1):
+        if sort:
+            dirs.sort(key=lambda entry: entry.name)
+            files.sort(key=lambda entry: entry.name)
+
         result_dirs = []
-        result_files = []
+        walk_dirs = []
+        for entry in dirs:
+            if not match_excludes(entry.path, excludes):
+                result_dirs.append(entry)
+                if prune is None or not prune(entry.path):
+                    walk_dirs.append(entry)
+            else:
+                logging.info("excluding %s", entry.path)
+        dirs[:] = walk_dirs
+
+        result_files = [entry for entry in files if not match_excludes(entry.path, excludes)]
 
-        off = 0
-        for i, f in enumerate(dirs[:]):
-            try:
-                path = os.path.join(root, f)
-                if not match_excludes(path, excludes):
-                    result_dirs.append(path)
-                else:
-                    logging.info("excluding %s", path)
-                    del dirs[i - off]
-                    off += 1
-            except OSError as err:
-                if onerror is not None:
-                    onerror(err)
+        yield (cast(str, root), result_dirs, result_files)
 
-        for f in files:
-            try:
-                path = os.path.join(root, f)
-                if not match_excludes(path, excludes):
-                    result_files.append(path)
-            except OSError as err:
-                if onerror is not None:
-                    onerror(err)  # type: ignore
 
-        yield (cast(str, root), result_dirs, result_files)
+def scan_directory(path: str,
+                   excludes: Optional[list[str]] = None,
+                   onerror: Optional[Callable[[OSError], None]] = None,
+                   sort: bool = False,
+                   prune: Optional[Callable[[str], bool]] = None,
+                   jobs: int = 1) -> Iterator[tuple[str, list[str], list[str]]]:
+    """Like scan_entries(), but returns the absolute paths"""
+    for root, dirs, files in scan_entries(path, excludes, onerror, sort=sort, prune=prune, jobs=jobs):
+        yield (root,
+               [entry.path for entry in dirs],
+               [entry.path for entry in files])
 
 
 def scan_fileinfos(path: str,
                    excludes: Optional[list[str]] = None,
                    checksums: bool = False,
-                   relative: bool = False,
-                   onerror: Optional[Callable[[OSError], None]] = None) \
+                   onerror: Optional[Callable[[OSError], None]] = None,
+                   sort: bool = False,
+                   prune: Optional[Callable[[str], bool]] = None,
+                   jobs: int = 1) \
                    -> Iterator[tuple[str, list[FileInfo], list[FileInfo]]]:
 
-    for root, dirs, files in scan_directory(path, excludes, onerror):
+    for root, dirs, files in scan_entries(path, excludes, onerror, sort=sort, prune=prune, jobs=jobs):
         result_dirs = []
         for d in dirs:
             try:
-                result_dirs.append(FileInfo.from_file(d, checksums=checksums, relative=relative))
+                result_dirs.append(FileInfo.from_dir_entry(d, checksums=checksums))
             except OSError as err:
                 if onerror is not None:
                     onerror(err)
@@ -93,7 +107,7 @@ def scan_fileinfos(path: str,
         result_files = []
         for f in files:
             try:
-                result_files.append(FileInfo.from_file(f, checksums=checksums, relative=relative))
+                result_files.append(FileInfo.from_dir_entry(f, checksums=checksums))
             except OSError as err:
                 if onerror is not None:
                     onerror(err)  # type: ignore
@@ -140,20 +154,39 @@ def generate_fileinfos(path: str,
                        onerror: Optional[Callable[[OSError], None]] = None,
                        excludes: Optional[Sequence[str]] = None,
                        checksums: bool = False) -> Iterator[FileInfo]:
+    """Generate FileInfos for path and everything below it, in the same
+    order as generate_files()"""
+
+    def make_fileinfo(fileinfo: FileInfo) -> FileInfo:
+        if prefix is not None:
+            fileinfo.path = os.path.join(prefix, fileinfo.path)
+        return fileinfo
 
-    for p in generate_files(path=path, onerror=onerror, excludes=excludes):
-        try:
-            fileinfo = FileInfo.from_file(p,
-                                          checksums=checksums,
-                                          relative=relative)
-            if prefix is not None:
-                fileinfo.path = os.path.join(prefix, fileinfo.path)
+    try:
+        yield make_fileinfo(FileInfo.from_file(path, checksums=checksums, relative=relative))
+    except OSError as err:
+        if onerror is not None:
+            onerror(err)
 
-            yield fileinfo
+    # normalize once, the paths of the entries below are built from it
+    path = os.path.normpath(path) if relative else os.path.abspath(path)
 
-        except OSError as err:
-            if onerror is not None:
-                onerror(err)
+    if os.path.isdir(path):
+        for root, dirs, files in scatterbackup.walk_entries(path, onerror=onerror):
+            walk_dirs = []
+            for entry in dirs:
+                if not match_excludes(entry.path, excludes):
+                    walk_dirs.append(entry)
+                else:
+                    logging.info("excluding %s", entry.path)
+            dirs[:] = walk_dirs
+
+            for entry in walk_dirs + [f for f in files if not match_excludes(f.path, excludes)]:
+                try:
+                    yield make_fileinfo(FileInfo.from_dir_entry(entry, checksums=checksums))
+                except OSError as err:
+                    if onerror is not None:
+                        onerror(err)
 
 
 # EOF #
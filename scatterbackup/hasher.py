@@ -0,0 +1,194 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Single pass multi-digest hashing of file content"""
+
+
+from typing import cast, Any, Callable, Optional, Protocol, Sequence, Union
+
+import hashlib
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+
+# digests calculated unless configured otherwise in config.yaml
+DEFAULT_DIGESTS = ["md5", "sha1", "crc32"]
+
+
+class Digest(Protocol):
+
+    def update(self, data: Any) -> None:
+        ...
+
+    def hexdigest(self) -> str:
+        ...
+
+
+class CRC32:
+    """zlib.crc32() wrapped in the hashlib interface"""
+
+    def __init__(self) -> None:
+        self.value = 0
+
+    def update(self, data: Any) -> None:
+        self.value = zlib.crc32(data, self.value)
+
+    def hexdigest(self) -> str:
+        return "{:08x}".format(self.value)
+
+
+DIGESTS: dict[str, Callable[[], Digest]] = {
+    "md5": hashlib.md5,
+    "sha1": hashlib.sha1,
+    "blake2b": hashlib.blake2b,
+    "crc32": CRC32,
+}
+
+
+def digest_value(digest: Digest) -> Union[str, int]:
+    if isinstance(digest, CRC32):
+        return digest.value
+    else:
+        return digest.hexdigest()
+
+
+def check_digests(names: Sequence[str]) -> None:
+    for name in names:
+        if name not in DIGESTS:
+            raise Exception("unknown digest: {!r}, must be one of: {}".format(name, ", ".join(DIGESTS)))
+
+
+class Hasher:
+    """Calculates a set of digests of a file in a single pass. File
+    content is read with readinto() into a buffer that is reused for
+    every block and every file, so no new bytes objects are created
+    while hashing. When 'threaded' is True each digest is updated on its
+    own thread, the hash functions release the GIL, so this allows
+    using more than one core for a single file.
+
+    A Hasher must not be shared between threads, use get_hasher() to
+    get one for the current thread."""
+
+    def __init__(self,
+                 block_size: int = DEFAULT_BLOCK_SIZE,
+                 threaded: bool = False,
+                 fadvise: bool = True,
+                 digests: Sequence[str] = DEFAULT_DIGESTS) -> None:
+        check_digests(digests)
+
+        self.digests = list(digests)
+        self.block_size = block_size
+        self.threaded = threaded
+        self.fadvise = fadvise and hasattr(os, "posix_fadvise")
+
+        self.buffer = bytearray(block_size)
+        self.view = memoryview(self.buffer)
+
+        self.executor: Optional[ThreadPoolExecutor] = None
+
+    def hash_file(self, path: str) -> tuple[int, dict[str, Union[str, int]]]:
+        """Returns the size and the digests of the file at 'path', the
+        digests are hex strings, except crc32 which is an int"""
+        digests = {name: DIGESTS[name]() for name in self.digests}
+
+        size = self.hash_into(path, list(digests.values()))
+
+        return (size, {name: digest_value(digest) for name, digest in digests.items()})
+
+    def hash_into(self, path: str, digests: list[Digest]) -> int:
+        """Feed the content of 'path' into 'digests', returns the number
+        of bytes read"""
+        size = 0
+        with open(path, 'rb', buffering=0) as fin:
+            fd = fin.fileno()
+            self._advise(fd, 0, 0, "POSIX_FADV_SEQUENTIAL")
+
+            while True:
+                count = fin.readinto(self.view)
+                if not count:
+                    break
+
+                self._update(digests, self.view[:count])
+                # the data is not needed again, keep the page cache
+                # for the files the user is actually working with
+                self._advise(fd, size, count, "POSIX_FADV_DONTNEED")
+                size += count
+
+        return size
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def _update(self, digests: list[Digest], data: memoryview) -> None:
+        if not self.threaded or len(digests) == 1:
+            for digest in digests:
+                digest.update(data)
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=len(digests))
+
+            # all digests have to be done with the block before the
+            # buffer can be refilled
+            futures = [self.executor.submit(digest.update, data) for digest in digests]
+            for future in futures:
+                future.result()
+
+    def _advise(self, fd: int, offset: int, length: int, advice: str) -> None:
+        if self.fadvise:
+            try:
+                os.posix_fadvise(fd, offset, length, getattr(os, advice))
+            except OSError:
+                pass  # not supported for this file, e.g. on a pipe
+
+
+_config: dict[str, Any] = {}
+_config_serial = 0
+_local = threading.local()
+
+
+def configure(block_size: int = DEFAULT_BLOCK_SIZE,
+              threaded: bool = False,
+              fadvise: bool = True,
+              digests: Sequence[str] = DEFAULT_DIGESTS) -> None:
+    """Set the parameters for the Hasher returned by get_hasher()"""
+    global _config_serial  # pylint: disable=global-statement
+
+    check_digests(digests)
+
+    _config.clear()
+    _config.update(block_size=block_size, threaded=threaded, fadvise=fadvise, digests=list(digests))
+    _config_serial += 1
+
+
+def get_hasher() -> Hasher:
+    """Returns the Hasher of the current thread"""
+    serial, hasher = getattr(_local, "hasher", (None, None))
+    if hasher is None or serial != _config_serial:
+        if hasher is not None:
+            hasher.close()
+        hasher = Hasher(**_config)
+        _local.hasher = (_config_serial, hasher)
+    return cast(Hasher, hasher)
+
+
+# EOF #
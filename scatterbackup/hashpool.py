@@ -0,0 +1,91 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Callable, Optional
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from scatterbackup.fileinfo import FileInfo
+
+
+def calc_checksums(fileinfo: FileInfo) -> Optional[OSError]:
+    try:
+        fileinfo.calc_checksums()
+        return None
+    except OSError as err:
+        return err
+
+
+class HashPool:
+    """Calculates checksums on a pool of worker threads. Completion
+    callbacks are run on the calling thread, strictly in the order in
+    which they were submitted, so the database sees the same sequence of
+    operations as in a single threaded run. At most 'max_pending' jobs
+    are in flight, submit() blocks on the oldest one once that limit is
+    reached."""
+
+    def __init__(self, jobs: int,
+                 onerror: Optional[Callable[[OSError], None]] = None,
+                 max_pending: Optional[int] = None) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.onerror = onerror
+        self.max_pending = max_pending if max_pending is not None else jobs * 4
+        self.pending: deque[tuple[Optional[Future[Optional[OSError]]], Callable[[], None]]] = deque()
+
+    def submit(self, fileinfo: Optional[FileInfo], on_done: Callable[[], None]) -> None:
+        """Calculate the checksums for 'fileinfo' and call 'on_done' once
+        they are available. When 'fileinfo' is None no checksum is
+        calculated and 'on_done' is only queued behind the pending jobs."""
+        if fileinfo is None and not self.pending:
+            on_done()
+            return
+
+        future = self.executor.submit(calc_checksums, fileinfo) if fileinfo is not None else None
+        self.pending.append((future, on_done))
+        self.poll()
+
+    def poll(self) -> None:
+        """Run the callbacks of all jobs at the head of the queue that are
+        already finished"""
+        while self.pending:
+            future, _ = self.pending[0]
+            if len(self.pending) <= self.max_pending and \
+               future is not None and not future.done():
+                break
+            self._complete_one()
+
+    def join(self) -> None:
+        """Wait for all pending jobs and run their callbacks"""
+        while self.pending:
+            self._complete_one()
+
+    def shutdown(self) -> None:
+        """Throw away all pending jobs without running their callbacks"""
+        self.pending.clear()
+        self.executor.shutdown(wait=True, cancel_futures=True)
+
+    def _complete_one(self) -> None:
+        future, on_done = self.pending.popleft()
+        if future is not None:
+            err = future.result()
+            if err is not None and self.onerror is not None:
+                self.onerror(err)
+        on_done()
+
+
+# EOF #
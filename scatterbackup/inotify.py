@@ -0,0 +1,151 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Minimal ctypes binding for the Linux inotify API"""
+
+
+from typing import NamedTuple, Optional
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+
+
+# events, see inotify(7)
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_CLOSE_NOWRITE = 0x00000010
+IN_OPEN = 0x00000020
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+
+# events sent by the kernel without being asked for
+IN_UNMOUNT = 0x00002000
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+
+# flags for add_watch()
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+
+# set in the mask of events that refer to a directory
+IN_ISDIR = 0x40000000
+
+# flags for inotify_init1()
+IN_CLOEXEC = os.O_CLOEXEC
+IN_NONBLOCK = os.O_NONBLOCK
+
+# all events that change the metadata or content of the directory
+# entries, everything sb-update stores
+IN_CHANGES = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE |
+              IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE |
+              IN_DELETE_SELF | IN_MOVE_SELF)
+
+# struct inotify_event without the trailing name
+EVENT_HEADER = struct.Struct("iIII")
+
+
+class Event(NamedTuple):
+
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+def parse_events(data: bytes) -> list[Event]:
+    """Split the buffer returned by read() on an inotify fd into Events"""
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        # the name is padded with NUL bytes
+        name = data[offset:offset + length].rstrip(b"\0")
+        offset += length
+        events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+
+_libc: Optional[ctypes.CDLL] = None
+
+
+def _get_libc() -> ctypes.CDLL:
+    global _libc  # pylint: disable=global-statement
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    return _libc
+
+
+def _check(ret: int, filename: Optional[str] = None) -> int:
+    if ret < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno), filename)
+    return ret
+
+
+class Inotify:
+
+    def __init__(self) -> None:
+        self.libc = _get_libc()
+        self.fd = _check(self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def fileno(self) -> int:
+        return self.fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """Watch 'path' for the events in 'mask', returns the watch
+        descriptor, adding the same path again returns the same one"""
+        return _check(self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask)), path)
+
+    def rm_watch(self, wd: int) -> None:
+        _check(self.libc.inotify_rm_watch(self.fd, wd))
+
+    def read(self, timeout: Optional[float] = None) -> list[Event]:
+        """Wait up to 'timeout' seconds for events, returns an empty list
+        when none arrived"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            return parse_events(os.read(self.fd, 64 * 1024))
+        except BlockingIOError:
+            return []
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self) -> 'Inotify':
+        return self
+
+    def __exit__(self, exc_type: object, exc_value: object, traceback: object) -> None:
+        self.close()
+
+
+# EOF #
@@ -0,0 +1,120 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Optional
+
+import os
+
+from scatterbackup.database import IDatabase
+from scatterbackup.fileinfo import FileInfo
+
+
+BY_UUID_DIRECTORY = "/dev/disk/by-uuid"
+
+
+def device_uuids() -> dict[int, str]:
+    """Returns the filesystem UUIDs from /dev/disk/by-uuid by the
+    device number of their block device"""
+    result: dict[int, str] = {}
+    try:
+        entries = list(os.scandir(BY_UUID_DIRECTORY))
+    except OSError:
+        return result  # no udev
+
+    for entry in entries:
+        try:
+            result[os.stat(entry.path).st_rdev] = entry.name
+        except OSError:
+            pass  # dangling link
+    return result
+
+
+def storage_name(path: str, dev: int, uuids: dict[int, str]) -> str:
+    """Returns a name for the filesystem that 'path' is on, which
+    unlike st_dev stays the same across reboots: the UUID of the block
+    device when there is one, the fsid from statfs() otherwise, which
+    most filesystems derive from their UUID as well"""
+    uuid = uuids.get(dev)
+    if uuid is not None:
+        return "uuid:{}".format(uuid)
+
+    fsid = os.statvfs(path).f_fsid
+    if fsid != 0:
+        return "fsid:{:x}".format(fsid)
+    else:
+        return "dev:{:d}".format(dev)
+
+
+def find_storage_name(path: str, dev: int, uuids: dict[int, str]) -> str:
+    """Returns storage_name() for the filesystem with the device number
+    'dev', looked up from 'path' or its closest ancestor that still
+    exists. When that is on another filesystem, the number belongs to
+    an earlier boot or another machine and only "dev:N" is left."""
+    while True:
+        try:
+            if os.stat(path).st_dev == dev:
+                return storage_name(path, dev, uuids)
+            else:
+                break
+        except OSError:
+            pass  # gone already, the parent is on the same filesystem
+
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+
+    return "dev:{:d}".format(dev)
+
+
+class StorageRegistry:
+    """Replaces FileInfo.dev, the st_dev of the file, with the id of its
+    filesystem in the storageinfo table. st_dev is only valid until the
+    next reboot or remount, so the mapping is only kept for one run.
+    Databases from before schema version 4 keep st_dev until they are
+    migrated."""
+
+    def __init__(self, db: IDatabase) -> None:
+        self.db = db
+        self.enabled = db.uses_storage_ids()
+        self.storage_ids: dict[int, int] = {}
+        self.uuids: Optional[dict[int, str]] = None
+
+    def storage_id(self, fileinfo: FileInfo) -> int:
+        assert fileinfo.dev is not None
+        storage_id = self.storage_ids.get(fileinfo.dev)
+        if storage_id is None:
+            if self.uuids is None:
+                self.uuids = device_uuids()
+
+            # mount points and bind mounts are directories, everything
+            # else is on the filesystem of its parent directory
+            if fileinfo.kind == "directory":
+                path = fileinfo.path
+            else:
+                path = os.path.dirname(fileinfo.path)
+
+            storage_id = self.db.get_storage_id(find_storage_name(path, fileinfo.dev, self.uuids))
+            self.storage_ids[fileinfo.dev] = storage_id
+        return storage_id
+
+    def assign(self, fileinfo: FileInfo) -> None:
+        if self.enabled and fileinfo.dev is not None:
+            fileinfo.dev = self.storage_id(fileinfo)
+
+
+# EOF #
@@ -15,16 +15,19 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
-from typing import Any, Callable, Sequence, TypeVar, Iterator, Optional
+from typing import Any, Callable, Generic, Sequence, TypeVar, Iterator, Optional
 
 import io
 import os
 import sys
 import logging
+from collections import OrderedDict
 import xdg.BaseDirectory
 
 
 T = TypeVar('T')
+K = TypeVar('K')
+V = TypeVar('V')
 
 
 def sb_init() -> None:
@@ -108,4 +111,31 @@ def full_join(lhs: Sequence[T], rhs: Sequence[T],
         yield (None, rhs[i])
 
 
+class LRUCache(Generic[K, V]):
+    """A dict that forgets the least recently used entries once it
+    holds more than 'maxsize' of them"""
+
+    def __init__(self, maxsize: int) -> None:
+        self.maxsize = maxsize
+        self.entries: OrderedDict[K, V] = OrderedDict()
+
+    def get(self, key: K) -> Optional[V]:
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        return value
+
+    def put(self, key: K, value: V) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self.entries.clear()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
 # EOF #
@@ -8,32 +8,18 @@ import sys
 
 import stat
 import os
+from concurrent.futures import ThreadPoolExecutor
 from os import scandir, path, name, listdir, PathLike, DirEntry
 
 
 def walk(top: Union[str, PathLike[str]], topdown: bool = True,
          onerror: Optional[Callable[[OSError], None]] = None,
          followlinks: bool = False,
-         maxdepth: Optional[int] = None) -> Generator[Tuple[Union[str, PathLike[str]],
-                                                            list[Union[str, PathLike[str]]],
-                                                            list[Union[str, PathLike[str]]]],
-                                                      None, None]:
-    if maxdepth is None:
-        maxdepth = sys.maxsize
-    return _walk(top, topdown, onerror, followlinks, maxdepth, depth=1)
-
-
-# This is the os.walk() function from Python-3.5.2, modified such that
-# it returns symlinks to directories in the 'nodirs' portion of the
-# result tuple instead of the 'dirs' one.
-def _walk(top: Union[str, PathLike[str]], topdown: bool,
-          onerror: Optional[Callable[[OSError], None]],
-          followlinks: bool,
-          maxdepth: int,
-          depth: int) -> Generator[Tuple[Union[str, PathLike[str]],
-                                         list[Union[str, PathLike[str]]],
-                                         list[Union[str, PathLike[str]]]],
-                                   None, None]:
+         maxdepth: Optional[int] = None,
+         jobs: int = 1) -> Generator[Tuple[Union[str, PathLike[str]],
+                                            list[Union[str, PathLike[str]]],
+                                            list[Union[str, PathLike[str]]]],
+                                      None, None]:
     """Directory tree generator.
 
     For each directory in the directory tree rooted at top (including top
@@ -74,6 +60,11 @@ def _walk(top: Union[str, PathLike[str]], topdown: bool,
     systems that support them.  In order to get this functionality, set the
     optional argument 'followlinks' to true.
 
+    With 'jobs' greater than one the directories that are visited next
+    are listed ahead of time on a pool of 'jobs' threads, which hides
+    the latency of scandir() on network filesystems. Directories removed
+    from dirnames in topdown mode are never listed.
+
     Caution:  if you pass a relative pathname for top, don't change the
     current working directory between resumptions of walk.  walk never
     changes the current directory, and assumes that the client doesn't
@@ -92,26 +83,47 @@ def _walk(top: Union[str, PathLike[str]], topdown: bool,
 
     """
 
+    if maxdepth is None:
+        maxdepth = sys.maxsize
+    return _walk(top, topdown, onerror, followlinks, maxdepth, jobs, entries=False, stat=False)
+
+
+def walk_entries(top: Union[str, PathLike[str]], topdown: bool = True,
+                 onerror: Optional[Callable[[OSError], None]] = None,
+                 followlinks: bool = False,
+                 maxdepth: Optional[int] = None,
+                 jobs: int = 1,
+                 stat: bool = False) -> Generator[Tuple[Union[str, PathLike[str]],
+                                                        list[DirEntry[str]],
+                                                        list[DirEntry[str]]],
+                                                  None, None]:
+    """Like walk(), but yields the os.DirEntry objects from scandir()
+    instead of names, so their cached stat results can be used. When
+    pruning, entries have to be removed from the dirs list, adding new
+    ones is not supported.
+
+    With 'stat' the lstat() result of every entry is requested right
+    after listing the directory, with 'jobs' greater than one that
+    happens on the thread pool."""
+    if maxdepth is None:
+        maxdepth = sys.maxsize
+    return _walk(top, topdown, onerror, followlinks, maxdepth, jobs, entries=True, stat=stat)
+
+
+def _scan(top: Union[str, PathLike[str]], topdown: bool,
+          followlinks: bool, stat: bool) -> Tuple[list[Any], list[Any], list[Any]]:
+    """List 'top', returns the entries of the subdirectories, the entries
+    of everything else and the paths of the subdirectories to descend
+    into in bottom up mode"""
     dirs = []
     nondirs = []
+    walk_dirs = []
 
-    # We may not have read permission for top, in which case we can't
-    # get a list of the files the directory contains.  os.walk
-    # always suppressed the exception then, rather than blow up for a
-    # minor reason when (say) a thousand readable directories are still
-    # left to visit.  That logic is copied here.
-    try:
-        if name == 'nt' and isinstance(top, bytes):  # type: ignore
-            scandir_it = _dummy_scandir(top)
-        else:
-            # Note that scandir is global in this module due
-            # to earlier import-*.
-            scandir_it = scandir(top)
-        entries: Sequence[DirEntry[str]] = list(scandir_it)
-    except OSError as error:
-        if onerror is not None:
-            onerror(error)
-        return
+    if name == 'nt' and isinstance(top, bytes):  # type: ignore
+        scandir_it = _dummy_scandir(top)
+    else:
+        scandir_it = scandir(top)
+    entries: Sequence[DirEntry[str]] = list(scandir_it)
 
     for entry in entries:
         try:
@@ -129,41 +141,111 @@ def _walk(top: Union[str, PathLike[str]], topdown: bool,
             # os.path.islink().
             is_symlink = False
 
+        if stat:
+            try:
+                entry.stat(follow_symlinks=False)
+            except OSError:
+                pass  # reported when the caller asks for it again
+
         if is_dir and not is_symlink:
-            dirs.append(entry.name)
+            dirs.append(entry)
         else:
-            nondirs.append(entry.name)
+            nondirs.append(entry)
 
         if not topdown and is_dir:
             # Bottom-up: recurse into sub-directory, but exclude symlinks to
             # directories if followlinks is False
-            if followlinks:
-                walk_into = True
-            else:
-                walk_into = not is_symlink
+            if followlinks or not is_symlink:
+                walk_dirs.append(entry.path)
 
-            if walk_into:
-                if depth < maxdepth:
-                    yield from _walk(entry.path, topdown, onerror, followlinks, maxdepth, depth + 1)
-
-    # Yield before recursion if going top down
-    if topdown:
-        yield top, dirs, nondirs  # type: ignore
-
-        # Recurse into sub-directories
-        islink, join = path.islink, path.join
-        for dirname in dirs:
-            new_path = join(top, dirname)
-            # Issue #23605: os.path.islink() is used instead of caching
-            # entry.is_symlink() result during the loop on os.scandir() because
-            # the caller can replace the directory entry during the "yield"
-            # above.
-            if followlinks or not islink(new_path):
+    return dirs, nondirs, walk_dirs
+
+
+# Iterative version of the os.walk() function from Python-3.5.2,
+# modified such that it returns symlinks to directories in the
+# 'nodirs' portion of the result tuple instead of the 'dirs' one.
+def _walk(top: Union[str, PathLike[str]], topdown: bool,
+          onerror: Optional[Callable[[OSError], None]],
+          followlinks: bool,
+          maxdepth: int,
+          jobs: int,
+          entries: bool,
+          stat: bool) -> Generator[Tuple[Union[str, PathLike[str]], list[Any], list[Any]], None, None]:
+    # Each stack item is [path, depth, future], 'future' holds the
+    # prefetched _scan() result. Bottom up, a directory is pushed a
+    # second time as [path, depth, (dirs, nondirs)] below its
+    # subdirectories, so it is yielded once they are done.
+    stack: list[list[Any]] = [[top, 1, None]]
+
+    executor = ThreadPoolExecutor(max_workers=jobs) if jobs > 1 else None
+    prefetch = jobs * 4
+
+    try:
+        while stack:
+            top, depth, pending = stack.pop()
+
+            if isinstance(pending, tuple):
+                # Yield after recursion if going bottom up
+                yield top, pending[0], pending[1]
+                continue
+
+            # We may not have read permission for top, in which case we can't
+            # get a list of the files the directory contains.  os.walk
+            # always suppressed the exception then, rather than blow up for a
+            # minor reason when (say) a thousand readable directories are still
+            # left to visit.  That logic is copied here.
+            try:
+                if pending is not None:
+                    dirs, nondirs, walk_dirs = pending.result()
+                else:
+                    dirs, nondirs, walk_dirs = _scan(top, topdown, followlinks, stat)
+            except OSError as error:
+                if onerror is not None:
+                    onerror(error)
+                continue
+
+            if not entries:
+                dirs = [entry.name for entry in dirs]
+                nondirs = [entry.name for entry in nondirs]
+
+            if topdown:
+                # Yield before recursion if going top down
+                if entries:
+                    yield top, dirs, nondirs
+
+                    # Recurse into sub-directories, in reverse as the
+                    # stack is processed from the end
+                    if depth < maxdepth:
+                        for entry in reversed(dirs):
+                            stack.append([entry.path, depth + 1, None])
+                else:
+                    known_dirs = set(dirs)
+                    yield top, dirs, nondirs
+
+                    if depth < maxdepth:
+                        join = path.join
+                        for dirname in reversed(dirs):
+                            new_path = join(top, dirname)
+                            # Issue #23605: os.path.islink() is used for
+                            # directories the caller added during the "yield"
+                            # above, the ones from scandir() are known to not
+                            # be symlinks.
+                            if followlinks or dirname in known_dirs or not path.islink(new_path):
+                                stack.append([new_path, depth + 1, None])
+            else:
+                stack.append([top, depth, (dirs, nondirs)])
                 if depth < maxdepth:
-                    yield from _walk(new_path, topdown, onerror, followlinks, maxdepth, depth + 1)
-    else:
-        # Yield after recursion if going bottom up
-        yield top, dirs, nondirs  # type: ignore
+                    for new_path in reversed(walk_dirs):
+                        stack.append([new_path, depth + 1, None])
+
+            if executor is not None:
+                # list the directories that are visited next ahead of time
+                for item in stack[-prefetch:]:
+                    if item[2] is None:
+                        item[2] = executor.submit(_scan, item[0], topdown, followlinks, stat)
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
 
 
 class _DummyDirEntry:
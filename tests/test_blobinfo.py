@@ -30,6 +30,18 @@ class BlobInfoTestCase(unittest.TestCase):
         self.assertEqual("bc9faaae1e35d52f3dea9651da12cd36627b8403", blobinfo.sha1)
         self.assertEqual(460961799, blobinfo.crc32)
 
+    def test_digests(self) -> None:
+        blobinfo = BlobInfo(11, md5="6df4d50a41a5d20bc4faad8a6f09aa8f")
+        self.assertEqual(blobinfo.md5_raw, bytes.fromhex("6df4d50a41a5d20bc4faad8a6f09aa8f"))
+        self.assertIsNone(blobinfo.sha1)
+        self.assertFalse(blobinfo.is_complete(["md5", "sha1"]))
+
+        blobinfo.sha1 = "bc9faaae1e35d52f3dea9651da12cd36627b8403"
+        self.assertEqual(len(blobinfo.sha1_raw or b""), 20)
+        self.assertEqual(blobinfo.sha1, "bc9faaae1e35d52f3dea9651da12cd36627b8403")
+        self.assertTrue(blobinfo.is_complete(["md5", "sha1", "crc32"]))
+        self.assertEqual(blobinfo, BlobInfo.from_file("tests/data/test.txt"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -18,11 +18,15 @@
 
 
 import os
+import sqlite3
+import tempfile
 import unittest
 
-from scatterbackup.database import Database
+from scatterbackup.blobinfo import BlobInfo
+from scatterbackup.database import Database, SCHEMA_VERSION
 from scatterbackup.fileinfo import FileInfo
 from scatterbackup.generation import GenerationRange
+from scatterbackup.storage import device_uuids, storage_name
 
 
 class DatabaseTestCase(unittest.TestCase):
@@ -57,6 +61,54 @@ class DatabaseTestCase(unittest.TestCase):
         self.assertEqual(results[0][0].path, os.path.abspath("tests/data/subdir/test.txt"))
         self.assertEqual(results[0][1].path, os.path.abspath("tests/data/test.txt"))
 
+    def test_get_ranked_duplicates(self) -> None:
+        results = list(self.db.get_ranked_duplicates(os.path.abspath("tests/data/")))
+        self.assertEqual(len(results), 1)
+        self.assertEqual(results[0].wasted, results[0].blob.size)
+        self.assertEqual([fi.path for fi in results[0].fileinfos],
+                         [os.path.abspath("tests/data/subdir/test.txt"),
+                          os.path.abspath("tests/data/test.txt")])
+
+        size = results[0].blob.size
+        self.assertEqual(len(list(self.db.get_ranked_duplicates(os.path.abspath("tests/data/subdir")))), 0)
+        self.assertEqual(len(list(self.db.get_ranked_duplicates(os.path.abspath("tests/data"),
+                                                                min_size=size + 1))), 0)
+        self.assertEqual(len(list(self.db.get_ranked_duplicates(os.path.abspath("tests/data"),
+                                                                min_wasted=size + 1))), 0)
+
+        # hardlinks don't waste space
+        fileinfo = FileInfo.from_file("tests/data/test.txt")
+        fileinfo.path = os.path.abspath("tests/data/subdir/hardlink.txt")
+        self.db.store(fileinfo)
+        results = list(self.db.get_ranked_duplicates(os.path.abspath("tests/data/")))
+        self.assertEqual(len(results[0].fileinfos), 3)
+        self.assertEqual(results[0].wasted, size)
+
+    def test_get_ranked_duplicates_digests(self) -> None:
+        blob = FileInfo.from_file("tests/data/test.txt").blob
+        assert blob is not None
+        blobs = [BlobInfo(blob.size, md5=blob.md5, sha1=blob.sha1),
+                 BlobInfo(blob.size, sha1=blob.sha1),
+                 BlobInfo(blob.size, md5=blob.md5, sha1=blob.sha1),
+                 # nothing to compare with
+                 BlobInfo(blob.size),
+                 BlobInfo(blob.size)]
+
+        for version in range(1, SCHEMA_VERSION + 1):
+            db = Database(":memory:", schema_version=version)
+            for i, content in enumerate(blobs):
+                fileinfo = FileInfo.from_file("tests/data/test.txt")
+                assert fileinfo.ino is not None
+                fileinfo.path = os.path.abspath("tests/data/copy{}.txt".format(i))
+                fileinfo.ino += i + 1
+                fileinfo.blob = content
+                db.store(fileinfo)
+
+            results = list(db.get_ranked_duplicates(os.path.abspath("tests/data"), top=1))
+            self.assertEqual(len(results), 1)
+            self.assertEqual(len(results[0].fileinfos), 3)
+            self.assertEqual(results[0].wasted, 2 * blob.size)
+
     def test_get_by_glob(self) -> None:
         results = list(self.db.get_by_glob(os.path.abspath("tests/*.txt")))
         self.assertEqual(len(results), 2)
@@ -71,6 +123,362 @@ class DatabaseTestCase(unittest.TestCase):
         next(gen2)
         next(gen)  # this will throw if the generator gets invalidaded by cursor reuse
 
+    def test_get_by_checksum(self) -> None:
+        results = list(self.db.get_by_checksum('sha1', "bc9faaae1e35d52f3dea9651da12cd36627b8403"))
+        self.assertEqual(len(results), 2)
+
+        fileinfo = FileInfo.from_file("tests/data/test.txt", checksums=False)
+        fileinfo.path = "/tmp/blake2b.txt"
+        fileinfo.blob = BlobInfo(11, blake2b="b797ce33")
+        self.db.store(fileinfo)
+
+        results = list(self.db.get_by_checksum('blake2b', "b797ce33"))
+        self.assertEqual(len(results), 1)
+        assert results[0].blob is not None
+        self.assertEqual(results[0].blob.blake2b, "b797ce33")
+        self.assertIsNone(results[0].blob.sha1)
+
+        self.assertRaises(Exception, lambda: self.db.get_by_checksum('path', "foo"))
+
+    def test_store_many(self) -> None:
+        db = Database(":memory:")
+        fileinfos = [FileInfo.from_file(p) for p in ["tests/data/test.txt",
+                                                     "tests/data/symlink.lnk",
+                                                     "tests/data/subdir/test.txt",
+                                                     "tests/data/subdir"]]
+        db.store_many(fileinfos)
+        db.store_many([])
+
+        results = sorted(db.get_all(), key=lambda fi: fi.path)
+        self.assertEqual([fi.path for fi in results], sorted(fi.path for fi in fileinfos))
+        for fileinfo in results:
+            if fileinfo.kind == "file":
+                assert fileinfo.blob is not None
+                self.assertEqual(fileinfo.blob.sha1, "bc9faaae1e35d52f3dea9651da12cd36627b8403")
+            elif fileinfo.kind == "link":
+                self.assertEqual(fileinfo.target, "test.txt")
+            else:
+                self.assertIsNone(fileinfo.blob)
+
+    def test_store_directory(self) -> None:
+        subdir_id = self.db.store_directory("/tmp/a/b/c")
+        self.assertEqual(self.db.store_directory("/tmp/a/b/c"), subdir_id)
+        self.db.directory_cache.clear()
+        self.assertEqual(self.db.lookup_directory("/tmp/a/b/c"), subdir_id)
+        self.assertIsNone(self.db.lookup_directory("/tmp/a/b/d"))
+
+        cur = self.db.con.cursor()
+        cur.execute("SELECT path, parent_id FROM directory WHERE path LIKE '/tmp%' ORDER BY path")
+        rows = cur.fetchall()
+        self.assertEqual([path for path, _ in rows], ["/tmp", "/tmp/a", "/tmp/a/b", "/tmp/a/b/c"])
+        for (parent_path, _), (path, parent_id) in zip(rows, rows[1:]):
+            self.assertEqual(parent_id, self.db.lookup_directory(parent_path))
+
+    def test_checkpoint(self) -> None:
+        self.assertIsNone(self.db.resume_generation())
+
+        gen = self.db.init_generation("sb-update")
+        self.assertIsNone(self.db.get_checkpoint("/tmp"))
+        self.db.store_checkpoint("/tmp", "/tmp/a", False)
+        self.db.store_checkpoint("/tmp", "/tmp/b", False)
+        self.assertEqual(self.db.get_checkpoint("/tmp"), ("/tmp/b", False))
+
+        self.db.current_generation = None
+        self.assertEqual(self.db.resume_generation(), gen)
+        self.assertEqual(self.db.get_checkpoint("/tmp"), ("/tmp/b", False))
+
+        self.db.deinit_generation(gen)
+        self.assertIsNone(self.db.resume_generation())
+        self.assertEqual(self.db.con.execute("SELECT COUNT(*) FROM checkpoint").fetchall(), [(0,)])
+
+    def test_get_by_inode(self) -> None:
+        db = Database(":memory:")
+        gen1 = db.init_generation("test")
+        db.store(FileInfo.from_file("tests/data/test.txt"))
+        db.deinit_generation(gen1)
+
+        # move the file
+        gen2 = db.init_generation("test")
+        fileinfo = db.get_one_by_path(os.path.abspath("tests/data/test.txt"))
+        assert fileinfo is not None and fileinfo.dev is not None and fileinfo.ino is not None
+        db.mark_removed(fileinfo)
+        moved = FileInfo.from_file("tests/data/test.txt")
+        moved.path = os.path.abspath("tests/data/subdir/moved.txt")
+        db.store(moved)
+        db.deinit_generation(gen2)
+
+        self.assertEqual([fi.path for fi in db.get_by_inode(fileinfo.dev, fileinfo.ino)],
+                         [moved.path])
+        self.assertEqual([fi.path for fi in db.get_by_inode(fileinfo.dev, fileinfo.ino, GenerationRange.MATCH_ALL)],
+                         [moved.path, fileinfo.path])
+        self.assertEqual([fi.path for fi in db.get_by_inode(fileinfo.dev, fileinfo.ino,
+                                                            GenerationRange(gen1, gen2))],
+                         [fileinfo.path])
+        self.assertEqual(list(db.get_by_inode(fileinfo.dev, fileinfo.ino + 1)), [])
+
+        self.assertEqual([fi.path for fi in db.get_by_inodes([(fileinfo.dev, fileinfo.ino),
+                                                              (fileinfo.dev, fileinfo.ino + 1)],
+                                                             GenerationRange.MATCH_ALL)],
+                         [moved.path, fileinfo.path])
+        self.assertEqual(list(db.get_by_inodes([])), [])
+
+    def test_store_blob(self) -> None:
+        fileinfo = FileInfo.from_file("tests/data/test.txt", checksums=True)
+        assert fileinfo.blob is not None
+        blob_id = self.db.store_blob(fileinfo.blob)
+
+        # identical content shares the row
+        self.db.blob_cache.clear()
+        self.assertEqual(self.db.store_blob(BlobInfo(11, sha1=fileinfo.blob.sha1)), blob_id)
+        self.assertNotEqual(self.db.store_blob(BlobInfo(11, sha1="b797ce33")), blob_id)
+
+        cur = self.db.con.cursor()
+        cur.execute("SELECT COUNT(DISTINCT blob_id) FROM fileinfo WHERE blob_id IS NOT NULL")
+        self.assertEqual(cur.fetchall(), [(1,)])
+
+        # missing digests get filled in
+        other_id = self.db.store_blob(BlobInfo(5, sha1="aabbccdd"))
+        self.assertEqual(self.db.store_blob(BlobInfo(5, md5="eeff", sha1="aabbccdd")), other_id)
+        cur.execute("SELECT md5, sha1, blake2b FROM blob WHERE id = ?", [other_id])
+        self.assertEqual(cur.fetchall(), [(bytes.fromhex("eeff"), bytes.fromhex("aabbccdd"), None)])
+
+        # a stronger digest that wasn't configured before doesn't
+        # split the content into a second row
+        self.db.blob_cache.clear()
+        self.assertEqual(self.db.store_blob(BlobInfo(5, md5="eeff", sha1="aabbccdd", blake2b="0123")), other_id)
+        self.assertEqual(self.db.store_blob(BlobInfo(5, blake2b="0123")), other_id)
+        cur.execute("SELECT blake2b FROM blob WHERE id = ?", [other_id])
+        self.assertEqual(cur.fetchall(), [(bytes.fromhex("0123"),)])
+
+        # a shared digest that differs is different content
+        self.assertNotEqual(self.db.store_blob(BlobInfo(5, md5="eeff", sha1="99999999")), other_id)
+
+    def test_migrate(self) -> None:
+        for version in range(1, SCHEMA_VERSION):
+            db = Database(":memory:", schema_version=version)
+            self.assertEqual(db.schema_version, version)
+            db.store(FileInfo.from_file("tests/data/test.txt"))
+            db.store(FileInfo.from_file("tests/data/symlink.lnk"))
+            db.store(FileInfo.from_file("tests/data/subdir/test.txt"))
+            db.store(FileInfo.from_file("tests/data/subdir", checksums=False))
+            self.assertEqual(len(list(db.get_duplicates(os.path.abspath("tests/data/")))), 1)
+            expected = sorted(((fi.path, fi.blob, fi.target) for fi in db.get_all()), key=lambda x: x[0])
+
+            db.migrate()
+            self.assertEqual(db.schema_version, SCHEMA_VERSION)
+            cur = db.con.cursor()
+            cur.execute("PRAGMA user_version")
+            self.assertEqual(cur.fetchall(), [(SCHEMA_VERSION,)])
+            cur.execute("SELECT COUNT(*) FROM blob")
+            self.assertEqual(cur.fetchall(), [(1,)])
+            cur.execute("PRAGMA table_info(fileinfo)")
+            self.assertNotIn("path", [row[1] for row in cur.fetchall()])
+
+            self.assertEqual(sorted(((fi.path, fi.blob, fi.target) for fi in db.get_all()), key=lambda x: x[0]),
+                             expected)
+            self.assertEqual(len(list(db.get_by_checksum('sha1', "bc9faaae1e35d52f3dea9651da12cd36627b8403"))), 2)
+            self.assertEqual(len(list(db.get_duplicates(os.path.abspath("tests/data/")))), 1)
+            self.assertEqual(len(list(db.get_by_glob(os.path.abspath("tests/*.txt")))), 2)
+            self.assertIsNotNone(db.get_one_by_path(os.path.abspath("tests/data/symlink.lnk")))
+
+            # the device number of the still mounted filesystem was
+            # replaced with its storageinfo id
+            st_dev = os.stat("tests/data").st_dev
+            name = storage_name(os.path.abspath("tests/data/subdir"), st_dev, device_uuids())
+            cur.execute("SELECT DISTINCT fileinfo.dev, storageinfo.name "
+                        "FROM fileinfo LEFT JOIN storageinfo ON storageinfo.id = fileinfo.dev")
+            self.assertEqual(cur.fetchall(), [(db.get_storage_id(name), name)])
+
+    def test_root_path(self) -> None:
+        fileinfo = FileInfo.from_file("/", checksums=False)
+        self.db.store(fileinfo)
+        result = self.db.get_one_by_path("/")
+        assert result is not None
+        self.assertEqual(result.path, "/")
+        self.assertEqual([fi.path for fi in self.db.get_by_glob("/")], ["/"])
+
+    def test_profile(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.sqlite3")
+            db = Database(filename, profile="bulk-write")
+            db.store(FileInfo.from_file("tests/data/test.txt"))
+            db.commit()
+
+            db = Database(filename, profile="interactive-read")
+            self.assertEqual(len(list(db.get_all())), 1)
+            self.assertRaises(sqlite3.OperationalError, lambda: db.store(FileInfo.from_file("tests/data/test.txt")))
+
+            db.set_profile("default")
+            db.store(FileInfo.from_file("tests/data/test.txt"))
+            self.assertRaises(Exception, lambda: db.set_profile("unknown"))
+
+    def test_alive_indices(self) -> None:
+        def query_plan(sql: str, args: list[object]) -> str:
+            cur = self.db.con.cursor()
+            cur.execute("EXPLAIN QUERY PLAN " + sql, args)
+            return " ".join(row[3] for row in cur)
+
+        for _ in range(2):
+            directory_id = self.db.lookup_directory(os.path.abspath("tests/data"))
+            self.assertIn("fileinfo_alive_name_index",
+                          query_plan(self.db.fileinfo_select +
+                                     "WHERE fileinfo.death is NULL AND fileinfo.directory_id = ?",
+                                     [directory_id]))
+
+            args: list[object] = []
+            stmt = self.db.glob_condition(os.path.abspath("tests/*.txt"), args)
+            plan = query_plan(self.db.fileinfo_select + "WHERE fileinfo.death is NULL AND " + stmt, args)
+            self.assertIn("directory_path_index (path>? AND path<?)", plan)
+            self.assertIn("fileinfo_alive_name_index", plan)
+
+            self.db.rebuild_indices()
+
+        self.assertEqual(len(list(self.db.get_by_glob(os.path.abspath("tests/*.txt")))), 2)
+
+    def test_get_changed_by_glob(self) -> None:
+        db = Database(":memory:")
+        pattern = os.path.abspath("tests/data/*")
+
+        gen1 = db.init_generation("test")
+        db.store(FileInfo.from_file("tests/data/test.txt"))
+        db.store(FileInfo.from_file("tests/data/subdir/test.txt"))
+        db.deinit_generation(gen1)
+
+        gen2 = db.init_generation("test")
+        fileinfo = db.get_one_by_path(os.path.abspath("tests/data/test.txt"))
+        assert fileinfo is not None
+        db.mark_removed(fileinfo)
+        db.store(FileInfo.from_file("tests/data/test.txt"))
+        db.deinit_generation(gen2)
+
+        gen3 = db.init_generation("test")
+        fileinfo = db.get_one_by_path(os.path.abspath("tests/data/subdir/test.txt"))
+        assert fileinfo is not None
+        db.mark_removed(fileinfo)
+        db.deinit_generation(gen3)
+
+        def changes(start: int, end: int) -> list[tuple[str, int, int]]:
+            return [(os.path.relpath(fi.path, "tests/data"), fi.birth, fi.death)
+                    for fi in db.get_changed_by_glob(pattern, GenerationRange(start, end))]
+
+        self.assertEqual(changes(gen1, gen3 + 1),
+                         [("test.txt", gen1, gen2),
+                          ("subdir/test.txt", gen1, gen3),
+                          ("test.txt", gen2, None)])
+        self.assertEqual(changes(gen2, gen3 + 1),
+                         [("test.txt", gen1, gen2),
+                          ("test.txt", gen2, None),
+                          ("subdir/test.txt", gen1, gen3)])
+        self.assertEqual(changes(gen3, gen3 + 1), [("subdir/test.txt", gen1, gen3)])
+
+    def test_dirstat(self) -> None:
+        def expected(path: str) -> tuple[int, int]:
+            prefix = os.path.join(path, "")
+            fileinfos = [fi for fi in self.db.get_all() if fi.path.startswith(prefix) and fi.death is None]
+            return (sum(fi.size or 0 for fi in fileinfos),
+                    sum(1 for fi in fileinfos if fi.kind == "file"))
+
+        def check() -> None:
+            for path in ["tests/data", "tests", "/"]:
+                dirstat = self.db.get_dirstat(os.path.abspath(path))
+                assert dirstat is not None
+                self.assertEqual((dirstat.size, dirstat.count), expected(os.path.abspath(path)))
+
+        self.db.init_generation("test")
+        self.db.store(FileInfo.from_file("tests/data/subdir"))
+        check()
+        dirstat = self.db.get_dirstat(os.path.abspath("tests/data"))
+        assert dirstat is not None
+        self.assertEqual(dirstat.count, 2)
+        self.assertIsNone(self.db.get_dirstat(os.path.abspath("non-existing-dir")))
+
+        fileinfo = self.db.get_one_by_path(os.path.abspath("tests/data/test.txt"))
+        assert fileinfo is not None
+        self.db.mark_removed(fileinfo)
+        check()
+
+        subdir = self.db.get_one_by_path(os.path.abspath("tests/data/subdir"))
+        assert subdir is not None
+        self.db.mark_removed_recursive(subdir)
+        check()
+        dirstat = self.db.get_dirstat(os.path.abspath("tests/data"))
+        assert dirstat is not None
+        self.assertEqual(dirstat.count, 0)
+
+        self.db.store_many([FileInfo.from_file("tests/data/test.txt")])
+        self.db.commit()
+        rows = self.db.con.execute("SELECT * FROM dirstat ORDER BY directory_id").fetchall()
+        self.db.rebuild_dirstat()
+        self.assertEqual(self.db.con.execute("SELECT * FROM dirstat ORDER BY directory_id").fetchall(),
+                         [row for row in rows if row[1:4] != (0, 0, 0)])
+
+    def test_dirstat_existing_database(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.sqlite3")
+            db = Database(filename)
+            db.store(FileInfo.from_file("tests/data/test.txt"))
+            db.commit()
+            db.execute(db.con.cursor(), "DROP TABLE dirstat")
+            db.con.commit()
+            del db
+
+            # opening a database from before the dirstat table doesn't
+            # build it, that is left to 'sb-dbtool --rebuild-dirstat'
+            db = Database(filename, profile="interactive-read")
+            self.assertIsNone(db.get_dirstat(os.path.abspath("tests/data")))
+            self.assertFalse(db.table_exists("dirstat"))
+            del db
+
+            db = Database(filename)
+            db.rebuild_dirstat()
+            db.commit()
+            dirstat = db.get_dirstat(os.path.abspath("tests/data"))
+            assert dirstat is not None
+            self.assertEqual(dirstat.count, 1)
+            del db
+
+    def test_get_subtree(self) -> None:
+        for version in range(1, SCHEMA_VERSION + 1):
+            db = Database(":memory:", schema_version=version)
+            for root in ["/old", "/new"]:
+                for relpath in ["b", "a/x", "a-b", "a", "c/d/e"]:
+                    fileinfo = FileInfo(os.path.join(root, relpath))
+                    fileinfo.kind = "file"
+                    fileinfo.blob = BlobInfo(1, sha1="aa" if relpath != "b" or root == "/old" else "bb")
+                    db.store(fileinfo)
+
+            old = list(db.get_subtree("/old"))
+            new = list(db.get_subtree("/new"))
+            self.assertEqual([x[0] for x in old], sorted(x[0] for x in old))
+            self.assertEqual([x[:3] for x in old], [x[:3] for x in new])
+            self.assertEqual(sorted(x[1] for x in old), ["a", "a-b", "a/x", "b", "c/d/e"])
+            self.assertEqual([x[1] for x in old if x[3] != new[old.index(x)][3]], ["b"])
+
+            self.assertEqual(sorted(x[1] for x in db.get_subtree("/old", ["a", "c/d"])), ["a-b", "b"])
+            self.assertEqual(sorted(x[1] for x in db.get_subtree("/old", ["c/d/e", "a/x/"])), ["a", "a-b", "b"])
+
+    def test_get_by_blobs(self) -> None:
+        for version in range(1, SCHEMA_VERSION + 1):
+            db = Database(":memory:", schema_version=version)
+            for path in ["tests/data/test.txt", "tests/data/subdir/test.txt", "tests/data/symlink.lnk"]:
+                db.store(FileInfo.from_file(path))
+
+            fileinfo = FileInfo.from_file("tests/data/test.txt")
+            blob = fileinfo.blob
+            assert blob is not None
+            self.assertEqual(len(list(db.get_by_blobs([blob]))), 2)
+            self.assertEqual([fi.path for _, fi in db.get_by_blobs([blob], [os.path.abspath("tests/data/subdir")])],
+                             [os.path.abspath("tests/data/subdir/test.txt")])
+            self.assertEqual(list(db.get_by_blobs([blob], [os.path.abspath("tests/data/sub")])), [])
+            self.assertEqual(list(db.get_by_blobs([BlobInfo(11, sha1="b797ce33")])), [])
+
+            # a copy hashed with another set of digests is found through
+            # the ones both have, a differing one rules it out
+            other = BlobInfo(11, sha1=blob.sha1, blake2b="0123")
+            conflict = BlobInfo(11, sha1=blob.sha1, md5="0123")
+            self.assertEqual(sorted(index for index, _ in db.get_by_blobs([conflict, other, blob])),
+                             [1, 1, 2, 2])
+
     def test_get_all(self) -> None:
         results = list(self.db.get_all())
         self.assertEqual(len(results), 3)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+
+
+import io
+import os
+import tempfile
+import unittest
+
+from scatterbackup.cmd_du import disk_usage
+from scatterbackup.database import Database
+from scatterbackup.fileinfo import FileInfo
+
+
+class DuTestCase(unittest.TestCase):
+
+    def test_disk_usage(self) -> None:
+        paths = ["tests/data/test.txt", "tests/data/symlink.lnk",
+                 "tests/data/subdir", "tests/data/subdir/test.txt"]
+        fileinfos = [FileInfo.from_file(path) for path in paths]
+        file_count = len([fileinfo for fileinfo in fileinfos if fileinfo.kind == "file"])
+        total_bytes = sum(fileinfo.size or 0 for fileinfo in fileinfos)
+
+        db = Database(":memory:")
+        db.init_generation("test")
+        db.store(FileInfo.from_file("tests/data"))
+        for fileinfo in fileinfos:
+            db.store(fileinfo)
+        db.commit()
+
+        data = os.path.abspath("tests/data")
+
+        # every entry below the directory is listed, only regular
+        # files are counted
+        fout = io.StringIO()
+        self.assertEqual(disk_usage(db, data, False, fout), (file_count, total_bytes))
+        self.assertEqual(sorted(line.split()[1] for line in fout.getvalue().splitlines()),
+                         sorted(os.path.abspath(path) for path in paths))
+
+        # -s gives the same totals from the dirstat rollup
+        self.assertIsNotNone(db.get_dirstat(data))
+        fout = io.StringIO()
+        self.assertEqual(disk_usage(db, data, True, fout), (file_count, total_bytes))
+        self.assertEqual(fout.getvalue(), "")
+
+        # a single file
+        self.assertEqual(disk_usage(db, os.path.join(data, "test.txt"), True),
+                         (1, fileinfos[0].size))
+
+    def test_disk_usage_without_dirstat(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.sqlite3")
+            db = Database(filename)
+            db.init_generation("test")
+            for path in ["tests/data/test.txt", "tests/data/subdir/test.txt"]:
+                db.store(FileInfo.from_file(path))
+            db.commit()
+            db.execute(db.con.cursor(), "DROP TABLE dirstat")
+            db.con.commit()
+            del db
+
+            db = Database(filename, profile="analytics")
+            data = os.path.abspath("tests/data")
+            self.assertIsNone(db.get_dirstat(data))
+            self.assertEqual(disk_usage(db, data, True), disk_usage(db, data, False, io.StringIO()))
+            self.assertEqual(disk_usage(db, data, True)[0], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
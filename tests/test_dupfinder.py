@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import tempfile
+import unittest
+
+from scatterbackup.cmd_dupfinder import find_duplicates, store_checksums, DatabaseCache, SAMPLE_SIZE
+from scatterbackup.database import Database
+from scatterbackup.fileinfo import FileInfo
+
+
+class DupfinderTestCase(unittest.TestCase):
+
+    def test_find_duplicates(self) -> None:
+        big = bytes(range(256)) * (3 * SAMPLE_SIZE // 256)
+        middle = len(big) // 2
+        content = {
+            "big1": big,
+            "big2": big,
+            # only differs outside of the sample
+            "big3": big[:middle] + b"x" + big[middle + 1:],
+            "small1": b"Hello World",
+            "small2": b"Hello World",
+            "small3": b"Hello Wxrld",
+            "unique": b"unique",
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name, data in content.items():
+                with open(os.path.join(tmpdir, name), "wb") as fout:
+                    fout.write(data)
+            os.link(os.path.join(tmpdir, "big1"), os.path.join(tmpdir, "hardlink"))
+
+            fileinfos = [FileInfo.from_file(os.path.join(tmpdir, name))
+                         for name in sorted(list(content) + ["hardlink"])]
+
+            def names(groups: list[list[FileInfo]]) -> list[list[str]]:
+                return sorted(sorted(os.path.basename(fi.path) for fi in g) for g in groups)
+
+            for jobs in [1, 4]:
+                self.assertEqual(names(find_duplicates(fileinfos, jobs=jobs)),
+                                 [["big1", "big2"], ["small1", "small2"]])
+
+            self.assertEqual(names(find_duplicates(fileinfos, size_only=True)),
+                             [["big1", "big2", "big3"], ["small1", "small2", "small3"]])
+            self.assertEqual(names(find_duplicates(fileinfos, limit=100)), [["big1", "big2"]])
+
+    def test_find_duplicates_cache(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            def write(name: str, data: bytes) -> None:
+                with open(os.path.join(tmpdir, name), "wb") as fout:
+                    fout.write(data)
+                os.utime(os.path.join(tmpdir, name), ns=(0, 0))
+
+            def scan() -> list[FileInfo]:
+                return [FileInfo.from_file(os.path.join(tmpdir, name), checksums=False)
+                        for name in ["a", "b", "c"]]
+
+            def names(groups: list[list[FileInfo]]) -> list[list[str]]:
+                return sorted(sorted(os.path.basename(fi.path) for fi in g) for g in groups)
+
+            write("a", b"Hello World")
+            write("b", b"Hello World")
+            write("c", b"Hello Wxrld")
+
+            db = Database(os.path.join(tmpdir, "test.sqlite3"))
+            cache = DatabaseCache(db)
+
+            # nothing is known, everything gets read and stored
+            fileinfos = scan()
+            self.assertEqual(names(find_duplicates(fileinfos, cache=cache)), [["a", "b"]])
+            gen = db.init_generation("test")
+            self.assertEqual(store_checksums(db, cache, fileinfos), 3)
+            db.deinit_generation(gen)
+            db.commit()
+
+            # unchanged rows aren't stored again
+            fileinfos = scan()
+            find_duplicates(fileinfos, cache=DatabaseCache(db))
+            self.assertEqual(store_checksums(db, DatabaseCache(db), fileinfos), 0)
+
+            # same size and mtime, the stale checksum from the database wins
+            write("c", b"Hello World")
+            self.assertEqual(names(find_duplicates(scan(), cache=DatabaseCache(db))), [["a", "b"]])
+            self.assertEqual(names(find_duplicates(scan())), [["a", "b", "c"]])
+
+            # a changed mtime invalidates the checksum
+            os.utime(os.path.join(tmpdir, "c"), ns=(1, 1))
+            self.assertEqual(names(find_duplicates(scan(), cache=DatabaseCache(db))), [["a", "b", "c"]])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
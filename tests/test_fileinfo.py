@@ -16,6 +16,7 @@
 # You should have received a copy of the GNU General Public License
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
+import os
 import unittest
 from scatterbackup.fileinfo import FileInfo
 
@@ -29,6 +30,16 @@ class FileInfoTestCase(unittest.TestCase):
         self.assertEqual("6df4d50a41a5d20bc4faad8a6f09aa8f", fileinfo.blob.md5)
         self.assertEqual("bc9faaae1e35d52f3dea9651da12cd36627b8403", fileinfo.blob.sha1)
 
+    def test_from_dir_entry(self) -> None:
+        entries = {entry.name: entry for entry in os.scandir(os.path.abspath("tests/data"))}
+        for name in ["test.txt", "symlink.lnk", "subdir"]:
+            expected = FileInfo.from_file(os.path.join("tests/data", name))
+            fileinfo = FileInfo.from_dir_entry(entries[name])
+            fileinfo.time = expected.time
+            self.assertEqual(fileinfo, expected)
+            self.assertEqual(fileinfo.path, expected.path)
+            self.assertEqual(fileinfo.target, expected.target)
+
     # def test_json(self) -> None:
     #     fileinfo = FileInfo.from_file("tests/test.txt")
     #     jstxt = fileinfo.json()
@@ -0,0 +1,52 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from scatterbackup.hasher import Hasher
+
+
+class HasherTestCase(unittest.TestCase):
+
+    def test_hash_file(self) -> None:
+        for block_size in [1, 4, 11, 1024]:
+            for threaded in [False, True]:
+                hasher = Hasher(block_size=block_size, threaded=threaded,
+                                digests=["md5", "sha1", "crc32", "blake2b"])
+                size, digests = hasher.hash_file("tests/data/test.txt")
+                hasher.close()
+
+                self.assertEqual(11, size)
+                self.assertEqual("6df4d50a41a5d20bc4faad8a6f09aa8f", digests["md5"])
+                self.assertEqual("bc9faaae1e35d52f3dea9651da12cd36627b8403", digests["sha1"])
+                self.assertEqual(460961799, digests["crc32"])
+                self.assertEqual("b797ce335db9e7b58577d0e5737dbba3c3c566a5a65c8610e668bd7963f2f603"
+                                 "6aa6cc309b96c1155025fb1ebc91ce14b9eb8037871d344a8f44c4480c82a374",
+                                 digests["blake2b"])
+
+    def test_digests(self) -> None:
+        hasher = Hasher(digests=["blake2b"])
+        size, digests = hasher.hash_file("tests/data/test.txt")
+        self.assertEqual(["blake2b"], list(digests.keys()))
+        self.assertRaises(Exception, lambda: Hasher(digests=["sha3"]))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
@@ -0,0 +1,59 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+
+from scatterbackup.fileinfo import FileInfo
+from scatterbackup.hashpool import HashPool
+
+
+class HashPoolTestCase(unittest.TestCase):
+
+    def test_order(self) -> None:
+        pool = HashPool(4, max_pending=2)
+        results: list[tuple[int, FileInfo]] = []
+        errors: list[OSError] = []
+        pool.onerror = errors.append
+
+        fileinfos = []
+        for i in range(20):
+            fi = FileInfo.from_file("tests/data/test.txt", checksums=False)
+            fileinfos.append(fi)
+            pool.submit(fi if i % 3 != 0 else None,
+                        lambda i=i, fi=fi: results.append((i, fi)))  # type: ignore
+            self.assertLessEqual(len(pool.pending), 2)
+
+        pool.submit(FileInfo("tests/data/does-not-exist"), lambda: None)
+
+        pool.join()
+        pool.shutdown()
+
+        self.assertEqual([i for i, _ in results], list(range(20)))
+        for i, fi in results:
+            if i % 3 != 0:
+                assert fi.blob is not None
+                self.assertEqual("bc9faaae1e35d52f3dea9651da12cd36627b8403", fi.blob.sha1)
+            else:
+                self.assertIsNone(fi.blob)
+        self.assertEqual(len(errors), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import os
+import sys
+import tempfile
+import unittest
+
+from scatterbackup.cmd_watch import Watcher
+from scatterbackup.inotify import (Inotify, Event, parse_events, EVENT_HEADER,
+                                   IN_CREATE, IN_ISDIR, IN_Q_OVERFLOW, IN_UNMOUNT)
+
+
+class InotifyTestCase(unittest.TestCase):
+
+    def test_parse_events(self) -> None:
+        data = (EVENT_HEADER.pack(1, IN_CREATE, 0, 16) + b"test.txt".ljust(16, b"\0") +
+                EVENT_HEADER.pack(2, IN_CREATE | IN_ISDIR, 0, 4) + b"\xff\0\0\0" +
+                EVENT_HEADER.pack(-1, IN_Q_OVERFLOW, 0, 0))
+        self.assertEqual(parse_events(data),
+                         [Event(1, IN_CREATE, 0, "test.txt"),
+                          Event(2, IN_CREATE | IN_ISDIR, 0, os.fsdecode(b"\xff")),
+                          Event(-1, IN_Q_OVERFLOW, 0, "")])
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "requires inotify")
+    def test_watcher(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir, Inotify() as inotify:
+            os.mkdir(os.path.join(tmpdir, "a"))
+
+            watcher = Watcher(inotify, [tmpdir])
+            watcher.watch_all()
+            self.assertIsNone(watcher.timeout(1.0, 10.0))
+
+            os.mkdir(os.path.join(tmpdir, "b"))
+            with open(os.path.join(tmpdir, "a", "test.txt"), "w") as fout:
+                fout.write("Hello World")
+
+            for event in inotify.read(1.0):
+                watcher.handle(event)
+
+            self.assertIsNotNone(watcher.timeout(1.0, 10.0))
+            overflow, dirs, trees = watcher.take()
+            self.assertFalse(overflow)
+            self.assertEqual(dirs, [tmpdir, os.path.join(tmpdir, "a")])
+            self.assertEqual(trees, [os.path.join(tmpdir, "b")])
+            self.assertIn(os.path.join(tmpdir, "b"), watcher.path_to_wd)
+            self.assertIsNone(watcher.timeout(1.0, 10.0))
+
+    @unittest.skipUnless(sys.platform.startswith("linux"), "requires inotify")
+    def test_watcher_removed(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir, Inotify() as inotify:
+            os.mkdir(os.path.join(tmpdir, "a"))
+            os.mkdir(os.path.join(tmpdir, "b"))
+
+            watcher = Watcher(inotify, [tmpdir])
+            watcher.watch_all()
+
+            # IN_IGNORED drops the watch of a deleted directory
+            os.rmdir(os.path.join(tmpdir, "a"))
+            for event in inotify.read(1.0):
+                watcher.handle(event)
+            self.assertNotIn(os.path.join(tmpdir, "a"), watcher.path_to_wd)
+            self.assertEqual(sorted(watcher.wd_to_path.values()), [tmpdir, os.path.join(tmpdir, "b")])
+            watcher.take()
+
+            # IN_UNMOUNT drops the watch, the directory below the mount
+            # point gets a new one and is rescanned
+            wd = watcher.path_to_wd[os.path.join(tmpdir, "b")]
+            inotify.rm_watch(wd)
+            watcher.handle(Event(wd, IN_UNMOUNT, 0, ""))
+            self.assertNotIn(wd, watcher.wd_to_path)
+            self.assertNotEqual(watcher.path_to_wd[os.path.join(tmpdir, "b")], wd)
+            overflow, dirs, trees = watcher.take()
+            self.assertEqual(dirs, [])
+            self.assertEqual(trees, [os.path.join(tmpdir, "b")])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
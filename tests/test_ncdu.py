@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from typing import Any
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from scatterbackup.cmd_ncdu import write_ncdu
+from scatterbackup.database import Database
+from scatterbackup.fileinfo import FileInfo
+
+
+class NcduTestCase(unittest.TestCase):
+
+    def test_write_ncdu(self) -> None:
+        db = Database(":memory:")
+        for path in ["tests/data/test.txt", "tests/data/symlink.lnk",
+                     "tests/data/subdir", "tests/data/subdir/test.txt"]:
+            db.store(FileInfo.from_file(path))
+
+        def names(node: list[Any]) -> list[Any]:
+            return [names(child) if isinstance(child, list) else child["name"]
+                    for child in node]
+
+        fout = io.StringIO()
+        write_ncdu(db, os.path.abspath("tests/data"), fout)
+        ncdu = json.loads(fout.getvalue())
+        self.assertEqual(ncdu[:2], [1, 0])
+        self.assertEqual(sorted(names(ncdu[3])[1:], key=str),
+                         sorted(["symlink.lnk", "test.txt", ["subdir", "test.txt"]], key=str))
+        self.assertEqual(ncdu[3][0]["name"], os.path.abspath("tests/data"))
+
+        # directories without an entry of their own are faked
+        fout = io.StringIO()
+        write_ncdu(db, os.path.dirname(os.path.abspath("tests")), fout)
+        ncdu = json.loads(fout.getvalue())
+        tests_node = ncdu[3][1]
+        self.assertEqual(tests_node[0], {"name": "tests", "asize": 0, "dev": 0, "ino": 0})
+        self.assertEqual(tests_node[1][0]["name"], "data")
+
+    def test_write_ncdu_without_dirstat(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename = os.path.join(tmpdir, "test.sqlite3")
+            db = Database(filename)
+            db.init_generation("test")
+            for path in ["tests/data/test.txt", "tests/data/subdir/test.txt"]:
+                db.store(FileInfo.from_file(path))
+            db.commit()
+            db.execute(db.con.cursor(), "DROP TABLE dirstat")
+            db.con.commit()
+            del db
+
+            db = Database(filename, profile="interactive-read")
+            self.assertIsNone(db.get_dirstat(os.path.abspath("tests/data")))
+
+            # directories without an entry of their own are still found
+            fout = io.StringIO()
+            write_ncdu(db, os.path.abspath("tests"), fout)
+            ncdu = json.loads(fout.getvalue())
+            data_node = ncdu[3][1]
+            self.assertEqual(data_node[0]["name"], "data")
+            self.assertEqual(sorted(child[0]["name"] if isinstance(child, list) else child["name"]
+                                    for child in data_node[1:]),
+                             ["subdir", "test.txt"])
+
+            # but not once everything below them is gone
+            db.set_profile("default")
+            db.init_generation("test")
+            fileinfo = db.get_one_by_path(os.path.abspath("tests/data/subdir/test.txt"))
+            assert fileinfo is not None
+            db.mark_removed(fileinfo)
+            fout = io.StringIO()
+            write_ncdu(db, os.path.abspath("tests/data"), fout)
+            ncdu = json.loads(fout.getvalue())
+            self.assertEqual([child["name"] for child in ncdu[3][1:]], ["test.txt"])
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
@@ -0,0 +1,75 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from scatterbackup.database import Database
+from scatterbackup.fileinfo import FileInfo
+from scatterbackup.storage import StorageRegistry, find_storage_name, storage_name
+
+
+class StorageTestCase(unittest.TestCase):
+
+    def test_storage_name(self) -> None:
+        dev = os.stat("tests/data").st_dev
+        self.assertEqual(storage_name("tests/data", dev, {dev: "1234-ABCD"}), "uuid:1234-ABCD")
+        self.assertEqual(storage_name("tests/data", dev, {}), storage_name("tests/data/subdir", dev, {}))
+
+    def test_find_storage_name(self) -> None:
+        dev = os.stat("tests/data").st_dev
+        name = storage_name("tests/data", dev, {})
+        # a file that is gone is resolved through its parent
+        self.assertEqual(find_storage_name(os.path.abspath("tests/data/gone/gone.txt"), dev, {}), name)
+        # a device number that isn't the one of the path anymore
+        self.assertEqual(find_storage_name(os.path.abspath("tests/data"), dev + 1, {}), "dev:{:d}".format(dev + 1))
+
+    def test_storage_registry(self) -> None:
+        db = Database(":memory:")
+        storage = StorageRegistry(db)
+
+        fileinfos = [FileInfo.from_file(path, checksums=False)
+                     for path in ["tests/data", "tests/data/test.txt", "tests/data/subdir/test.txt"]]
+        for fileinfo in fileinfos:
+            storage.assign(fileinfo)
+
+        rows = db.con.execute("SELECT id, name FROM storageinfo").fetchall()
+        self.assertEqual(len(rows), 1)
+        self.assertEqual([fileinfo.dev for fileinfo in fileinfos], [rows[0][0]] * 3)
+
+        # a file that vanished before its filesystem was looked up
+        # gets the same id
+        fileinfo = FileInfo.from_file("tests/data/test.txt", checksums=False)
+        fileinfo.path = os.path.abspath("tests/data/gone/gone.txt")
+        StorageRegistry(db).assign(fileinfo)
+        self.assertEqual(fileinfo.dev, rows[0][0])
+
+        # a new run maps to the same id
+        fileinfo = FileInfo.from_file("tests/data/test.txt", checksums=False)
+        StorageRegistry(db).assign(fileinfo)
+        self.assertEqual(fileinfo.dev, rows[0][0])
+
+        # older databases keep st_dev until they are migrated
+        fileinfo = FileInfo.from_file("tests/data/test.txt", checksums=False)
+        StorageRegistry(Database(":memory:", schema_version=3)).assign(fileinfo)
+        self.assertEqual(fileinfo.dev, os.stat("tests/data/test.txt").st_dev)
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
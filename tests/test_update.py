@@ -0,0 +1,94 @@
+# ScatterBackup - A chaotic backup solution
+# Copyright (C) 2016 Ingo Ruhnke <grumbel@gmail.com>
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import contextlib
+import io
+import os
+import tempfile
+import unittest
+
+from scatterbackup.cmd_update import UpdateAction
+from scatterbackup.database import Database
+
+
+class UpdateTestCase(unittest.TestCase):
+
+    def test_hardlinks_with_jobs(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            with open(os.path.join(tmpdir, "a"), "wb") as fout:
+                fout.write(b"Hello World")
+            for name in ["b", "c", "d"]:
+                os.link(os.path.join(tmpdir, "a"), os.path.join(tmpdir, name))
+
+            db = Database(":memory:")
+            db.init_generation("test")
+            update = UpdateAction(db)
+            update.jobs = 4
+            update.verbose = 1
+
+            out = io.StringIO()
+            with contextlib.redirect_stdout(out):
+                update.process_path(tmpdir)
+
+            # all links are scheduled before the first one is hashed,
+            # still only that one is read
+            log = out.getvalue()
+            self.assertEqual(log.count("calculating checksums"), 1)
+            self.assertEqual(log.count("recycling checksums of inode"), 3)
+            self.assertEqual(update.pending_inodes, {})
+
+            blobs = [fileinfo.blob for fileinfo in db.get_by_glob(os.path.join(tmpdir, "*"))]
+            self.assertEqual(len(blobs), 4)
+            self.assertIsNotNone(blobs[0])
+            self.assertEqual(blobs, [blobs[0]] * 4)
+
+    def test_scan_paths_without_checkpoints(self) -> None:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for name in ["a", "b"]:
+                os.mkdir(os.path.join(tmpdir, name))
+                with open(os.path.join(tmpdir, name, "test.txt"), "w") as fout:
+                    fout.write(name)
+
+            db = Database(":memory:")
+            db.init_generation("test")
+            update = UpdateAction(db)
+            update.jobs = 4
+            update.checkpoints = False
+
+            with update.hashing():
+                hashpool = update.hashpool
+                for name in ["a", "b"]:
+                    update.scan_path(os.path.join(tmpdir, name))
+                    self.assertIs(update.hashpool, hashpool)
+            self.assertIsNone(update.hashpool)
+
+            fileinfos = list(db.get_by_glob(os.path.join(tmpdir, "*", "test.txt")))
+            self.assertEqual(len(fileinfos), 2)
+            self.assertTrue(all(fileinfo.blob is not None for fileinfo in fileinfos))
+            self.assertEqual(db.con.execute("SELECT COUNT(*) FROM checkpoint").fetchall(), [(0,)])
+
+            # sb-update still records where it got to
+            update = UpdateAction(db)
+            update.process_path(tmpdir)
+            self.assertEqual(db.get_checkpoint(tmpdir), (tmpdir, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
+
+
+# EOF #
@@ -19,7 +19,7 @@
 
 import unittest
 
-from scatterbackup.util import full_join, split
+from scatterbackup.util import full_join, split, LRUCache
 
 
 class UtilTestCase(unittest.TestCase):
@@ -43,6 +43,19 @@ class UtilTestCase(unittest.TestCase):
                     (None, 7)]
         self.assertEqual(result, expected)
 
+    def test_lru_cache(self) -> None:
+        cache: LRUCache[str, int] = LRUCache(2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.put("c", 3)
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        cache.clear()
+        self.assertIsNone(cache.get("a"))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -34,6 +34,19 @@ class UtilTestCase(unittest.TestCase):
                      ['test.txt'])]
         self.assertListEqual(result, expected)
 
+    def test_walk_jobs(self) -> None:
+        for topdown in [True, False]:
+            expected = list(scatterbackup.walk("tests", topdown=topdown))
+            result = list(scatterbackup.walk("tests", topdown=topdown, jobs=4))
+            self.assertListEqual(result, expected)
+
+    def test_walk_prune(self) -> None:
+        result = []
+        for root, dirs, files in scatterbackup.walk("tests", jobs=4):
+            result.append(root)
+            dirs[:] = []
+        self.assertListEqual(result, ["tests"])
+
 
 if __name__ == '__main__':
     unittest.main()